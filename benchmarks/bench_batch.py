@@ -0,0 +1,94 @@
+"""
+Benchmark of batch analysis throughput against the batch concurrency
+
+Runs BatchAnalyzer over copies of the files in src/uploads with the real pipeline (parsing,
+examples, prompt building, map-reduce and summary parsing) and a stand-in for Bedrock that
+answers each model call after --latency seconds. Bedrock throttling is modelled by
+--capacity, the number of calls the stand-in serves at the same time.
+
+Run from the repository root:
+    python -m benchmarks.bench_batch [--experiments 24] [--latency 0.2] [--capacity 16]
+"""
+import argparse
+import glob
+import json
+import shutil
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+from src.services.analysis_pipeline import AnalysisPipeline
+from src.services.batch_analyzer import BatchAnalyzer
+from src.services.example_manager import ExampleManager
+from src.services.map_reduce_analyzer import MapReduceAnalyzer
+from src.services.prompt_builder import PromptBuilder
+from src.services.summary_generator import SummaryGenerator
+from src.utils.file_handler import FileHandler
+
+RESPONSE = json.dumps({
+    'summary': 'Done',
+    'key_metrics': [{'metric_name': 'OPS', 'impact range': '[+0.5%, +1.5%]', 'probability of impact >0': '98%',
+                     'annualized impact': '$1.2M', 'interpretation': 'More sales per customer'}],
+    'recommendations': []
+})
+
+
+def fake_bedrock(latency, capacity):
+    slots = threading.BoundedSemaphore(capacity)
+
+    class FakeBedrockService:
+        def __init__(self, model_id, **kwargs):
+            self.model_id = model_id
+            self.retries = 0
+
+        def prompt_token_budget(self):
+            return 100000
+
+        def call(self):
+            with slots:
+                time.sleep(latency)
+            return RESPONSE
+
+        def get_model_responses_streaming(self, prompts):
+            for _ in prompts:
+                yield self.call()
+
+        def stream_model_response(self, prompt):
+            yield self.call()
+
+    return FakeBedrockService
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', default='src/uploads/*.csv')
+    parser.add_argument('--experiments', type=int, default=24)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--capacity', type=int, default=16)
+    parser.add_argument('--concurrency', default='1,2,4,8,16,32')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        file_handler = FileHandler(upload_folder=directory)
+        paths = sorted(glob.glob(args.files))
+        experiments = [(f"experiment{i}", paths[i % len(paths)]) for i in range(args.experiments)]
+        prompt_builder = PromptBuilder()
+        summary_generator = SummaryGenerator()
+        pipeline = AnalysisPipeline(file_handler, ExampleManager(prompt_builder=prompt_builder),
+                                    MapReduceAnalyzer(prompt_builder, summary_generator), summary_generator)
+
+        print(f"{args.experiments} experiments, {args.latency}s per model call, {args.capacity} calls served at once")
+        print(f"{'concurrency':>11} {'seconds':>8} {'experiments/s':>14}")
+        with patch('src.services.analysis_pipeline.AWSBedrockService', fake_bedrock(args.latency, args.capacity)):
+            for concurrency in [int(value) for value in args.concurrency.split(',')]:
+                batch = BatchAnalyzer(pipeline, max_concurrency=concurrency).run(experiments, 'Summarize', 'model')
+                assert batch['rollup']['succeeded'] == args.experiments
+                assert batch['rollup']['key_metrics'][0]['experiments'][0]['impact range'] == '[+0.5%, +1.5%]'
+                print(f"{concurrency:>11} {batch['seconds']:>8.2f} {args.experiments / batch['seconds']:>14.1f}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
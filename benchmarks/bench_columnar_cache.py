@@ -0,0 +1,83 @@
+"""
+Benchmark of loading parsed uploads and example data from the columnar cache
+
+For each CSV file, times parsing it with FileHandler (what every request did before the
+cache), loading a pickled copy, and opening the columnar copy memory-mapped. --scale repeats
+the rows of each file to show how the load times grow with the size of an export.
+
+Run from the repository root:
+    python -m benchmarks.bench_columnar_cache [--files 'src/uploads/*.csv'] [--scale 1] [--format npy]
+"""
+import argparse
+import glob
+import os
+import pickle
+import shutil
+import statistics
+import tempfile
+import time
+import pandas as pd
+from src.utils.columnar_store import ColumnarStore
+from src.utils.file_handler import FileHandler
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', default='src/uploads/*.csv,src/examples/data/*.csv')
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--format', choices=ColumnarStore.FORMATS, default=None)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        store = ColumnarStore(os.path.join(directory, 'columnar'), args.format)
+        file_handler = FileHandler(upload_folder=directory)
+        print(f"Columnar format: {store.format}")
+        print(f"{'file':<40} {'rows':>7} {'MB':>6} {'csv ms':>8} {'pickle ms':>10} {'columnar ms':>12} {'speedup':>8}")
+        paths = sorted(path for pattern in args.files.split(',') for path in glob.glob(pattern))
+        for number, path in enumerate(paths):
+            csv_path = path
+            if args.scale > 1:
+                csv_path = os.path.join(directory, f"scaled{number}.csv")
+                pd.concat([pd.read_csv(path)] * args.scale, ignore_index=True).to_csv(csv_path, index=False)
+
+            def parse():
+                with open(csv_path, 'rb') as f:
+                    return file_handler._read_csv_chunks(f)
+
+            df = parse()
+            key = f"file{number}"
+            if not store.write(key, df):
+                print(f"{os.path.basename(path)[:40]:<40} not supported by the columnar format")
+                continue
+            pd.testing.assert_frame_equal(store.read(key), df)
+            pickle_path = os.path.join(directory, f"{key}.pkl")
+            with open(pickle_path, 'wb') as f:
+                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            def load_pickle():
+                with open(pickle_path, 'rb') as f:
+                    return pickle.load(f)
+
+            csv_ms = median_ms(parse, args.repeat)
+            pickle_ms = median_ms(load_pickle, args.repeat)
+            columnar_ms = median_ms(lambda: store.read(key), args.repeat)
+            size = os.path.getsize(csv_path) / 1024 / 1024
+            print(f"{os.path.basename(path)[:40]:<40} {len(df):>7} {size:>6.2f} {csv_ms:>8.2f} {pickle_ms:>10.2f} "
+                  f"{columnar_ms:>12.2f} {csv_ms / columnar_ms:>7.1f}x")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
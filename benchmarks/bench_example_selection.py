@@ -0,0 +1,103 @@
+"""
+Benchmark of few-shot example selection with thousands of curated examples
+
+Writes a temporary examples directory, loads it into ExampleManager and times
+select_examples against the previous implementation, which scored every example and
+read the chosen examples' CSV and JSON files on each request. With --retrieval vector the
+TF-IDF vector search is timed instead of the metric index.
+
+Run from the repository root:
+    python -m benchmarks.bench_example_selection [--examples 2000] [--queries 200] [--retrieval vector]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import pandas as pd
+from src.services.example_manager import ExampleManager
+
+METRICS = [f"metric_{i}" for i in range(300)]
+
+
+def write_examples(directory, count, rng):
+    os.makedirs(os.path.join(directory, 'data'))
+    os.makedirs(os.path.join(directory, 'analyses'))
+    examples = []
+    for i in range(count):
+        metrics = rng.sample(METRICS, rng.randint(2, 8))
+        examples.append({'id': f'example{i}', 'name': f'Example {i}', 'data_file': f'example{i}.csv',
+                         'analysis_file': f'example{i}.json', 'metrics': metrics})
+        with open(os.path.join(directory, 'data', f'example{i}.csv'), 'w') as f:
+            f.write("metric,control,treatment,difference,p_value\n")
+            for metric in metrics:
+                f.write(f"{metric},0.12,0.15,0.03,0.04\n")
+        with open(os.path.join(directory, 'analyses', f'example{i}.json'), 'w') as f:
+            json.dump({'summary': f'Summary {i}', 'key_metrics': [], 'recommendations': []}, f)
+    with open(os.path.join(directory, 'metadata.json'), 'w') as f:
+        json.dump({'examples': examples}, f)
+
+
+def legacy_select_examples(manager, data_df, max_examples=2):
+    """The selection ExampleIndex replaced: score every example, then read the winners from disk"""
+    input_metrics = set(data_df['metric'].unique())
+    scored = []
+    for example in manager.examples:
+        example_metrics = set(example.get('metrics', []))
+        union = len(input_metrics | example_metrics)
+        scored.append((example, len(input_metrics & example_metrics) / union if union else 0))
+    scored.sort(key=lambda item: item[1], reverse=True)
+    selected = []
+    for example, score in scored[:max_examples]:
+        example = next(e for e in manager.examples if e['id'] == example['id'])
+        data = pd.read_csv(os.path.join(manager.data_dir, example['data_file']))
+        with open(os.path.join(manager.analyses_dir, example['analysis_file'])) as f:
+            analysis = json.load(f)
+        selected.append({'metadata': example, 'data': data, 'analysis': analysis, 'relevance_score': score})
+    return selected
+
+
+def median_ms(func, inputs):
+    timings = []
+    for data_df in inputs:
+        start = time.perf_counter()
+        func(data_df)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--examples', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--retrieval', choices=ExampleManager.RETRIEVAL_MODES, default='jaccard')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    directory = tempfile.mkdtemp()
+    try:
+        write_examples(directory, args.examples, rng)
+        start = time.perf_counter()
+        manager = ExampleManager(examples_dir=directory, retrieval=args.retrieval)
+        print(f"Loaded {args.examples} examples in {time.perf_counter() - start:.2f}s")
+
+        inputs = [pd.DataFrame({'metric': rng.sample(METRICS, rng.randint(3, 30))}) for _ in range(args.queries)]
+        # Vector retrieval ranks differently by design; only the metric index must match
+        for data_df in inputs[:20] if args.retrieval == 'jaccard' else []:
+            expected = [e['metadata']['id'] for e in legacy_select_examples(manager, data_df)]
+            assert [e['metadata']['id'] for e in manager.select_examples(data_df)] == expected
+
+        before = median_ms(lambda df: legacy_select_examples(manager, df), inputs)
+        after = median_ms(manager.select_examples, inputs)
+        print(f"{'implementation':<16} {'median ms':>10}")
+        print(f"{'before':<16} {before:>10.3f}")
+        print(f"{'after':<16} {after:>10.3f}  ({before / after:.0f}x faster)")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark of field description lookup with a large descriptions dictionary
+
+Builds a dictionary of exact names, 'prefix_*' keys and a few patterns, then times
+DescriptionIndex.lookup for uploads with many columns and metrics against the previous
+lookup, which tested each column and metric against the dictionary one at a time and only
+found exact names.
+
+Run from the repository root:
+    python -m benchmarks.bench_field_descriptions [--entries 50000] [--metrics 5000]
+"""
+import argparse
+from collections import Counter
+import random
+import statistics
+import time
+import pandas as pd
+from src.utils.description_index import DescriptionIndex
+
+
+def build_descriptions(count, rng):
+    descriptions = {}
+    for i in range(count):
+        descriptions[f"metric_{i}_value"] = f"Value of metric {i}"
+    for i in range(count // 20):
+        descriptions[f"family_{i}_*"] = f"Metrics of family {i}"
+    descriptions['overall_*'] = 'Overall treatment effect'
+    descriptions['indicator_*'] = 'Indicator flag'
+    descriptions['segment_*_share'] = 'Share of the segment'
+    return descriptions
+
+
+def build_upload(entries, metrics, rng):
+    names = []
+    for _ in range(metrics):
+        kind = rng.random()
+        if kind < 0.4:
+            names.append(f"metric_{rng.randrange(entries)}_value")
+        elif kind < 0.6:
+            names.append(f"Metric {rng.randrange(entries)} Value")
+        elif kind < 0.8:
+            names.append(f"family_{rng.randrange(entries // 20)}_conversion_{rng.randrange(100)}")
+        else:
+            names.append(f"unknown_metric_{rng.randrange(10 ** 6)}")
+    columns = ['metric_name', 'overall_percent_impact', 'overall_p_value', 'indicator_positive',
+               'segment_mobile_share'] + [f"column_{i}" for i in range(200)]
+    return pd.DataFrame({column: [0] * metrics for column in columns}).assign(metric_name=names)
+
+
+def legacy_get_field_descriptions(field_descriptions, df):
+    """The lookup DescriptionIndex replaced: exact names only, one dictionary test per name"""
+    descriptions = {}
+    for column in df.columns:
+        if column in field_descriptions:
+            descriptions[column] = field_descriptions[column]
+    if 'metric_name' in df.columns:
+        for metric in df['metric_name'].unique():
+            if metric in field_descriptions:
+                descriptions[metric] = field_descriptions[metric]
+    return descriptions
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=50000)
+    parser.add_argument('--metrics', type=int, default=5000)
+    parser.add_argument('--max-descriptions', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    descriptions = build_descriptions(args.entries, rng)
+    start = time.perf_counter()
+    index = DescriptionIndex(descriptions)
+    print(f"Indexed {len(descriptions)} descriptions in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    df = build_upload(args.entries, args.metrics, rng)
+    names = list(df.columns) + list(df['metric_name'].unique())
+    legacy = legacy_get_field_descriptions(descriptions, df)
+    matches = index.match(names)
+    result = index.lookup(names, args.max_descriptions)
+    print(f"{len(names)} names: {len(legacy)} matched before, {len(matches)} now "
+          f"({dict(sorted(Counter(kind for _, _, kind in matches).items()))} by kind), "
+          f"{len(result)} descriptions kept")
+
+    before = median_ms(lambda: legacy_get_field_descriptions(descriptions, df), args.repeat)
+    after = median_ms(lambda: index.lookup(names, args.max_descriptions), args.repeat)
+    print(f"{'implementation':<16} {'median ms':>10} {'descriptions':>13}")
+    print(f"{'before':<16} {before:>10.3f} {len(legacy):>13}")
+    print(f"{'after':<16} {after:>10.3f} {len(result):>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Micro-benchmark for the A/B test and regression result formatters in PromptBuilder
+
+Compares the previous row-by-row implementation (DataFrame.iterrows and repeated string
+concatenation) with the current column-wise one and checks that both produce the same text.
+
+Run from the repository root:
+    python -m benchmarks.bench_prompt_formatters [--rows 5000] [--repeat 5]
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from src.services.prompt_builder import PromptBuilder
+
+
+def legacy_format_ab_test_results(df):
+    """The iterrows implementation the vectorized formatter replaced"""
+    result = "A/B Test Results:\n\n"
+    for _, row in df.iterrows():
+        metric = row.get('metric', 'Unknown Metric')
+        control = row.get('control', 'N/A')
+        treatment = row.get('treatment', 'N/A')
+        diff = row.get('difference', 'N/A')
+        p_val = row.get('p_value', 'N/A')
+        sig_stars = ''
+        if isinstance(p_val, (int, float)):
+            if p_val < 0.001:
+                sig_stars = '***'
+            elif p_val < 0.01:
+                sig_stars = '**'
+            elif p_val < 0.05:
+                sig_stars = '*'
+            p_val_str = f"{p_val:.4f}{sig_stars}"
+        else:
+            p_val_str = str(p_val)
+        result += f"Metric: {metric}\n"
+        result += f"  Control: {control}\n"
+        result += f"  Treatment: {treatment}\n"
+        result += f"  Difference: {diff}\n"
+        result += f"  P-value: {p_val_str}\n\n"
+    result += "Significance levels: * p<0.05, ** p<0.01, *** p<0.001"
+    return result
+
+
+def legacy_format_regression_results(df):
+    """The iterrows implementation the vectorized formatter replaced"""
+    result = "Regression Analysis Results:\n\n"
+    for _, row in df.iterrows():
+        var = row.get('variable', 'Unknown Variable')
+        coef = row.get('coefficient', 'N/A')
+        std_err = row.get('std_error', 'N/A')
+        t_val = row.get('t_value', 'N/A')
+        p_val = row.get('p_value', 'N/A')
+        sig_stars = ''
+        if isinstance(p_val, (int, float)):
+            if p_val < 0.001:
+                sig_stars = '***'
+            elif p_val < 0.01:
+                sig_stars = '**'
+            elif p_val < 0.05:
+                sig_stars = '*'
+            p_val_str = f"{p_val:.4f}{sig_stars}"
+        else:
+            p_val_str = str(p_val)
+        result += f"Variable: {var}\n"
+        result += f"  Coefficient: {coef}\n"
+        result += f"  Std Error: {std_err}\n"
+        result += f"  t-value: {t_val}\n"
+        result += f"  P-value: {p_val_str}\n\n"
+    result += "Significance levels: * p<0.05, ** p<0.01, *** p<0.001"
+    return result
+
+
+def make_frames(rows):
+    rng = np.random.default_rng(42)
+    ab_df = pd.DataFrame({
+        'metric': [f"metric_{i % 50}|segment_{i // 50}" for i in range(rows)],
+        'control': rng.random(rows),
+        'treatment': rng.random(rows),
+        'difference': rng.normal(scale=0.05, size=rows),
+        'p_value': rng.random(rows) / 10
+    })
+    regression_df = pd.DataFrame({
+        'variable': [f"x_{i}" for i in range(rows)],
+        'coefficient': rng.normal(size=rows),
+        'std_error': rng.random(rows),
+        't_value': rng.normal(scale=3, size=rows),
+        'p_value': rng.random(rows) / 10
+    })
+    return ab_df, regression_df
+
+
+def best_time(func, df, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(df)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    builder = PromptBuilder()
+    ab_df, regression_df = make_frames(args.rows)
+    cases = [
+        ('A/B test results', ab_df, legacy_format_ab_test_results, builder._format_ab_test_results),
+        ('Regression results', regression_df, legacy_format_regression_results, builder._format_regression_results),
+    ]
+
+    print(f"{'formatter':<20} {'rows':>7} {'before rows/s':>14} {'after rows/s':>13} {'speedup':>8}")
+    for name, df, legacy, current in cases:
+        assert legacy(df) == current(df), f"{name}: output differs from the legacy formatter"
+        before = best_time(legacy, df, args.repeat)
+        after = best_time(current, df, args.repeat)
+        print(f"{name:<20} {len(df):>7} {len(df) / before:>14,.0f} {len(df) / after:>13,.0f} {before / after:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
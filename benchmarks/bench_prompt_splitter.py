@@ -0,0 +1,91 @@
+"""
+Benchmark of the prompt splitter over uploaded experiment files
+
+Builds the analysis prompt for every CSV file, splits it for the prompt budget of a few
+models and reports the number of chunks, the largest chunk in estimated tokens, the number
+of data lines that were cut between chunks and the splitting throughput. The previous
+splitter (regex sentence boundaries and a fixed character size per model family) is
+measured alongside for comparison.
+
+Run from the repository root:
+    python -m benchmarks.bench_prompt_splitter [--files 'src/uploads/*.csv'] [--repeat 5]
+"""
+import argparse
+import glob
+import re
+import time
+from src.services.aws_bedrock import AWSBedrockService
+from src.services.model_registry import estimate_tokens
+from src.services.prompt_builder import PromptBuilder
+from src.services.prompt_splitter import PromptSplitter
+from src.utils.file_handler import FileHandler
+
+MODELS = ['meta.llama2-13b-chat-v1', 'amazon.titan-text-express-v1', 'anthropic.claude-v2']
+
+# Character chunk sizes the previous splitter used for each model family
+LEGACY_CHUNK_SIZES = {'anthropic': 1800, 'amazon.titan': 1500, 'meta.llama': 1500, 'cohere': 1500}
+
+
+def legacy_split_into_chunks(text, chunk_size):
+    """The sentence-boundary splitter PromptSplitter replaced"""
+    sentences = re.split(r'([.!?]+[\s\n]+)', text)
+    chunks = []
+    current_chunk = ""
+    for sentence in sentences:
+        if len(current_chunk) + len(sentence) <= chunk_size:
+            current_chunk += sentence
+        else:
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+            current_chunk = sentence
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+def cut_lines(prompt, chunks):
+    """Count the data lines of the prompt that no chunk contains in full"""
+    lines = {line.strip() for line in prompt.split('\n') if line.startswith(('- ', 'Metric: ', 'Variable: '))}
+    return sum(1 for line in lines if not any(line in chunk for chunk in chunks))
+
+
+def best_time(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', default='src/uploads/*.csv')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    file_handler = FileHandler('uploads')
+    builder = PromptBuilder()
+    print(f"{'file':<28} {'model':<30} {'tokens':>7} {'budget':>7} {'chunks':>7} {'max tok':>8} "
+          f"{'cut':>4} {'MB/s':>7} | {'legacy chunks':>13} {'max tok':>8} {'cut':>4} {'MB/s':>7}")
+    for path in sorted(glob.glob(args.files)):
+        prompt = builder.build_prompt("Summarize the impact on revenue", file_handler.read_csv(path))
+        prompt_tokens = estimate_tokens(prompt)
+        megabytes = len(prompt.encode('utf-8')) / 1e6
+        for model_id in MODELS:
+            budget = AWSBedrockService(model_id).prompt_token_budget()
+            seconds, chunks = best_time(lambda: PromptSplitter(budget).split(prompt), args.repeat)
+            assert all(estimate_tokens(chunk) <= budget for chunk in chunks)
+
+            chunk_size = next(size for family, size in LEGACY_CHUNK_SIZES.items() if family in model_id)
+            legacy_seconds, legacy_chunks = best_time(lambda: legacy_split_into_chunks(prompt, chunk_size),
+                                                      args.repeat)
+            name = path.rsplit('/', 1)[-1]
+            print(f"{name[:28]:<28} {model_id:<30} {prompt_tokens:>7} {budget:>7} {len(chunks):>7} "
+                  f"{max(map(estimate_tokens, chunks)):>8} {cut_lines(prompt, chunks):>4} "
+                  f"{megabytes / seconds:>7.1f} | {len(legacy_chunks):>13} {max(map(estimate_tokens, legacy_chunks)):>8} "
+                  f"{cut_lines(prompt, legacy_chunks):>4} {megabytes / legacy_seconds:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark of model calls against a throttling service, with and without the adaptive rate limit
+
+--threads threads make --calls calls in total to a stand-in for Bedrock that answers after
+--latency seconds and throttles calls above its quota of --quota calls per second. The calls are
+made once with retries only, like botocore's standard retry mode (3 attempts, no client-side
+rate), and once with the AdaptiveRateLimiter. The report shows how many calls failed, were
+throttled and retried, and the throughput of successful calls.
+
+Run from the repository root:
+    python -m benchmarks.bench_rate_limiter [--calls 300] [--threads 16] [--quota 20] [--latency 0.05]
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from src.services.rate_limiter import AdaptiveRateLimiter, ModelInvocationError
+
+
+class ThrottlingService:
+    """
+    Stand-in for a model with a quota of calls per second, enforced with a token bucket
+    """
+    def __init__(self, quota, latency):
+        self.quota = quota
+        self.latency = latency
+        self.tokens = quota
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.throttled = 0
+
+    def invoke(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.quota, self.tokens + (now - self.updated) * self.quota)
+            self.updated = now
+            allowed = self.tokens >= 1
+            if allowed:
+                self.tokens -= 1
+            else:
+                self.throttled += 1
+        if not allowed:
+            time.sleep(self.latency / 5)
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Too many requests'},
+                               'ResponseMetadata': {'HTTPStatusCode': 429}}, 'InvokeModel')
+        time.sleep(self.latency)
+        return 'response'
+
+
+def run(limiter, args):
+    service = ThrottlingService(args.quota, args.latency)
+    failed = 0
+    retries = 0
+
+    def call(_):
+        try:
+            return limiter.call('model', service.invoke)[1], False
+        except ModelInvocationError as e:
+            return e.retries, True
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        for call_retries, call_failed in executor.map(call, range(args.calls)):
+            retries += call_retries
+            failed += call_failed
+    seconds = time.perf_counter() - start
+    return {'failed': failed, 'throttled': service.throttled, 'retries': retries, 'seconds': seconds,
+            'calls/s': (args.calls - failed) / seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=300)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--quota', type=float, default=20)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    limiters = {
+        # Retries with exponential backoff and jitter, but every thread sends as fast as it can
+        'retries only': AdaptiveRateLimiter(initial_rate=1e6, max_rate=1e6, burst=1e6, decrease_factor=1,
+                                            max_retries=2, base_backoff_seconds=1),
+        'adaptive': AdaptiveRateLimiter()
+    }
+    print(f"{args.calls} calls from {args.threads} threads, quota {args.quota} calls/s, {args.latency}s per call")
+    print(f"{'limiter':>12} {'failed':>7} {'throttled':>10} {'retries':>8} {'seconds':>8} {'calls/s':>8}")
+    for name, limiter in limiters.items():
+        result = run(limiter, args)
+        print(f"{name:>12} {result['failed']:>7} {result['throttled']:>10} {result['retries']:>8} "
+              f"{result['seconds']:>8.2f} {result['calls/s']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,185 @@
-from flask import Flask, request, render_template, flash
+from flask import Flask, Response, request, render_template, flash, jsonify, url_for, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
+import json
+import time
 import traceback
-from src.services.aws_bedrock import AWSBedrockService
 from src.services.prompt_builder import PromptBuilder
 from src.services.summary_generator import SummaryGenerator
 from src.services.example_manager import ExampleManager
+from src.services.map_reduce_analyzer import MapReduceAnalyzer
+from src.services.response_cache import ResponseCache, LRUCache, SQLiteCache
+from src.services.client_pool import default_client_pool
+from src.services.rate_limiter import AdaptiveRateLimiter
+from src.services.model_catalog import ModelCatalog
+from src.services.analysis_pipeline import AnalysisPipeline
+from src.services.job_manager import JobManager
+from src.services.batch_analyzer import BatchAnalyzer
+from src.services.file_watcher import FileWatcher
 from src.utils.file_handler import FileHandler
+from src.utils.dataframe_cache import DataFrameCache
+from src.utils.retention import RetentionManager
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # For flash messages
 
+# Folder of the uploaded files, and folder holding the caches, job database and snapshots by default
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+CACHE_DIR = os.environ.get('CACHE_DIR', 'cache')
+# Maximum number of Bedrock chunk requests sent in parallel for one analysis
+BEDROCK_MAX_CONCURRENCY = int(os.environ.get('BEDROCK_MAX_CONCURRENCY', '4'))
+# Requests per second first allowed for each Bedrock model and the most it is raised to while calls
+# succeed, and how often throttled or failed calls are retried
+BEDROCK_RATE_LIMIT_INITIAL = float(os.environ.get('BEDROCK_RATE_LIMIT_INITIAL', '5'))
+BEDROCK_RATE_LIMIT_MAX = float(os.environ.get('BEDROCK_RATE_LIMIT_MAX', '50'))
+BEDROCK_MAX_RETRIES = int(os.environ.get('BEDROCK_MAX_RETRIES', '5'))
+# SQLite file shared by all workers for cached model responses (empty to keep the cache in memory only)
+BEDROCK_CACHE_PATH = os.environ.get('BEDROCK_CACHE_PATH', os.path.join(CACHE_DIR, 'bedrock_responses.sqlite3'))
+BEDROCK_CACHE_TTL_SECONDS = float(os.environ.get('BEDROCK_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+# How long the model list is served before it is refreshed in the background, and where it is persisted
+MODEL_CATALOG_TTL_SECONDS = float(os.environ.get('MODEL_CATALOG_TTL_SECONDS', '3600'))
+MODEL_CATALOG_SNAPSHOT = os.environ.get('MODEL_CATALOG_SNAPSHOT', os.path.join(CACHE_DIR, 'bedrock_models.json'))
+# Largest CSV upload accepted, in bytes and data rows
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(256 * 1024 * 1024)))
+UPLOAD_MAX_ROWS = int(os.environ.get('UPLOAD_MAX_ROWS', '500000'))
+# SQLite file holding the state of background analysis jobs, and the number of jobs each worker runs at once
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', os.path.join(CACHE_DIR, 'jobs.sqlite3'))
+JOB_MAX_WORKERS = int(os.environ.get('JOB_MAX_WORKERS', '2'))
+# How often the job event stream checks for new events, and how often it sends a keep-alive comment
+JOB_EVENT_POLL_SECONDS = float(os.environ.get('JOB_EVENT_POLL_SECONDS', '0.25'))
+JOB_EVENT_HEARTBEAT_SECONDS = 15
+# How few-shot examples are selected ('jaccard' or 'vector') and where the example vectors are persisted
+EXAMPLE_RETRIEVAL = os.environ.get('EXAMPLE_RETRIEVAL', 'jaccard')
+EXAMPLE_VECTOR_INDEX_PATH = os.environ.get('EXAMPLE_VECTOR_INDEX_PATH',
+                                           os.path.join(CACHE_DIR, 'example_vectors.npz'))
+# Where the example data is kept in a columnar format after it is first parsed
+EXAMPLE_DATA_CACHE_DIR = os.environ.get('EXAMPLE_DATA_CACHE_DIR', os.path.join(CACHE_DIR, 'examples'))
+# How often the example and field description files are checked for changes (0 to disable reloading)
+RELOAD_INTERVAL_SECONDS = float(os.environ.get('RELOAD_INTERVAL_SECONDS', '2'))
+# Where parsed uploads are cached, keyed by the hash of the file, and how many are kept in memory
+PARSED_CACHE_DIR = os.environ.get('PARSED_CACHE_DIR', os.path.join(CACHE_DIR, 'parsed'))
+PARSED_CACHE_MAX_ENTRIES = int(os.environ.get('PARSED_CACHE_MAX_ENTRIES', '16'))
+PARSED_CACHE_MAX_MEMORY_BYTES = int(os.environ.get('PARSED_CACHE_MAX_MEMORY_BYTES', str(512 * 1024 * 1024)))
+# How long uploads and parsed files are kept after their last use, and how much disk space they may take
+UPLOAD_RETENTION_MAX_AGE_SECONDS = float(os.environ.get('UPLOAD_RETENTION_MAX_AGE_SECONDS', str(30 * 24 * 3600)))
+UPLOAD_RETENTION_MAX_BYTES = int(os.environ.get('UPLOAD_RETENTION_MAX_BYTES', str(10 * 1024 ** 3)))
+PARSED_CACHE_MAX_BYTES = int(os.environ.get('PARSED_CACHE_MAX_BYTES', str(5 * 1024 ** 3)))
+# How often the retention sweep runs (0 to disable it), and how long files in use are protected from it
+RETENTION_SWEEP_INTERVAL_SECONDS = float(os.environ.get('RETENTION_SWEEP_INTERVAL_SECONDS', '300'))
+RETENTION_GRACE_SECONDS = float(os.environ.get('RETENTION_GRACE_SECONDS', '3600'))
+# Number of experiments of a batch analyzed at the same time, and largest number of files in a batch
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', '4'))
+BATCH_MAX_EXPERIMENTS = int(os.environ.get('BATCH_MAX_EXPERIMENTS', '100'))
+# Largest number of field descriptions put in a prompt
+FIELD_DESCRIPTIONS_MAX = int(os.environ.get('FIELD_DESCRIPTIONS_MAX', '50'))
+
+# Reject oversized request bodies before they are read, leaving room for the other form fields
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES + 1024 * 1024
+
 # Initialize services
-file_handler = FileHandler(upload_folder='uploads')
+dataframe_cache = DataFrameCache(directory=PARSED_CACHE_DIR or None, max_entries=PARSED_CACHE_MAX_ENTRIES,
+                                 max_memory_bytes=PARSED_CACHE_MAX_MEMORY_BYTES)
+file_handler = FileHandler(upload_folder=UPLOAD_FOLDER, max_bytes=UPLOAD_MAX_BYTES, max_rows=UPLOAD_MAX_ROWS,
+                           max_descriptions=FIELD_DESCRIPTIONS_MAX, dataframe_cache=dataframe_cache)
 prompt_builder = PromptBuilder()
 summary_generator = SummaryGenerator()
-example_manager = ExampleManager(examples_dir='src/examples')
+example_manager = ExampleManager(examples_dir='src/examples', prompt_builder=prompt_builder,
+                                 retrieval=EXAMPLE_RETRIEVAL, vector_index_path=EXAMPLE_VECTOR_INDEX_PATH or None,
+                                 data_cache_dir=EXAMPLE_DATA_CACHE_DIR or None)
+map_reduce_analyzer = MapReduceAnalyzer(prompt_builder, summary_generator)
+
+# Cache model responses in memory and, when configured, on disk for all workers
+cache_backends = [LRUCache(max_entries=512, ttl_seconds=BEDROCK_CACHE_TTL_SECONDS)]
+if BEDROCK_CACHE_PATH:
+    cache_backends.append(SQLiteCache(BEDROCK_CACHE_PATH, ttl_seconds=BEDROCK_CACHE_TTL_SECONDS))
+response_cache = ResponseCache(cache_backends)
+
+# Model calls of all analyses and batches of a worker share one rate limit per model
+rate_limiter = AdaptiveRateLimiter(initial_rate=BEDROCK_RATE_LIMIT_INITIAL, max_rate=BEDROCK_RATE_LIMIT_MAX,
+                                   max_retries=BEDROCK_MAX_RETRIES)
+
+model_catalog = ModelCatalog(ttl_seconds=MODEL_CATALOG_TTL_SECONDS, snapshot_path=MODEL_CATALOG_SNAPSHOT or None)
+
+analysis_pipeline = AnalysisPipeline(file_handler, example_manager, map_reduce_analyzer, summary_generator,
+                                     response_cache=response_cache, max_concurrency=BEDROCK_MAX_CONCURRENCY,
+                                     rate_limiter=rate_limiter)
+job_manager = JobManager(JOB_DB_PATH, max_workers=JOB_MAX_WORKERS)
+batch_analyzer = BatchAnalyzer(analysis_pipeline, max_concurrency=BATCH_MAX_CONCURRENCY)
+
+# Reload examples and field descriptions when their files change, without restarting workers
+file_watcher = FileWatcher(interval_seconds=RELOAD_INTERVAL_SECONDS)
+file_watcher.watch('examples', example_manager.watched_paths, example_manager.reload)
+file_watcher.watch('field_descriptions', lambda: [file_handler.descriptions_path],
+                   file_handler.reload_field_descriptions)
+
+# Evict uploads, parsed files and example data copies that were not used for a long time or exceed the disk budget
+retention_manager = RetentionManager(interval_seconds=RETENTION_SWEEP_INTERVAL_SECONDS,
+                                     grace_seconds=RETENTION_GRACE_SECONDS)
+retention_manager.manage('uploads', file_handler.upload_folder, FileHandler.STORED_PATH_PATTERN,
+                         max_bytes=UPLOAD_RETENTION_MAX_BYTES, max_age_seconds=UPLOAD_RETENTION_MAX_AGE_SECONDS)
+if PARSED_CACHE_DIR:
+    retention_manager.manage('parsed', PARSED_CACHE_DIR, DataFrameCache.STORED_PATH_PATTERN,
+                             max_bytes=PARSED_CACHE_MAX_BYTES, max_age_seconds=UPLOAD_RETENTION_MAX_AGE_SECONDS)
+if EXAMPLE_DATA_CACHE_DIR:
+    # Copies of example data files that have changed since are no longer read and age out
+    retention_manager.manage('examples', EXAMPLE_DATA_CACHE_DIR, ExampleManager.STORED_PATH_PATTERN,
+                             max_age_seconds=UPLOAD_RETENTION_MAX_AGE_SECONDS)
+
+@app.before_request
+def start_background_threads():
+    # Started by the first request so every forked worker polls and sweeps in its own threads
+    if app.testing:
+        return
+    file_watcher.start()
+    retention_manager.start()
+
+def remove_files(paths):
+    """
+    Remove files saved for a request that was rejected, ignoring files that are already gone
+    """
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def parse_event_id(value):
+    """
+    Parse the ID of the last event a client received, falling back to 0 (all events) for
+    a missing or malformed ID
+
+    Returns:
+        int: Sequence number of the last event received
+    """
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+def get_analysis_options(form):
+    """
+    Read the analysis options from the submitted form
+
+    Returns:
+        dict: Keyword arguments for AnalysisPipeline.run
+    """
+    model_name = form.get('model_name')
+    if not model_name:
+        raise ValueError("No model selected")
+
+    format_options = {}
+    if form.get('correlation_top_k'):
+        format_options['correlation_top_k'] = int(form['correlation_top_k'])
+    if form.get('correlation_threshold'):
+        format_options['correlation_threshold'] = float(form['correlation_threshold'])
+
+    return {
+        'instructions': form.get('instructions', ''),
+        'model_name': model_name,
+        'use_examples': form.get('use_examples', 'on') == 'on',
+        'bypass_cache': form.get('bypass_cache') == 'on',
+        'format_options': format_options
+    }
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -28,76 +193,212 @@ def index():
         try:
             # Get form data
             csv_file = request.files.get('csv_file')
-            instructions = request.form.get('instructions', '')
-            model_name = request.form.get('model_name')
-            use_examples = request.form.get('use_examples', 'on') == 'on'
             
             # Validate inputs
             if not csv_file:
                 raise ValueError("No CSV file provided")
-                
-            if not model_name:
-                raise ValueError("No model selected")
+            options = get_analysis_options(request.form)
             
-            # Process the CSV file
-            file_path = file_handler.save_file(csv_file)
-            print(f"File saved to {file_path}")
-            data_df = file_handler.read_csv(file_path)
-            file_handler.validate_csv_content(data_df)
+            # Process the CSV file, parsing it in chunks as it is saved
+            file_path, data_df = file_handler.ingest_upload(csv_file)
+            print(f"File saved to {file_path} ({len(data_df)} rows)")
             
-            # Get field descriptions
-            field_descriptions = file_handler.get_field_descriptions(data_df)
-            
-            # Get examples if enabled
-            examples = []
-            if use_examples:
-                examples = example_manager.select_examples(data_df, max_examples=2)
-                print(f"Selected {len(examples)} examples for few-shot learning")
-            
-            # Build the prompt
-            prompt = prompt_builder.build_prompt(instructions, data_df, field_descriptions, examples)
-            print(f"Prompt: {prompt}")
-            
-            # Get response from AWS Bedrock
-            bedrock_service = AWSBedrockService(model_id=model_name)
-            model_response = bedrock_service.get_model_response(prompt)
-            
-            # Generate summary
-            result = summary_generator.generate_summary(model_response)
+            result = analysis_pipeline.run(file_path, data_df=data_df, **options)
             
+        except RequestEntityTooLarge:
+            raise
         except Exception as e:
             error = str(e)
             print(f"Error: {error}")
             print(traceback.format_exc())
+    elif request.args.get('job'):
+        # Show the outcome of a background job started from the form
+        job = job_manager.get(request.args['job'])
+        if job is None:
+            error = "Analysis job not found"
+        elif job['status'] == 'failed':
+            error = job['error']
+        else:
+            result = job['result']
     
-    # Get available models for the dropdown
-    try:
-        # Use a default model ID for initialization
-        bedrock_service = AWSBedrockService(model_id="anthropic.claude-v2")
-        available_models = bedrock_service.list_available_models()
-    except Exception as e:
-        print(f"Error fetching models: {e}")
-        available_models = []
+    # Get available models for the dropdown from the cached catalog
+    available_models = model_catalog.get_models()
     
     return render_template('index.html', result=result, error=error, models=available_models)
 
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    """
+    Show a form error when the upload is larger than MAX_CONTENT_LENGTH
+    """
+    error = f"The uploaded file is larger than the limit of {UPLOAD_MAX_BYTES:,} bytes"
+    if request.path.startswith(('/jobs', '/batches')):
+        return {'error': error}, 413
+    return render_template('index.html', result=None, error=error, models=model_catalog.get_models()), 413
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Route to start an analysis in the background
+
+    Takes the same form fields as the main route, saves the upload and returns the job ID
+    right away; the file is parsed and analyzed by the job.
+    """
+    try:
+        csv_file = request.files.get('csv_file')
+        if not csv_file:
+            raise ValueError("No CSV file provided")
+        options = get_analysis_options(request.form)
+        file_path = file_handler.save_file(csv_file)
+        print(f"File saved to {file_path}")
+    except RequestEntityTooLarge:
+        raise
+    except Exception as e:
+        return {'error': str(e)}, 400
+
+    job_id = job_manager.submit(analysis_pipeline.run, file_path, **options)
+    return {
+        'job_id': job_id,
+        'status_url': url_for('get_job', job_id=job_id),
+        'events_url': url_for('stream_job_events', job_id=job_id)
+    }, 202
+
+@app.route('/batches', methods=['POST'])
+def create_batch():
+    """
+    Route to analyze many experiments with the same instructions in one background job
+
+    Takes the form fields of the main route, with any number of CSV files in 'csv_files'
+    and/or a zip archive of CSV files in 'archive'. Returns the job ID right away; the job's
+    result has the analysis of each experiment and a roll-up of all of them.
+    """
+    # Files this request added to the upload folder, removed again if the batch is rejected
+    new_files = []
+    try:
+        options = get_analysis_options(request.form)
+        csv_files = request.files.getlist('csv_files')
+        if len(csv_files) > BATCH_MAX_EXPERIMENTS:
+            raise ValueError(f"A batch can have at most {BATCH_MAX_EXPERIMENTS} experiments")
+        experiments = []
+        for csv_file in csv_files:
+            experiments.append((csv_file.filename, file_handler.save_file(csv_file, new_files)))
+        archive = request.files.get('archive')
+        if archive:
+            remaining = BATCH_MAX_EXPERIMENTS - len(experiments)
+            if remaining < 1:
+                raise ValueError(f"A batch can have at most {BATCH_MAX_EXPERIMENTS} experiments")
+            experiments.extend(file_handler.save_archive(archive, max_files=remaining, new_files=new_files))
+        if not experiments:
+            raise ValueError("No CSV files provided")
+    except RequestEntityTooLarge:
+        remove_files(new_files)
+        raise
+    except Exception as e:
+        remove_files(new_files)
+        return {'error': str(e)}, 400
+
+    # Results are keyed by experiment name in the roll-up, so repeated file names are numbered
+    seen = {}
+    for position, (name, file_path) in enumerate(experiments):
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            experiments[position] = (f"{name} ({seen[name]})", file_path)
+    print(f"Saved {len(experiments)} files for a batch analysis")
+
+    job_id = job_manager.submit(batch_analyzer.run, experiments, **options)
+    return {
+        'job_id': job_id,
+        'experiments': len(experiments),
+        'status_url': url_for('get_job', job_id=job_id),
+        'events_url': url_for('stream_job_events', job_id=job_id)
+    }, 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Route to get the status, progress and result of an analysis job
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return {'error': 'Job not found'}, 404
+    return job
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """
+    Route to stream the events of an analysis job as server-sent events
+
+    Each slice summarized by the map stage is sent as soon as it completes, followed by the
+    'summary' event and a final 'end' event with the job status. Reconnecting clients resume
+    after the Last-Event-ID they received.
+    """
+    if job_manager.get(job_id) is None:
+        return {'error': 'Job not found'}, 404
+    last_seq = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('after'))
+
+    def generate(last_seq):
+        last_sent = time.monotonic()
+        while True:
+            # Read the status before the events so nothing published in between is missed
+            job = job_manager.get(job_id)
+            for seq, event in job_manager.get_events(job_id, after=last_seq):
+                last_seq = seq
+                yield f"id: {seq}\nevent: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+                last_sent = time.monotonic()
+            if job is None or job['status'] in ('succeeded', 'failed'):
+                end = {'status': job['status'] if job else 'failed', 'error': job['error'] if job else 'Job not found'}
+                yield f"event: end\ndata: {json.dumps(end)}\n\n"
+                return
+            if time.monotonic() - last_sent > JOB_EVENT_HEARTBEAT_SECONDS:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            time.sleep(JOB_EVENT_POLL_SECONDS)
+
+    response = Response(stream_with_context(generate(last_seq)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Ask proxies such as nginx not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/models', methods=['GET'])
 def get_models():
     """
     Route to get available models
     """
-    try:
-        # Use a default model ID for initialization
-        bedrock_service = AWSBedrockService(model_id="anthropic.claude-v2")
-        models = bedrock_service.list_available_models()
-        return {'models': models}
-    except Exception as e:
-        return {'error': str(e)}, 500
+    models = model_catalog.get_models()
+    if not models and model_catalog.last_error:
+        return {'error': model_catalog.last_error}, 500
+    if model_catalog.etag is None:
+        # No model list has been loaded yet, e.g. while the first refresh is still running
+        return {'error': 'The model list is not loaded yet, please try again shortly'}, 503
+    
+    # Let browsers revalidate with If-None-Match / If-Modified-Since instead of re-downloading
+    response = jsonify({'models': models})
+    response.set_etag(model_catalog.etag)
+    response.last_modified = model_catalog.last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """
+    Route to get cache and client pool statistics
+    """
+    return {
+        'response_cache': response_cache.stats(),
+        'dataframe_cache': dataframe_cache.stats(),
+        'client_pool': default_client_pool.stats(),
+        'rate_limiter': rate_limiter.stats(),
+        'model_catalog': model_catalog.stats(),
+        'jobs': job_manager.stats(),
+        'reloads': file_watcher.stats(),
+        'retention': retention_manager.stats()
+    }
 
 if __name__ == '__main__':
     # Create uploads directory if it doesn't exist
-    if not os.path.exists('uploads'):
-        os.makedirs('uploads')
+    if not os.path.exists(UPLOAD_FOLDER):
+        os.makedirs(UPLOAD_FOLDER)
         
     # Run the Flask app
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,122 @@
+import pandas as pd
+from typing import Dict, Any, Optional, Callable
+from src.services.aws_bedrock import AWSBedrockService
+from src.services.summary_generator import IncrementalJSONParser
+
+class AnalysisPipeline:
+    """
+    The steps run to analyze one uploaded file: read and validate the CSV, select examples,
+    call the model (map-reduce for large files) and parse the final summary.
+    Used both by the synchronous form route and by background jobs.
+    """
+    def __init__(self, file_handler, example_manager, map_reduce_analyzer, summary_generator,
+                 response_cache=None, max_concurrency: int = 4, rate_limiter=None):
+        """
+        Initialize the AnalysisPipeline
+
+        Args:
+            file_handler (FileHandler): Reads and validates the uploaded CSV file
+            example_manager (ExampleManager): Selects examples for few-shot learning
+            map_reduce_analyzer (MapReduceAnalyzer): Runs the model calls for the data
+            summary_generator (SummaryGenerator): Parses the final model response
+            response_cache (ResponseCache, optional): Cache of model responses
+            max_concurrency (int): Maximum number of parallel model calls per analysis
+            rate_limiter (AdaptiveRateLimiter, optional): Rate limit of the model calls, shared by
+                all analyses; the process-wide default limiter if not given
+        """
+        self.file_handler = file_handler
+        self.example_manager = example_manager
+        self.map_reduce_analyzer = map_reduce_analyzer
+        self.summary_generator = summary_generator
+        self.response_cache = response_cache
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter
+
+    def run_streaming(self, file_path: str, instructions: str, model_name: str, use_examples: bool = True,
+                      bypass_cache: bool = False, format_options: Optional[Dict[str, Any]] = None,
+                      data_df: Optional[pd.DataFrame] = None):
+        """
+        Analyze a saved CSV file, reporting each step as it completes
+
+        The arguments are the same as for run; data_df is the already parsed and validated
+        content of the file, if the caller has it.
+
+        Yields dictionaries with a 'stage' key:
+            - 'parse': the file was read ('rows', 'columns')
+            - 'map': a slice of the data was summarized (see MapReduceAnalyzer.analyze_streaming)
+            - 'generate': text of the final response as it is written
+            - 'field': a field of the final response is complete ('key', 'value' and, for an
+              item of a list such as 'key_metrics', its 'index')
+            - 'summary': the analysis is complete ('result', 'done', 'total' and the number of
+              'retries' of throttled or failed model calls)
+        """
+        if data_df is None:
+            data_df = self.file_handler.read_csv(file_path)
+            self.file_handler.validate_csv_content(data_df)
+        yield {'stage': 'parse', 'rows': len(data_df), 'columns': len(data_df.columns)}
+
+        # Get field descriptions
+        field_descriptions = self.file_handler.get_field_descriptions(data_df)
+
+        # Get examples if enabled
+        examples = []
+        if use_examples:
+            examples = self.example_manager.select_examples(data_df, max_examples=2)
+            print(f"Selected {len(examples)} examples for few-shot learning")
+
+        # Get response from AWS Bedrock, summarizing slices of large files in parallel
+        bedrock_service = AWSBedrockService(
+            model_id=model_name,
+            max_concurrency=self.max_concurrency,
+            cache=self.response_cache,
+            refresh_cache=bypass_cache,
+            rate_limiter=self.rate_limiter
+        )
+        model_response = ""
+        parser = IncrementalJSONParser()
+        for event in self.map_reduce_analyzer.analyze_streaming(
+                bedrock_service, instructions, data_df, field_descriptions, examples, format_options):
+            if event['stage'] == 'result':
+                model_response = event['response']
+                done, total = event['done'], event['total']
+                continue
+            yield event
+            if event['stage'] == 'generate':
+                # Report each field of the final response as soon as the model has closed it
+                for field in parser.feed(event['text']):
+                    yield {'stage': 'field', **field, 'done': event['done'], 'total': event['total']}
+
+        # Generate summary
+        result = self.summary_generator.generate_summary(model_response)
+        yield {'stage': 'summary', 'result': result, 'done': done, 'total': total,
+               'retries': bedrock_service.retries}
+
+    def run(self, file_path: str, instructions: str, model_name: str, use_examples: bool = True,
+            bypass_cache: bool = False, format_options: Optional[Dict[str, Any]] = None,
+            data_df: Optional[pd.DataFrame] = None,
+            progress: Optional[Callable[[int, int, str], None]] = None) -> Dict[str, Any]:
+        """
+        Analyze a saved CSV file and return the summary
+
+        Args:
+            file_path (str): Path to the uploaded CSV file
+            instructions (str): User instructions for interpreting the data
+            model_name (str): ID of the Bedrock model to use
+            use_examples (bool): Include examples for few-shot learning
+            bypass_cache (bool): Ignore cached model responses
+            format_options (dict, optional): Per-request options passed on to the PromptBuilder
+            data_df (pd.DataFrame, optional): Parsed content of the file, read from file_path if not given
+            progress (callable, optional): Called with (done, total, stage, event) for every
+                event of run_streaming
+
+        Returns:
+            Dict[str, Any]: The structured summary from SummaryGenerator.generate_summary
+        """
+        result = None
+        for event in self.run_streaming(file_path, instructions, model_name, use_examples,
+                                        bypass_cache, format_options, data_df):
+            if progress:
+                progress(event.get('done', 0), event.get('total', 0), event['stage'], event)
+            if event['stage'] == 'summary':
+                result = event['result']
+        return result
@@ -1,8 +1,13 @@
 from botocore.exceptions import BotoCoreError, ClientError
-import boto3
 import json
-from typing import List
-import re
+from typing import List, Optional, Dict, Any
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.services.client_pool import default_client_pool
+from src.services.rate_limiter import default_rate_limiter, ModelInvocationError
+from src.services.bedrock_stream import get_stream_decoder
+from src.services.model_registry import get_model_capabilities, estimate_tokens, estimate_cost
 
 class AWSBedrockService:
     '''
@@ -86,160 +91,307 @@ class AWSBedrockService:
             print(f"An error occurred: {e}")
             return f"Error: {str(e)}"
     '''
-    def __init__(self, model_id, region_name='us-west-2'):
+    # Longest response requested from any model, as in every request body before the model
+    # registry; capped further by the model's own limit
+    MAX_OUTPUT_TOKENS = 2048
+    # Tokens reserved for the template a model family wraps around the prompt (e.g. Human:/Assistant:)
+    PROMPT_OVERHEAD_TOKENS = 64
+
+    def __init__(self, model_id, region_name='us-west-2', max_concurrency=4, cache=None, refresh_cache=False,
+                 client_pool=None, rate_limiter=None):
         self.model_id = model_id
         self.region_name = region_name
-        self.client = boto3.client('bedrock-runtime', region_name=self.region_name)
-        # Define model-specific chunk sizes
-        self.chunk_sizes = {
-            'anthropic': 1800,
-            'amazon.titan': 1500,
-            'meta.llama': 1500,
-            'cohere': 1500,
-            'default': 1000
-        }
-
-    def _get_chunk_size(self) -> int:
-        """Get the appropriate chunk size based on the model"""
-        for model_type, size in self.chunk_sizes.items():
-            if model_type in self.model_id.lower():
-                return size
-        return self.chunk_sizes['default']
-
-    def _split_into_chunks(self, text: str, chunk_size: int) -> List[str]:
+        # Clients are shared by all service instances in the process
+        self.client_pool = client_pool or default_client_pool
+        self.client = self.client_pool.get_client('bedrock-runtime', self.region_name)
+        # Rate limit shared by all service instances calling the same model, which also
+        # retries throttled calls
+        self.rate_limiter = rate_limiter or default_rate_limiter
+        # Number of retries of all calls made by this instance
+        self.retries = 0
+        self._retries_lock = threading.Lock()
+        # Optional ResponseCache shared between requests; refresh_cache skips cached
+        # responses but still stores the newly generated ones
+        self.cache = cache
+        self.refresh_cache = refresh_cache
+        # Maximum number of chunk requests in flight at once (1 = serial)
+        self.max_concurrency = max(1, int(max_concurrency))
+        # Per-chunk latency of the most recent dispatch, in original chunk order
+        self.chunk_timings = []
+        # Context window, response length and price of the model
+        self.capabilities = get_model_capabilities(model_id)
+        self.max_output_tokens = min(self.MAX_OUTPUT_TOKENS, self.capabilities['max_output_tokens'])
+
+    def prompt_token_budget(self) -> int:
+        """Get the number of prompt tokens that fit in the context window next to the response"""
+        return max(1, self.capabilities['context_window'] - self.max_output_tokens - self.PROMPT_OVERHEAD_TOKENS)
+
+    def fits_in_context(self, prompt: str) -> bool:
+        """Check whether a prompt can be sent to the model in a single call"""
+        return estimate_tokens(prompt) <= self.prompt_token_budget()
+
+    def _check_prompt_size(self, prompt: str):
         """
-        Split text into chunks intelligently at sentence boundaries
+        Reject a prompt that does not fit in the model's context next to the response
+
+        Prompts are never split here: MapReduceAnalyzer sizes every prompt it sends to
+        prompt_token_budget, dividing large inputs with the PromptSplitter when needed.
+
+        Raises:
+            ValueError: If the prompt is over the budget
         """
-        # Split text into sentences
-        sentences = re.split('([.!?]+[\s\n]+)', text)
-        chunks = []
-        current_chunk = ""
-
-        for sentence in sentences:
-            if len(current_chunk) + len(sentence) <= chunk_size:
-                current_chunk += sentence
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence
+        budget = self.prompt_token_budget()
+        prompt_tokens = estimate_tokens(prompt)
+        print(f"Prompt is ~{prompt_tokens} tokens (budget {budget}, estimated cost "
+              f"${estimate_cost(self.model_id, prompt_tokens, self.max_output_tokens):.4f})")
+        if prompt_tokens > budget:
+            raise ValueError(f"Prompt of ~{prompt_tokens} tokens does not fit in the {budget} token "
+                             f"prompt budget of {self.model_id}")
 
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+    def _build_request_body(self, chunk: str, stream: bool = False) -> str:
+        """Build the JSON request body for the model family, optionally for the response-stream API"""
+        if "anthropic" in self.model_id.lower():
+            return json.dumps({
+                "prompt": f"\n\nHuman: {chunk}\n\nAssistant:",
+                "max_tokens_to_sample": self.max_output_tokens,
+                "temperature": 0.7,
+                "top_p": 0.9,
+            })
+        elif "amazon.titan" in self.model_id.lower():
+            return json.dumps({
+                "inputText": chunk,
+                "textGenerationConfig": {
+                    "maxTokenCount": self.max_output_tokens,
+                    "temperature": 0.7,
+                    "topP": 0.9,
+                }
+            })
+        elif "meta.llama" in self.model_id.lower():
+            return json.dumps({
+                "prompt": chunk,
+                "max_gen_len": self.max_output_tokens,
+                "temperature": 0.7,
+                "top_p": 0.9,
+            })
+        elif "cohere" in self.model_id.lower():
+            body = {
+                "prompt": chunk,
+                "max_tokens": self.max_output_tokens,
+                "temperature": 0.7,
+                "p": 0.9,
+            }
+            if stream:
+                # Cohere only sends incremental events when asked to
+                body["stream"] = True
+            return json.dumps(body)
+        else:
+            return json.dumps({
+                "prompt": chunk,
+                "max_tokens": self.max_output_tokens,
+                "temperature": 0.7,
+                "top_p": 0.9,
+            })
+
+    def _parse_response_body(self, response_body: dict) -> str:
+        """Extract the generated text based on the model type"""
+        if "anthropic" in self.model_id.lower():
+            return response_body.get('completion', '')
+        elif "amazon.titan" in self.model_id.lower():
+            return response_body.get('results', [{}])[0].get('outputText', '')
+        elif "meta.llama" in self.model_id.lower():
+            return response_body.get('generation', '')
+        elif "cohere" in self.model_id.lower():
+            return response_body.get('text', '')
+        else:
+            return str(response_body)
 
-        return chunks
+    def _count_retries(self, retries: int):
+        if retries:
+            with self._retries_lock:
+                self.retries += retries
 
-    def _process_chunk(self, chunk: str) -> str:
-        """Process a single chunk using the model"""
+    def _process_chunk(self, chunk: str, timing: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Process a single chunk using the model, serving it from the response cache when possible
+
+        Throttled and failed calls are retried by the rate limiter; the number of retries is
+        stored in timing when given.
+
+        Raises:
+            ModelInvocationError: If the call fails, so errors never become part of the response
+        """
         print(f'Processing chunk with model {self.model_id.lower()}')
-        try:
-            if "anthropic" in self.model_id.lower():
-                body = json.dumps({
-                    "prompt": f"\n\nHuman: {chunk}\n\nAssistant:",
-                    "max_tokens_to_sample": 2048,
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                })
-            elif "amazon.titan" in self.model_id.lower():
-                body = json.dumps({
-                    "inputText": chunk,
-                    "textGenerationConfig": {
-                        "maxTokenCount": 2048,
-                        "temperature": 0.7,
-                        "topP": 0.9,
-                    }
-                })
-            elif "meta.llama" in self.model_id.lower():
-                body = json.dumps({
-                    "prompt": chunk,
-                    "max_gen_len": 2048,
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                })
-            elif "cohere" in self.model_id.lower():
-                body = json.dumps({
-                    "prompt": chunk,
-                    "max_tokens": 2048,
-                    "temperature": 0.7,
-                    "p": 0.9,
-                })
-            else:
-                body = json.dumps({
-                    "prompt": chunk,
-                    "max_tokens": 2048,
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                })
+        body = self._build_request_body(chunk)
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(self.model_id, body)
+            if not self.refresh_cache:
+                cached_response = self.cache.get(cache_key)
+                if cached_response is not None:
+                    print('Serving chunk from response cache')
+                    return cached_response
 
+        def invoke():
             response = self.client.invoke_model(
                 modelId=self.model_id,
                 body=body,
                 contentType='application/json',
                 accept='application/json'
             )
+            return json.loads(response.get('body').read())
 
-            response_body = json.loads(response.get('body').read())
+        response_body, retries = self.rate_limiter.call(self.model_id, invoke)
+        self._count_retries(retries)
+        if timing is not None:
+            timing['retries'] = retries
+        text = self._parse_response_body(response_body)
 
-            # Extract response based on model type
-            if "anthropic" in self.model_id.lower():
-                return response_body.get('completion', '')
-            elif "amazon.titan" in self.model_id.lower():
-                return response_body.get('results', [{}])[0].get('outputText', '')
-            elif "meta.llama" in self.model_id.lower():
-                return response_body.get('generation', '')
-            elif "cohere" in self.model_id.lower():
-                return response_body.get('text', '')
-            else:
-                return str(response_body)
+        if cache_key is not None:
+            self.cache.set(cache_key, text)
+        return text
+
+    def _stream_chunk(self, chunk: str):
+        """
+        Process a single chunk with the response-stream API and yield the generated text as it
+        arrives. Cached responses are yielded in one piece, and complete responses are cached.
+        """
+        print(f'Streaming chunk with model {self.model_id.lower()}')
+        self._check_prompt_size(chunk)
+        # The cache is keyed on the regular request body so streamed and regular calls share entries
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(self.model_id, self._build_request_body(chunk))
+            if not self.refresh_cache:
+                cached_response = self.cache.get(cache_key)
+                if cached_response is not None:
+                    print('Serving chunk from response cache')
+                    yield cached_response
+                    return
 
+        body = self._build_request_body(chunk, stream=True)
+
+        def open_stream():
+            # Throttling is reported before the first piece of text, so the stream is only
+            # retried until it has produced text
+            response = self.client.invoke_model_with_response_stream(
+                modelId=self.model_id,
+                body=body,
+                contentType='application/json',
+                accept='application/json'
+            )
+            pieces = get_stream_decoder(self.model_id).iter_text(response.get('body'))
+            return next(pieces, None), pieces
+
+        (first, pieces), retries = self.rate_limiter.call(self.model_id, open_stream)
+        self._count_retries(retries)
+        parts = []
+        if first is not None:
+            parts.append(first)
+            yield first
+        try:
+            for text in pieces:
+                parts.append(text)
+                yield text
         except (BotoCoreError, ClientError) as e:
-            return f"Error processing chunk: {str(e)}"
+            raise ModelInvocationError(self.model_id, e, retries) from e
 
-    def get_model_response(self, prompt: str) -> str:
+        if cache_key is not None:
+            self.cache.set(cache_key, "".join(parts))
+
+    def _timed_process_chunk(self, index: int, chunk: str):
+        """Process a single chunk and measure how long the model call took"""
+        start = time.perf_counter()
+        timing = {'chunk': index, 'chars': len(chunk), 'estimated_tokens': estimate_tokens(chunk), 'retries': 0}
+        response = self._process_chunk(chunk, timing)
+        timing['latency_seconds'] = time.perf_counter() - start
+        return response, timing
+
+    def _dispatch_chunks(self, chunks: List[str]):
         """
-        Process the input prompt by breaking it into chunks and combining the responses
+        Process chunks with up to max_concurrency requests in flight and yield
+        the responses in the original chunk order
         """
-        try:
-            print('Get appropriate chunk size for the model')
-            chunk_size = self._get_chunk_size()
-
-            # Split the prompt into chunks
-            chunks = self._split_into_chunks(prompt, chunk_size)
-
-            # Process each chunk and collect responses
-            responses = []
-            for i, chunk in enumerate(chunks):
-                # Add context for continuation chunks
-                if i > 0:
-                    chunk = f"Continuing from previous part: {chunk}"
-                
-                response = self._process_chunk(chunk)
-                responses.append(response)
+        self.chunk_timings = []
+        if not chunks:
+            return
+        for chunk in chunks:
+            self._check_prompt_size(chunk)
 
-            # Combine responses
-            combined_response = " ".join(responses)
-            
-            return combined_response
+        workers = min(self.max_concurrency, len(chunks))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self._timed_process_chunk, i, chunk)
+                for i, chunk in enumerate(chunks)
+            ]
+            try:
+                for future in futures:
+                    response, timing = future.result()
+                    self.chunk_timings.append(timing)
+                    print(f"Chunk {timing['chunk'] + 1}/{len(chunks)} completed in "
+                          f"{timing['latency_seconds']:.2f}s ({timing['chars']} chars, "
+                          f"{timing['retries']} retries)")
+                    yield response
+            finally:
+                # Don't start chunks nobody is waiting for any more
+                for future in futures:
+                    future.cancel()
 
-        except Exception as e:
-            return f"Error: {str(e)}"
+    def get_model_response(self, prompt: str) -> str:
+        """
+        Send a prompt to the model in a single call and return the response
+
+        Raises:
+            ValueError: If the prompt does not fit in the model's context
+            ModelInvocationError: If the call fails, rather than returning the error as the response
+        """
+        start = time.perf_counter()
+        response = list(self._dispatch_chunks([prompt]))[0]
+        print(f"Processed prompt in {time.perf_counter() - start:.2f}s")
+        return response
 
     def get_model_response_streaming(self, prompt: str):
         """
-        Generator function to stream responses chunk by chunk
+        Generator version of get_model_response that yields the complete response
         """
-        try:
-            chunk_size = self._get_chunk_size()
-            chunks = self._split_into_chunks(prompt, chunk_size)
+        yield from self._dispatch_chunks([prompt])
 
-            for i, chunk in enumerate(chunks):
-                if i > 0:
-                    chunk = f"Continuing from previous part: {chunk}"
-                
-                response = self._process_chunk(chunk)
-                yield response
+    def stream_model_response(self, prompt: str):
+        """
+        Generator that yields the model's response to a prompt token by token, as it is generated.
+        Like get_model_responses the prompt is sent in a single call.
 
-        except Exception as e:
-            yield f"Error: {str(e)}"
+        Args:
+            prompt (str): Complete prompt to send to the model
+
+        Yields:
+            str: Pieces of generated text; joined they form the complete response
+
+        Raises:
+            ModelInvocationError: If the call fails, also after part of the text was yielded
+        """
+        yield from self._stream_chunk(prompt)
+
+    def get_model_responses(self, prompts: List[str]) -> List[str]:
+        """
+        Send several independent prompts to the model concurrently.
+        Each prompt must fit in the model's context (see prompt_token_budget).
+
+        Args:
+            prompts (List[str]): Complete prompts to send to the model
+
+        Returns:
+            List[str]: The model responses in the same order as the prompts
+        """
+        return list(self._dispatch_chunks(prompts))
+
+    def get_model_responses_streaming(self, prompts: List[str]):
+        """
+        Generator version of get_model_responses that yields each response,
+        in prompt order, as soon as it is available
+        """
+        for response in self._dispatch_chunks(prompts):
+            yield response
 
 
     def list_available_models(self):
@@ -248,7 +400,7 @@ class AWSBedrockService:
         """
         try:
             # Use bedrock client (not bedrock-runtime) for listing models
-            bedrock_client = boto3.client('bedrock', region_name=self.region_name)
+            bedrock_client = self.client_pool.get_client('bedrock', self.region_name)
             response = bedrock_client.list_foundation_models()
             models = []
             
@@ -0,0 +1,127 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+# Fields of a key_metrics item of OUTPUT_SCHEMA kept for each experiment in the roll-up
+METRIC_FIELDS = ('impact range', 'probability of impact >0', 'annualized impact', 'interpretation')
+
+class BatchAnalyzer:
+    """
+    Analyzes many experiments with the same instructions and model
+
+    Each experiment goes through the same AnalysisPipeline as a single upload, so the batch
+    shares its Bedrock client pool, response cache, parsed file cache and examples. Up to
+    max_concurrency experiments are analyzed at a time; a failed experiment is reported in
+    the results without stopping the others.
+    """
+    def __init__(self, analysis_pipeline, max_concurrency: int = 4):
+        """
+        Initialize the BatchAnalyzer
+
+        Args:
+            analysis_pipeline (AnalysisPipeline): Runs the analysis of one experiment
+            max_concurrency (int): Maximum number of experiments analyzed at the same time
+        """
+        self.analysis_pipeline = analysis_pipeline
+        self.max_concurrency = max(1, int(max_concurrency))
+
+    def run(self, experiments: List[Tuple[str, str]], instructions: str, model_name: str,
+            use_examples: bool = True, bypass_cache: bool = False,
+            format_options: Optional[Dict[str, Any]] = None,
+            progress: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+        """
+        Analyze every experiment and roll up the results
+
+        Args:
+            experiments (List[Tuple[str, str]]): (name, saved CSV file path) of each experiment
+            instructions (str): User instructions shared by all experiments
+            model_name (str): ID of the Bedrock model to use
+            use_examples (bool): Include examples for few-shot learning
+            bypass_cache (bool): Ignore cached model responses
+            format_options (dict, optional): Per-request options passed on to the PromptBuilder
+            progress (callable, optional): Called with (done, total, 'experiment', event) as each
+                experiment completes; the event has the experiment's 'name', 'status' and 'error'
+
+        Returns:
+            Dict[str, Any]: 'experiments', one entry per experiment in input order with its
+            'name', 'status' ('succeeded' or 'failed'), 'result' or 'error' and 'seconds', the
+            'rollup' of all results (see rollup), and the total 'seconds'
+        """
+        start = time.perf_counter()
+        total = len(experiments)
+        results = [None] * total
+        workers = min(self.max_concurrency, max(total, 1))
+        print(f"Analyzing {total} experiments with concurrency {workers}")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self._analyze, file_path, instructions, model_name, use_examples,
+                                bypass_cache, format_options): position
+                for position, (_, file_path) in enumerate(experiments)
+            }
+            done = 0
+            for future in as_completed(futures):
+                position = futures[future]
+                name = experiments[position][0]
+                results[position] = {'name': name, **future.result()}
+                done += 1
+                if progress:
+                    event = {'stage': 'experiment', 'name': name, 'status': results[position]['status'],
+                             'error': results[position].get('error'), 'done': done, 'total': total}
+                    progress(done, total, 'experiment', event)
+
+        seconds = time.perf_counter() - start
+        print(f"Analyzed {total} experiments in {seconds:.2f}s")
+        return {'experiments': results, 'rollup': self.rollup(results), 'seconds': round(seconds, 3)}
+
+    def _analyze(self, file_path: str, instructions: str, model_name: str, use_examples: bool,
+                 bypass_cache: bool, format_options: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Analyze one experiment, catching its errors
+        """
+        start = time.perf_counter()
+        try:
+            result = self.analysis_pipeline.run(file_path, instructions, model_name, use_examples,
+                                                bypass_cache, format_options)
+            outcome = {'status': 'succeeded', 'result': result}
+        except Exception as e:
+            print(f"Error analyzing {file_path}: {str(e)}")
+            outcome = {'status': 'failed', 'error': str(e)}
+        outcome['seconds'] = round(time.perf_counter() - start, 3)
+        return outcome
+
+    @staticmethod
+    def rollup(experiments: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Combine the results of the experiments into an overview, without another model call
+
+        Args:
+            experiments (List[Dict[str, Any]]): The 'experiments' entries of run
+
+        Returns:
+            Dict[str, Any]: Counts of 'succeeded' and 'failed' experiments, the 'failures' with
+            their errors, the 'statistical_significance' stated for each experiment, the
+            'key_metrics' reported by the experiments (most widely reported first, with the
+            impact range, probability, annualized impact and interpretation given by each
+            experiment) and the 'recommendations' of each experiment
+        """
+        succeeded = [e for e in experiments if e['status'] == 'succeeded']
+        metrics = OrderedDict()
+        for experiment in succeeded:
+            for metric in experiment['result'].get('key_metrics') or []:
+                if not isinstance(metric, dict) or not metric.get('metric_name'):
+                    continue
+                entry = metrics.setdefault(metric['metric_name'], {'metric_name': metric['metric_name'],
+                                                                   'experiments': []})
+                entry['experiments'].append({'name': experiment['name'],
+                                             **{field: metric.get(field) for field in METRIC_FIELDS}})
+        return {
+            'experiments': len(experiments),
+            'succeeded': len(succeeded),
+            'failed': len(experiments) - len(succeeded),
+            'failures': [{'name': e['name'], 'error': e['error']} for e in experiments if e['status'] != 'succeeded'],
+            'statistical_significance': {e['name']: e['result'].get('statistical_significance') for e in succeeded},
+            'key_metrics': sorted(metrics.values(), key=lambda entry: -len(entry['experiments'])),
+            'recommendations': [{'name': e['name'], 'recommendations': e['result'].get('recommendations', [])}
+                                for e in succeeded]
+        }
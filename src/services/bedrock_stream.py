@@ -0,0 +1,108 @@
+import json
+from botocore.exceptions import ClientError
+from typing import Dict, Any, Iterable, Iterator
+
+class StreamDecoder:
+    """
+    Incremental decoder for the events of invoke_model_with_response_stream
+
+    Every 'chunk' event carries a JSON payload in the model family's own format with the
+    text generated since the previous event. Subclasses name the field holding that text
+    and how the final event is marked.
+    """
+    text_field = 'completion'
+
+    def decode(self, payload: Dict[str, Any]) -> str:
+        """
+        Get the newly generated text from one event payload
+        """
+        return payload.get(self.text_field) or ''
+
+    def is_final(self, payload: Dict[str, Any]) -> bool:
+        """
+        Check whether the payload is the last one of the stream
+        """
+        return payload.get('stop_reason') is not None
+
+    def iter_text(self, event_stream: Iterable[Dict[str, Any]]) -> Iterator[str]:
+        """
+        Yield the generated text of each event as it arrives
+
+        Args:
+            event_stream: The 'body' of an invoke_model_with_response_stream response
+
+        Raises:
+            ClientError: If the stream reports an error (throttling, model timeout, ...)
+        """
+        for event in event_stream:
+            if 'chunk' not in event:
+                # Errors are delivered as events keyed by the exception name
+                name, details = next(iter(event.items()))
+                raise ClientError({'Error': {'Code': name, 'Message': details.get('message', '')}},
+                                  'InvokeModelWithResponseStream')
+            payload = json.loads(event['chunk']['bytes'])
+            text = self.decode(payload)
+            if text:
+                yield text
+            if self.is_final(payload):
+                return
+
+
+class AnthropicStreamDecoder(StreamDecoder):
+    text_field = 'completion'
+
+
+class TitanStreamDecoder(StreamDecoder):
+    text_field = 'outputText'
+
+    def is_final(self, payload: Dict[str, Any]) -> bool:
+        return payload.get('completionReason') is not None
+
+
+class LlamaStreamDecoder(StreamDecoder):
+    text_field = 'generation'
+
+
+class CohereStreamDecoder(StreamDecoder):
+    text_field = 'text'
+
+    def decode(self, payload: Dict[str, Any]) -> str:
+        # The final event repeats the whole response, so only the incremental events are used
+        if payload.get('is_finished'):
+            return ''
+        if 'generations' in payload:
+            return ''.join(generation.get('text', '') for generation in payload['generations'])
+        return payload.get('text') or ''
+
+    def is_final(self, payload: Dict[str, Any]) -> bool:
+        return bool(payload.get('is_finished'))
+
+
+class DefaultStreamDecoder(StreamDecoder):
+    def decode(self, payload: Dict[str, Any]) -> str:
+        for field in ('completion', 'outputText', 'generation', 'text'):
+            if payload.get(field):
+                return payload[field]
+        return ''
+
+
+def get_stream_decoder(model_id: str) -> StreamDecoder:
+    """
+    Get the stream decoder for a model
+
+    Args:
+        model_id (str): Bedrock model ID
+
+    Returns:
+        StreamDecoder: Decoder for the model family's event format
+    """
+    model_id = model_id.lower()
+    if "anthropic" in model_id:
+        return AnthropicStreamDecoder()
+    elif "amazon.titan" in model_id:
+        return TitanStreamDecoder()
+    elif "meta.llama" in model_id:
+        return LlamaStreamDecoder()
+    elif "cohere" in model_id:
+        return CohereStreamDecoder()
+    return DefaultStreamDecoder()
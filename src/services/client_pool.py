@@ -0,0 +1,113 @@
+import os
+import threading
+import boto3
+from botocore.config import Config
+from typing import Dict, Any, Optional
+
+class ClientPool:
+    """
+    Process-wide registry of boto3 clients keyed by (service, region)
+
+    Creating a client loads the botocore service model and resolves credentials, which is too
+    slow to repeat on every request. boto3 clients are thread-safe, so one client per service
+    and region is shared by every AWSBedrockService instance in the process. The registry is
+    emptied in forked children so each gunicorn worker creates its own clients after the fork.
+    """
+    # Model calls are retried by the AdaptiveRateLimiter, which also slows down on throttling;
+    # retrying them in botocore as well would multiply the attempts of every call
+    DEFAULT_MAX_ATTEMPTS_BY_SERVICE = {'bedrock-runtime': 1}
+
+    def __init__(self, max_pool_connections: int = 50, max_attempts: int = 3,
+                 connect_timeout: int = 10, read_timeout: int = 120,
+                 max_attempts_by_service: Optional[Dict[str, int]] = None):
+        """
+        Initialize the ClientPool
+
+        Args:
+            max_pool_connections (int): Maximum number of HTTP connections kept open per client
+            max_attempts (int): Total attempts per call made by botocore's retry handler
+            connect_timeout (int): Seconds to wait for a connection to be established
+            read_timeout (int): Seconds to wait for a response from the service
+            max_attempts_by_service (dict, optional): max_attempts of particular services,
+                by default 1 (no botocore retries) for 'bedrock-runtime'
+        """
+        self.config = Config(
+            max_pool_connections=max_pool_connections,
+            tcp_keepalive=True,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retries={'max_attempts': max_attempts, 'mode': 'standard'}
+        )
+        self.max_attempts_by_service = dict(self.DEFAULT_MAX_ATTEMPTS_BY_SERVICE if max_attempts_by_service is None
+                                            else max_attempts_by_service)
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.created = 0
+
+    def config_for(self, service_name: str) -> Config:
+        """
+        Get the client configuration of a service
+        """
+        if service_name not in self.max_attempts_by_service:
+            return self.config
+        return self.config.merge(Config(retries={'max_attempts': self.max_attempts_by_service[service_name],
+                                                 'mode': 'standard'}))
+
+    def get_client(self, service_name: str, region_name: str):
+        """
+        Get the shared client for a service and region, creating it on first use
+
+        Args:
+            service_name (str): AWS service name, e.g. 'bedrock-runtime' or 'bedrock'
+            region_name (str): AWS region of the service endpoint
+
+        Returns:
+            The boto3 client
+        """
+        key = (service_name, region_name)
+        with self._lock:
+            if self._pid != os.getpid():
+                # Clients (and their connection pools) must not be shared with the parent process
+                self._clients = {}
+                self._pid = os.getpid()
+            client = self._clients.get(key)
+            if client is None:
+                client = boto3.client(service_name, region_name=region_name, config=self.config_for(service_name))
+                self._clients[key] = client
+                self.created += 1
+            return client
+
+    def reset(self):
+        """
+        Drop all clients so they are recreated on next use
+        """
+        with self._lock:
+            self._clients = {}
+            self._pid = os.getpid()
+
+    def _reinit_after_fork(self):
+        """
+        Start the child process with an empty registry and a fresh lock, which another
+        thread of the parent may have been holding at the time of the fork
+        """
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._pid = os.getpid()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the clients currently held by the pool
+        """
+        with self._lock:
+            return {
+                'clients': sorted(f"{service}@{region}" for service, region in self._clients),
+                'created': self.created
+            }
+
+
+# Pool shared by all services in this process
+default_client_pool = ClientPool()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=default_client_pool._reinit_after_fork)
@@ -0,0 +1,162 @@
+import re
+import pandas as pd
+from typing import Dict, Any, Tuple
+
+class ColumnPruner:
+    """
+    Service for removing columns that add prompt size without adding information
+
+    Wide experiment exports carry job ids, hash keys, timestamps and columns that hold the same
+    value in every row. Columns are classified as empty, constant, identifier, duplicate, metadata,
+    count, statistic or dimension; empty, identifier and duplicate columns are dropped and constant
+    columns are collapsed into a single line before the data is formatted for the prompt.
+    """
+    # Column names that identify rows or entities rather than measure anything
+    IDENTIFIER_NAME_PATTERN = re.compile(r'(^|_)(id|ids|uuid|guid|key)$|hash', re.IGNORECASE)
+    # Values that look like UUIDs or hex digests
+    IDENTIFIER_VALUE_PATTERN = re.compile(r'^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-|[0-9a-f]{16,}$)', re.IGNORECASE)
+    # Column names describing when or how the analysis was produced
+    METADATA_NAME_PATTERN = re.compile(r'(^|_)(time|date|dates|timestamp|created|updated)($|_)|source', re.IGNORECASE)
+    # Column names holding sample sizes
+    COUNT_NAME_PATTERN = re.compile(r'(^|_)(count|n|size|sessions|customers)($|_)', re.IGNORECASE)
+
+    # Longest constant value shown in the prompt
+    MAX_VALUE_LENGTH = 80
+
+    def classify(self, df: pd.DataFrame) -> Dict[str, str]:
+        """
+        Classify every column of the DataFrame
+
+        Args:
+            df (pd.DataFrame): The DataFrame to classify
+
+        Returns:
+            Dict[str, str]: Mapping of column name to its category
+        """
+        categories, _ = self._classify(df)
+        return categories
+
+    def _classify(self, df: pd.DataFrame) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """
+        Classify every column and find columns that repeat an earlier column
+
+        Returns:
+            Tuple[Dict[str, str], Dict[str, str]]: Column categories, and a mapping of each
+            duplicate column to the column it repeats
+        """
+        unique_counts = df.nunique(dropna=False)
+        empty = df.isna().all()
+        numeric = set(df.select_dtypes(include=['number']).columns)
+
+        categories = {}
+        duplicates = {}
+        seen = {}
+        for column in df.columns:
+            name = str(column)
+            if empty[column]:
+                categories[column] = 'empty'
+                continue
+            if unique_counts[column] <= 1 and len(df) > 1:
+                categories[column] = 'constant'
+                continue
+            if self.IDENTIFIER_NAME_PATTERN.search(name) or self._has_identifier_values(df[column], column in numeric):
+                categories[column] = 'identifier'
+                continue
+
+            # Columns with identical values (e.g. base mean == sample mean) are only kept once
+            digest = pd.util.hash_pandas_object(df[column], index=False).sum()
+            original = seen.get((digest, df[column].dtype))
+            if original is not None and df[column].equals(df[original]):
+                categories[column] = 'duplicate'
+                duplicates[column] = original
+                continue
+            seen[(digest, df[column].dtype)] = column
+
+            if self.METADATA_NAME_PATTERN.search(name):
+                categories[column] = 'metadata'
+            elif column in numeric and self.COUNT_NAME_PATTERN.search(name):
+                categories[column] = 'count'
+            elif column in numeric:
+                categories[column] = 'statistic'
+            else:
+                categories[column] = 'dimension'
+        return categories, duplicates
+
+    def _has_identifier_values(self, series: pd.Series, is_numeric: bool) -> bool:
+        """
+        Check whether all values of a text column look like UUIDs or hashes
+        """
+        if is_numeric:
+            return False
+        values = series.dropna().astype(str)
+        return len(values) > 0 and bool(values.str.match(self.IDENTIFIER_VALUE_PATTERN).all())
+
+    def prune(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+        """
+        Drop empty, identifier and duplicate columns and collapse constant columns
+
+        Args:
+            df (pd.DataFrame): The DataFrame to prune
+
+        Returns:
+            Tuple[pd.DataFrame, Dict[str, Any]]: The pruned DataFrame and a report with the
+            'categories' of all columns, the 'dropped' column names by category, the
+            'constants' that were collapsed with their value and the 'duplicates' with the
+            column they repeat
+        """
+        categories, duplicates = self._classify(df)
+
+        dropped = {}
+        constants = {}
+        for column, category in categories.items():
+            if category in ('empty', 'identifier', 'constant', 'duplicate'):
+                dropped.setdefault(category, []).append(column)
+            if category == 'constant':
+                constants[column] = df[column].iloc[0]
+
+        removed = [column for columns in dropped.values() for column in columns]
+        pruned_df = df.drop(columns=removed)
+
+        report = {
+            'categories': categories,
+            'dropped': dropped,
+            'constants': constants,
+            'duplicates': duplicates,
+            'original_columns': len(df.columns),
+            'remaining_columns': len(pruned_df.columns)
+        }
+        print(f"Column pruning kept {report['remaining_columns']} of {report['original_columns']} columns "
+              + ", ".join(f"({len(columns)} {category} removed)" for category, columns in dropped.items()))
+        return pruned_df, report
+
+    def format_report(self, report: Dict[str, Any]) -> str:
+        """
+        Format the pruning report for inclusion in a prompt
+
+        Args:
+            report (Dict[str, Any]): Report returned by prune
+
+        Returns:
+            str: Lines describing the constant values and removed columns, or an empty string
+        """
+        lines = []
+        if report['constants']:
+            values = []
+            for column, value in report['constants'].items():
+                value_str = str(value)
+                if len(value_str) > self.MAX_VALUE_LENGTH:
+                    value_str = value_str[:self.MAX_VALUE_LENGTH] + '...'
+                values.append(f"{column}={value_str}")
+            lines.append("Constant fields (same value in every row): " + "; ".join(values))
+        if report['duplicates']:
+            lines.append("Columns identical to another column: "
+                         + ", ".join(f"{column}={original}" for column, original in report['duplicates'].items()))
+        identifiers = report['dropped'].get('identifier', [])
+        if identifiers:
+            lines.append(f"Removed {len(identifiers)} identifier columns: " + ", ".join(str(c) for c in identifiers))
+        empty = report['dropped'].get('empty', [])
+        if empty:
+            lines.append(f"Removed {len(empty)} columns without any values")
+        if not lines:
+            return ""
+        return "\n".join(lines) + "\n\n"
@@ -1,25 +1,150 @@
 import os
+import re
+import copy
 import json
+import hashlib
+import heapq
+import threading
+import time
 import pandas as pd
+from collections import Counter
 from typing import List, Dict, Any, Optional
 import random
+from src.services.prompt_builder import PromptBuilder
+from src.services.example_vectors import VectorIndex
+from src.utils.columnar_store import ColumnarStore
+
+class ExampleIndex:
+    """
+    Loaded examples with an inverted index from metric name to the examples measuring it
+
+    An index is never modified after it is built, so it can be shared by concurrent requests.
+    Examples are referred to by their position in the metadata file, which also breaks ties
+    between equally relevant examples.
+    """
+    def __init__(self, entries: List[Dict[str, Any]], vectors: Optional[VectorIndex] = None,
+                 examples: Optional[List[Dict[str, Any]]] = None, signatures: Optional[Dict[str, Any]] = None):
+        """
+        Build the index
+
+        Args:
+            entries (List[Dict[str, Any]]): Examples in metadata order, each with its 'metadata',
+                'data', 'analysis' and pre-rendered 'prompt_text'
+            vectors (VectorIndex, optional): TF-IDF vectors of the entries, in the same order
+            examples (List[Dict[str, Any]], optional): All example metadata, including examples
+                whose files could not be loaded
+            signatures (Dict[str, Any], optional): Metadata and file modification times each
+                entry was loaded from, by example ID
+        """
+        self.entries = entries
+        self.vectors = vectors
+        self.examples = examples if examples is not None else [entry['metadata'] for entry in entries]
+        self.signatures = signatures or {}
+        # Number of entries taken over from the previous index when reloading
+        self.reused = 0
+        self.by_id = {entry['metadata']['id']: entry for entry in entries}
+        self.metric_index: Dict[Any, List[int]] = {}
+        self.metric_counts = []
+        # Examples without metrics are relevant to any input
+        self.unscored = []
+        for position, entry in enumerate(entries):
+            metrics = set(entry['metadata'].get('metrics', []))
+            self.metric_counts.append(len(metrics))
+            if not metrics:
+                self.unscored.append(position)
+            for metric in metrics:
+                self.metric_index.setdefault(metric, []).append(position)
+
+    def rank(self, input_metrics: set, max_examples: int) -> List[tuple]:
+        """
+        Get the examples most similar to the input metrics
+
+        Scores are the Jaccard similarity between the input metrics and the example's metrics,
+        or 0.5 for examples without metrics. Only examples sharing a metric with the input are
+        scored; examples sharing none score 0 and only fill up the selection.
+
+        Args:
+            input_metrics (set): Metric names of the input data
+            max_examples (int): Maximum number of examples to return
+
+        Returns:
+            List[tuple]: (score, position) pairs, best first and in metadata order for equal scores
+        """
+        if max_examples <= 0:
+            return []
+        overlap = Counter()
+        for metric in input_metrics:
+            positions = self.metric_index.get(metric)
+            if positions:
+                overlap.update(positions)
+
+        scored = [
+            (count / (len(input_metrics) + self.metric_counts[position] - count), position)
+            for position, count in overlap.items()
+        ]
+        scored.extend((0.5, position) for position in self.unscored)
+        ranked = heapq.nsmallest(max_examples, scored, key=lambda item: (-item[0], item[1]))
+
+        if len(ranked) < max_examples:
+            chosen = {position for _, position in ranked}
+            for position in range(len(self.entries)):
+                if len(ranked) >= max_examples:
+                    break
+                if position not in chosen:
+                    ranked.append((0.0, position))
+        return ranked
 
 class ExampleManager:
     """
     Service for managing example data and analyses for few-shot learning
+
+    All examples are read and rendered for the prompt once, when the manager is created, so
+    selecting examples for a request does not touch the disk. reload() builds a new index from
+    the files, reusing unchanged examples, and replaces the current one in a single assignment,
+    so a request always sees either the old or the new set of examples.
+
+    Examples are selected by one of two retrieval modes:
+        - 'jaccard': overlap between the metric names of the input and of each example
+        - 'vector': cosine similarity of hashed TF-IDF vectors of the example's name,
+          description, tags and metrics to the input's metric names, which also matches
+          metrics named differently by different teams
     """
-    def __init__(self, examples_dir: str = 'src/examples'):
+    RETRIEVAL_MODES = ('jaccard', 'vector')
+    # Paths in the example data cache written by the manager: one entry per version of a data
+    # file, so the retention sweep removes the copies of files that have changed since
+    STORED_PATH_PATTERN = re.compile(r'^([0-9a-f]{2})/\1[0-9a-f]{38}\.(npy|feather)(\.\d+\.\d+\.tmp)?$')
+
+    def __init__(self, examples_dir: str = 'src/examples', prompt_builder: Optional[PromptBuilder] = None,
+                 retrieval: str = 'jaccard', vector_index_path: Optional[str] = None,
+                 data_cache_dir: Optional[str] = None):
         """
         Initialize the ExampleManager with the path to the examples directory
         
         Args:
             examples_dir (str): Path to the directory containing examples
+            prompt_builder (PromptBuilder, optional): Renders the examples for the prompt
+            retrieval (str): Retrieval mode, 'jaccard' or 'vector'
+            vector_index_path (str, optional): .npz file where the example vectors are kept
+                between runs, so only new or changed examples are vectorized
+            data_cache_dir (str, optional): Folder where the example data is kept in a columnar
+                format after it is first parsed, so later starts open it memory-mapped
         """
+        if retrieval not in self.RETRIEVAL_MODES:
+            raise ValueError(f"Unknown example retrieval mode: {retrieval}")
+        self.retrieval = retrieval
+        self.vector_index_path = vector_index_path
+        self.data_store = ColumnarStore(data_cache_dir) if data_cache_dir else None
         self.examples_dir = examples_dir
         self.data_dir = os.path.join(examples_dir, 'data')
         self.analyses_dir = os.path.join(examples_dir, 'analyses')
         self.metadata_path = os.path.join(examples_dir, 'metadata.json')
-        self.examples = self._load_metadata()
+        self.prompt_builder = prompt_builder or PromptBuilder()
+        self._reload_lock = threading.Lock()
+        self._index = self._build_index(self._load_metadata())
+
+    @property
+    def examples(self) -> List[Dict[str, Any]]:
+        return self._index.examples
         
     def _load_metadata(self) -> List[Dict[str, Any]]:
         """
@@ -29,16 +154,147 @@ class ExampleManager:
             List[Dict[str, Any]]: List of example metadata
         """
         try:
-            if os.path.exists(self.metadata_path):
-                with open(self.metadata_path, 'r') as f:
-                    metadata = json.load(f)
-                return metadata.get('examples', [])
-            else:
-                print(f"Warning: Example metadata file not found at {self.metadata_path}")
-                return []
+            return self._read_metadata()
         except Exception as e:
             print(f"Error loading example metadata: {str(e)}")
             return []
+
+    def _read_metadata(self) -> List[Dict[str, Any]]:
+        """
+        Read the metadata.json file, raising an exception if it cannot be parsed
+        """
+        if not os.path.exists(self.metadata_path):
+            print(f"Warning: Example metadata file not found at {self.metadata_path}")
+            return []
+        with open(self.metadata_path, 'r') as f:
+            metadata = json.load(f)
+        return metadata.get('examples', [])
+
+    def reload(self) -> Dict[str, int]:
+        """
+        Load the examples again and swap in the new index
+
+        Examples whose metadata and files did not change are reused without reading them.
+
+        Returns:
+            Dict[str, int]: Number of 'examples' in the metadata, of 'loaded' examples and of
+            examples 'reused' from the previous index
+
+        Raises:
+            Exception: If metadata.json cannot be parsed; the current examples are kept
+        """
+        with self._reload_lock:
+            index = self._build_index(self._read_metadata(), previous=self._index)
+            self._index = index
+        return {'examples': len(index.examples), 'loaded': len(index.entries), 'reused': index.reused}
+
+    def watched_paths(self) -> List[str]:
+        """
+        Get the files and directories whose changes require a reload
+        """
+        paths = [self.metadata_path, self.data_dir, self.analyses_dir]
+        for example in self._index.examples:
+            paths.append(os.path.join(self.data_dir, example.get('data_file', '')))
+            paths.append(os.path.join(self.analyses_dir, example.get('analysis_file', '')))
+        return paths
+
+    def _signature(self, example: Dict[str, Any]):
+        """
+        Get the metadata and the modification times of the files an example is loaded from
+        """
+        stats = []
+        for path in (os.path.join(self.data_dir, example.get('data_file', '')),
+                     os.path.join(self.analyses_dir, example.get('analysis_file', ''))):
+            try:
+                stat = os.stat(path)
+                stats.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stats.append(None)
+        return json.dumps(example, sort_keys=True, default=str), tuple(stats)
+
+    def _build_index(self, examples: List[Dict[str, Any]], previous: Optional[ExampleIndex] = None) -> ExampleIndex:
+        """
+        Load the data and analysis of every example and index them
+
+        Examples whose data or analysis cannot be loaded are left out of the index.
+
+        Args:
+            examples (List[Dict[str, Any]]): Example metadata
+            previous (ExampleIndex, optional): Index whose unchanged examples are reused
+
+        Returns:
+            ExampleIndex: The loaded examples
+        """
+        start = time.perf_counter()
+        entries = []
+        signatures = {}
+        reused = 0
+        for example in examples:
+            signature = self._signature(example)
+            entry = None
+            if previous is not None and previous.signatures.get(example.get('id')) == signature:
+                entry = previous.by_id.get(example['id'])
+            if entry is not None:
+                reused += 1
+            else:
+                data = self._load_example_data(example)
+                analysis = self._load_example_analysis(example)
+                if data is None or analysis is None:
+                    continue
+                entry = {'metadata': example, 'data': data, 'analysis': analysis}
+                entry['prompt_text'] = self.prompt_builder.format_example(entry)
+            entries.append(entry)
+            signatures[example['id']] = signature
+        vectors = None
+        if self.retrieval == 'vector':
+            vectors = self._build_vectors(entries, previous.vectors if previous is not None else None)
+        index = ExampleIndex(entries, vectors, examples, signatures)
+        index.reused = reused
+        print(f"Loaded {len(entries)} of {len(examples)} examples ({reused} unchanged) "
+              f"in {time.perf_counter() - start:.2f}s")
+        return index
+
+    def _build_vectors(self, entries: List[Dict[str, Any]], previous: Optional[VectorIndex] = None) -> VectorIndex:
+        """
+        Vectorize the examples, reusing the vectors of unchanged examples
+
+        Args:
+            entries (List[Dict[str, Any]]): The loaded examples
+            previous (VectorIndex, optional): Vectors of the current index, used instead of
+                the saved ones
+
+        Returns:
+            VectorIndex: Vectors of the examples in entry order
+        """
+        if previous is None and self.vector_index_path:
+            previous = VectorIndex.load(self.vector_index_path)
+        documents = [(entry['metadata']['id'], self._example_text(entry['metadata'])) for entry in entries]
+        vectors = VectorIndex.build(documents, previous=previous)
+        print(f"Vectorized {vectors.vectorized} of {len(vectors)} examples")
+        if self.vector_index_path and (previous is None or vectors.vectorized or previous.ids != vectors.ids):
+            try:
+                vectors.save(self.vector_index_path)
+            except OSError as e:
+                print(f"Error saving vector index to {self.vector_index_path}: {str(e)}")
+        return vectors
+
+    def _example_text(self, example: Dict[str, Any]) -> str:
+        """
+        Get the text an example is retrieved by: its name, description, tags and metrics
+        """
+        parts = [example.get('name', ''), example.get('description', '')]
+        parts.extend(example.get('tags', []))
+        parts.extend(example.get('metrics', []))
+        return '\n'.join(str(part) for part in parts)
+
+    def _query_text(self, data_df: pd.DataFrame) -> str:
+        """
+        Get the text examples are retrieved for: the metric names of the input data
+        """
+        for column in ('metric', 'metric_name'):
+            if column in data_df.columns:
+                return '\n'.join(str(metric) for metric in data_df[column].dropna().unique())
+        return '\n'.join(str(column) for column in data_df.columns)
             
     def get_all_examples(self) -> List[Dict[str, Any]]:
         """
@@ -59,20 +315,10 @@ class ExampleManager:
         Returns:
             Optional[pd.DataFrame]: DataFrame containing the example data, or None if not found
         """
-        example = next((e for e in self.examples if e['id'] == example_id), None)
-        if not example:
-            return None
-            
-        data_path = os.path.join(self.data_dir, example['data_file'])
-        try:
-            if os.path.exists(data_path):
-                return pd.read_csv(data_path)
-            else:
-                print(f"Warning: Example data file not found at {data_path}")
-                return None
-        except Exception as e:
-            print(f"Error loading example data: {str(e)}")
+        entry = self._index.by_id.get(example_id)
+        if entry is None:
             return None
+        return entry['data'].copy()
             
     def get_example_analysis(self, example_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -84,10 +330,54 @@ class ExampleManager:
         Returns:
             Optional[Dict[str, Any]]: Dictionary containing the example analysis, or None if not found
         """
-        example = next((e for e in self.examples if e['id'] == example_id), None)
-        if not example:
+        entry = self._index.by_id.get(example_id)
+        if entry is None:
             return None
-            
+        return copy.deepcopy(entry['analysis'])
+
+    def _load_example_data(self, example: Dict[str, Any]) -> Optional[pd.DataFrame]:
+        """
+        Read the data file of an example
+        """
+        data_path = os.path.join(self.data_dir, example['data_file'])
+        try:
+            if os.path.exists(data_path):
+                return self._read_example_csv(data_path)
+            else:
+                print(f"Warning: Example data file not found at {data_path}")
+                return None
+        except Exception as e:
+            print(f"Error loading example data: {str(e)}")
+            return None
+
+    def _read_example_csv(self, data_path: str) -> pd.DataFrame:
+        """
+        Read an example data file from the columnar cache, parsing and caching it on a miss
+        """
+        if self.data_store is None:
+            return pd.read_csv(data_path)
+        stat = os.stat(data_path)
+        # A changed file gets a new key, so an outdated copy is never read
+        key = hashlib.sha1(f"{os.path.abspath(data_path)}:{stat.st_mtime_ns}:{stat.st_size}".encode('utf-8')).hexdigest()
+        data = self.data_store.read(key)
+        if data is None:
+            data = pd.read_csv(data_path)
+            try:
+                self.data_store.write(key, data)
+            except Exception as e:
+                print(f"Error caching example data {data_path}: {str(e)}")
+        else:
+            try:
+                # Mark the copy as used for the retention sweep
+                os.utime(self.data_store.path(key))
+            except OSError:
+                pass
+        return data
+
+    def _load_example_analysis(self, example: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Read the analysis file of an example
+        """
         analysis_path = os.path.join(self.analyses_dir, example['analysis_file'])
         try:
             if os.path.exists(analysis_path):
@@ -109,47 +399,21 @@ class ExampleManager:
             max_examples (int): Maximum number of examples to select
             
         Returns:
-            List[Dict[str, Any]]: List of selected examples with their data and analyses
+            List[Dict[str, Any]]: List of selected examples with their data, analyses and
+            'prompt_text'. The data and analyses are shared and must not be modified.
         """
-        # Get the metrics in the input data
-        if 'metric' in data_df.columns:
-            input_metrics = set(data_df['metric'].unique())
+        index = self._index
+        if index.vectors is not None:
+            ranked = index.vectors.search([self._query_text(data_df)], max_examples)[0]
         else:
-            input_metrics = set(data_df.columns)
-            
-        # Score examples based on metric overlap
-        scored_examples = []
-        for example in self.examples:
-            example_metrics = set(example.get('metrics', []))
-            if not example_metrics:
-                # If no metrics specified, use all examples
-                score = 0.5
+            # Get the metrics in the input data
+            if 'metric' in data_df.columns:
+                input_metrics = set(data_df['metric'].unique())
             else:
-                # Calculate Jaccard similarity between input metrics and example metrics
-                intersection = len(input_metrics.intersection(example_metrics))
-                union = len(input_metrics.union(example_metrics))
-                score = intersection / union if union > 0 else 0
-                
-            scored_examples.append((example, score))
-            
-        # Sort examples by score (descending)
-        scored_examples.sort(key=lambda x: x[1], reverse=True)
-        
-        # Select top examples
-        selected_examples = []
-        for example, score in scored_examples[:max_examples]:
-            example_data = self.get_example_data(example['id'])
-            example_analysis = self.get_example_analysis(example['id'])
-            
-            if example_data is not None and example_analysis is not None:
-                selected_examples.append({
-                    'metadata': example,
-                    'data': example_data,
-                    'analysis': example_analysis,
-                    'relevance_score': score
-                })
-                
-        return selected_examples
+                input_metrics = set(data_df.columns)
+            ranked = index.rank(input_metrics, max_examples)
+
+        return [dict(index.entries[position], relevance_score=score) for score, position in ranked]
         
     def get_random_examples(self, max_examples: int = 2) -> List[Dict[str, Any]]:
         """
@@ -161,27 +425,15 @@ class ExampleManager:
         Returns:
             List[Dict[str, Any]]: List of randomly selected examples with their data and analyses
         """
-        if not self.examples:
+        entries = self._index.entries
+        if not entries:
             return []
             
         # Randomly select examples
-        selected_ids = random.sample([e['id'] for e in self.examples], min(max_examples, len(self.examples)))
-        
-        selected_examples = []
-        for example_id in selected_ids:
-            example = next((e for e in self.examples if e['id'] == example_id), None)
-            example_data = self.get_example_data(example_id)
-            example_analysis = self.get_example_analysis(example_id)
-            
-            if example is not None and example_data is not None and example_analysis is not None:
-                selected_examples.append({
-                    'metadata': example,
-                    'data': example_data,
-                    'analysis': example_analysis,
-                    'relevance_score': 0.5  # Default score for random selection
-                })
-                
-        return selected_examples
+        return [
+            dict(entry, relevance_score=0.5)  # Default score for random selection
+            for entry in random.sample(entries, min(max_examples, len(entries)))
+        ]
         
     def format_example_for_prompt(self, example: Dict[str, Any]) -> str:
         """
@@ -0,0 +1,213 @@
+import os
+import re
+import zlib
+import hashlib
+import numpy as np
+from typing import List, Tuple, Optional, Sequence
+
+class HashingVectorizer:
+    """
+    Maps text to fixed-size term-frequency vectors without a vocabulary
+
+    Words are split at underscores, punctuation, digits and camelCase boundaries, and each word
+    contributes itself and its character trigrams, so differently spelled metric names such as
+    'conv_rate', 'ConversionRate' and 'conversion rate' still share most of their features.
+    Features are hashed with CRC32 into n_features buckets, which is stable across processes.
+    """
+    WORD_PATTERN = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+')
+
+    def __init__(self, n_features: int = 1024, ngram: int = 3):
+        """
+        Initialize the HashingVectorizer
+
+        Args:
+            n_features (int): Length of the vectors
+            ngram (int): Length of the character n-grams taken from each word
+        """
+        self.n_features = int(n_features)
+        self.ngram = int(ngram)
+
+    def features(self, text: str) -> List[str]:
+        """
+        Get the words and character n-grams of a text
+        """
+        features = []
+        for word in self.WORD_PATTERN.findall(text):
+            word = word.lower()
+            features.append(word)
+            padded = f"#{word}#"
+            features.extend(padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1))
+        return features
+
+    def transform(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Get the sublinear term frequencies (1 + log(count)) of each text
+
+        Args:
+            texts: The texts to vectorize
+
+        Returns:
+            np.ndarray: float32 matrix with one row per text
+        """
+        counts = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets = [zlib.crc32(feature.encode('utf-8')) % self.n_features for feature in self.features(text)]
+            if buckets:
+                counts[row] = np.bincount(buckets, minlength=self.n_features)
+        nonzero = counts > 0
+        counts[nonzero] = 1 + np.log(counts[nonzero])
+        return counts
+
+
+class VectorIndex:
+    """
+    TF-IDF vectors of a set of documents with batched top-k cosine search
+
+    The term frequencies of every document are kept next to the normalized TF-IDF matrix, so
+    when documents are added or changed only those are vectorized again; the IDF weights of
+    all documents are then recomputed with a few array operations. The index can be saved to
+    and loaded from a NumPy .npz file.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, vectorizer: HashingVectorizer, ids: List[str], fingerprints: List[str],
+                 term_frequencies: np.ndarray):
+        """
+        Initialize the VectorIndex
+
+        Args:
+            vectorizer (HashingVectorizer): Vectorizer the term frequencies were computed with
+            ids (List[str]): Document IDs, one per row
+            fingerprints (List[str]): Hash of each document's text, to detect changes
+            term_frequencies (np.ndarray): Output of vectorizer.transform for the documents
+        """
+        self.vectorizer = vectorizer
+        self.ids = list(ids)
+        self.fingerprints = list(fingerprints)
+        self.term_frequencies = term_frequencies
+        self._reweight()
+
+    @staticmethod
+    def fingerprint(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def build(cls, documents: List[Tuple[str, str]], vectorizer: Optional[HashingVectorizer] = None,
+              previous: Optional['VectorIndex'] = None) -> 'VectorIndex':
+        """
+        Build an index, reusing the vectors of unchanged documents of a previous index
+
+        Args:
+            documents (List[Tuple[str, str]]): (id, text) pairs in index order
+            vectorizer (HashingVectorizer, optional): Vectorizer for new indexes
+            previous (VectorIndex, optional): Index built from an earlier version of the documents
+
+        Returns:
+            VectorIndex: The new index; its 'vectorized' attribute is the number of documents
+            that had to be vectorized
+        """
+        if previous is not None:
+            vectorizer = previous.vectorizer
+        vectorizer = vectorizer or HashingVectorizer()
+        fingerprints = [cls.fingerprint(text) for _, text in documents]
+
+        term_frequencies = np.zeros((len(documents), vectorizer.n_features), dtype=np.float32)
+        reused = {}
+        if previous is not None:
+            reused = {(doc_id, fp): row for row, (doc_id, fp) in enumerate(zip(previous.ids, previous.fingerprints))}
+        missing = []
+        for row, ((doc_id, _), fp) in enumerate(zip(documents, fingerprints)):
+            previous_row = reused.get((doc_id, fp))
+            if previous_row is None:
+                missing.append(row)
+            else:
+                term_frequencies[row] = previous.term_frequencies[previous_row]
+        if missing:
+            term_frequencies[missing] = vectorizer.transform([documents[row][1] for row in missing])
+
+        index = cls(vectorizer, [doc_id for doc_id, _ in documents], fingerprints, term_frequencies)
+        index.vectorized = len(missing)
+        return index
+
+    def _reweight(self):
+        """
+        Compute the IDF weights and the normalized TF-IDF matrix from the term frequencies
+        """
+        document_count = len(self.ids)
+        document_frequency = np.count_nonzero(self.term_frequencies, axis=0)
+        self.idf = (np.log((1 + document_count) / (1 + document_frequency)) + 1).astype(np.float32)
+        # Stored one row per feature, so a query only reads the rows of the features it contains
+        self.feature_matrix = np.ascontiguousarray(self._normalize(self.term_frequencies * self.idf).T)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, queries: Sequence[str], k: int) -> List[List[Tuple[float, int]]]:
+        """
+        Find the documents most similar to each query
+
+        Args:
+            queries: Query texts, searched in one matrix product
+            k (int): Number of results per query
+
+        Returns:
+            List[List[Tuple[float, int]]]: For each query, up to k (cosine similarity, row) pairs,
+            most similar first and in index order for equal similarities
+        """
+        k = min(k, len(self.ids))
+        if k <= 0 or not queries:
+            return [[] for _ in queries]
+        query_vectors = self._normalize(self.vectorizer.transform(queries) * self.idf)
+        features = np.flatnonzero(query_vectors.any(axis=0))
+        scores = query_vectors[:, features] @ self.feature_matrix[features]
+
+        results = []
+        for row_scores in scores:
+            candidates = np.argpartition(-row_scores, k - 1)[:k] if k < len(row_scores) else np.arange(len(row_scores))
+            order = np.lexsort((candidates, -row_scores[candidates]))
+            results.append([(float(row_scores[candidates[i]]), int(candidates[i])) for i in order])
+        return results
+
+    def save(self, path: str):
+        """
+        Write the index to a .npz file, replacing any previous file atomically
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(temp_path,
+                 version=np.array(self.FORMAT_VERSION),
+                 n_features=np.array(self.vectorizer.n_features),
+                 ngram=np.array(self.vectorizer.ngram),
+                 ids=np.array(self.ids, dtype=str),
+                 fingerprints=np.array(self.fingerprints, dtype=str),
+                 term_frequencies=self.term_frequencies)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['VectorIndex']:
+        """
+        Read an index written by save
+
+        Returns:
+            Optional[VectorIndex]: The index, or None if the file is missing or unreadable
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data['version']) != cls.FORMAT_VERSION:
+                    return None
+                vectorizer = HashingVectorizer(int(data['n_features']), int(data['ngram']))
+                return cls(vectorizer, data['ids'].tolist(), data['fingerprints'].tolist(),
+                           data['term_frequencies'])
+        except Exception as e:
+            print(f"Error loading vector index from {path}: {str(e)}")
+            return None
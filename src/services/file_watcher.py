@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+from typing import Dict, Any, Callable, Iterable, Optional, Tuple
+
+class FileWatcher:
+    """
+    Reloads data when the files it was loaded from change
+
+    A background thread compares the modification time and size of the watched files every
+    interval_seconds and calls the reload function of each watch whose files changed. Polling
+    works on every platform and file system, including network mounts where inotify does not.
+    Reload functions must build their new state completely before swapping it in, and may
+    raise to keep the current state (for example while a file is only half written); they are
+    then retried on the next change of the files, not on every check.
+    """
+    def __init__(self, interval_seconds: float = 2.0):
+        """
+        Initialize the FileWatcher
+
+        Args:
+            interval_seconds (float): Time between two checks of the watched files
+        """
+        self.interval_seconds = interval_seconds
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def watch(self, name: str, paths: Callable[[], Iterable[str]], reload: Callable[[], Optional[Dict[str, Any]]]):
+        """
+        Watch a set of files
+
+        Args:
+            name (str): Name of the watch in the statistics
+            paths (callable): Returns the files and directories to watch; called again after
+                every reload, so the set can change with the loaded data
+            reload (callable): Loads the data again and optionally returns counts to report
+        """
+        with self._lock:
+            self._watches[name] = {
+                'paths': paths,
+                'reload': reload,
+                'signature': self._signature(paths()),
+                'checks': 0,
+                'reloads': 0,
+                'failures': 0,
+                'last_reload_at': None,
+                'last_reload_seconds': None,
+                'last_counts': None,
+                'last_error': None
+            }
+
+    @staticmethod
+    def _signature(paths: Iterable[str]) -> Dict[str, Optional[Tuple[int, int]]]:
+        signature = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                signature[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signature[path] = None
+        return signature
+
+    def check(self) -> Dict[str, bool]:
+        """
+        Reload every watch whose files changed since the last check
+
+        Returns:
+            Dict[str, bool]: For each watch, whether it was reloaded
+        """
+        reloaded = {}
+        for name, watch in list(self._watches.items()):
+            watch['checks'] += 1
+            signature = self._signature(watch['paths']())
+            if signature == watch['signature']:
+                reloaded[name] = False
+                continue
+
+            start = time.perf_counter()
+            try:
+                counts = watch['reload']()
+            except Exception as e:
+                # Keep the current data but take the new signature, so the same broken files are not
+                # reloaded on every check; the reload is retried when they change again
+                watch['signature'] = signature
+                watch['failures'] += 1
+                watch['last_error'] = str(e)
+                reloaded[name] = False
+                print(f"Error reloading {name}: {str(e)}")
+                continue
+            watch['reloads'] += 1
+            watch['last_reload_at'] = time.time()
+            watch['last_reload_seconds'] = time.perf_counter() - start
+            watch['last_counts'] = counts
+            watch['last_error'] = None
+            # The reload may have changed the set of files to watch
+            watch['signature'] = self._signature(watch['paths']())
+            reloaded[name] = True
+            print(f"Reloaded {name} in {watch['last_reload_seconds']:.3f}s: {counts}")
+        return reloaded
+
+    def start(self):
+        """
+        Start the polling thread of this process, if it is not running yet
+
+        Safe to call on every request: after a fork (e.g. gunicorn --preload) the child
+        process starts its own thread.
+        """
+        if self.interval_seconds <= 0:
+            return
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='file-watcher', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the polling thread
+        """
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Error checking watched files: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the number of checks, reloads and failures of each watch and the last reload's timing
+        """
+        return {
+            'interval_seconds': self.interval_seconds,
+            'watches': {
+                name: {key: value for key, value in watch.items() if key not in ('paths', 'reload', 'signature')}
+                for name, watch in self._watches.items()
+            }
+        }
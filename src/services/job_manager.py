@@ -0,0 +1,199 @@
+import os
+import time
+import json
+import uuid
+import sqlite3
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Callable, List, Tuple
+
+class JobManager:
+    """
+    Runs analysis jobs on a local thread pool and records their state in a SQLite database
+
+    Submitting a job only inserts a row and hands the work to the pool, so the request that
+    started it returns immediately. Because the state lives in SQLite, any worker process using
+    the same file can report the status, progress and result of a job, whichever process runs it.
+    """
+    # Finished jobs older than ttl_seconds are removed after this many submissions
+    PRUNE_EVERY = 50
+
+    def __init__(self, db_path: str, max_workers: int = 2, ttl_seconds: float = 24 * 3600):
+        """
+        Initialize the JobManager
+
+        Args:
+            db_path (str): Path to the SQLite database file (created on first use)
+            max_workers (int): Number of jobs run at the same time by this process
+            ttl_seconds (float): Number of seconds a finished job is kept
+        """
+        self.db_path = db_path
+        self.max_workers = max(1, int(max_workers))
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._submitted = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Get the connection for the current thread, opening a new one after a fork
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT, '
+                'done INTEGER NOT NULL DEFAULT 0, total INTEGER NOT NULL DEFAULT 0, '
+                'result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS job_events ('
+                'job_id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL, '
+                'PRIMARY KEY (job_id, seq))'
+            )
+            conn.commit()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """
+        Get the thread pool of this process, creating it on first use and after a fork
+        """
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='analysis-job')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _update(self, job_id: str, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        conn = self._connect()
+        conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+        conn.commit()
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> str:
+        """
+        Queue a job
+
+        The function is called with the given arguments and a 'progress' keyword argument,
+        a callable taking (done, total, stage) and optionally an event dictionary that is
+        published to readers of the job's events. Its return value and the events must be
+        JSON serializable.
+
+        Args:
+            fn (callable): The work to run
+            *args: Positional arguments for fn
+            **kwargs: Keyword arguments for fn
+
+        Returns:
+            str: The ID of the new job
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            'INSERT INTO jobs (id, status, stage, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+            (job_id, 'queued', 'queued', now, now)
+        )
+        conn.commit()
+
+        self._get_executor().submit(self._run, job_id, fn, args, kwargs)
+        self._submitted += 1
+        if self._submitted % self.PRUNE_EVERY == 0:
+            self.prune()
+        return job_id
+
+    def _run(self, job_id: str, fn: Callable[..., Any], args, kwargs):
+        self._update(job_id, status='running', stage='running')
+        start = time.perf_counter()
+        seq = 0
+
+        def progress(done: int, total: int, stage: str, event: Optional[Dict[str, Any]] = None):
+            nonlocal seq
+            if event is not None:
+                seq += 1
+                self._connect().execute('INSERT INTO job_events (job_id, seq, event) VALUES (?, ?, ?)',
+                                        (job_id, seq, json.dumps(event)))
+            self._update(job_id, done=done, total=total, stage=stage)
+
+        try:
+            result = fn(*args, progress=progress, **kwargs)
+            self._update(job_id, status='succeeded', stage='done', result=json.dumps(result))
+            print(f"Job {job_id} succeeded in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            self._update(job_id, status='failed', stage='failed', error=str(e))
+            print(f"Job {job_id} failed: {str(e)}")
+            print(traceback.format_exc())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the state of a job
+
+        Args:
+            job_id (str): ID returned by submit
+
+        Returns:
+            Optional[Dict[str, Any]]: The job's 'id', 'status' (queued, running, succeeded or
+            failed), 'stage', 'progress' with 'done' and 'total', 'result', 'error' and
+            timestamps, or None if there is no such job
+        """
+        row = self._connect().execute(
+            'SELECT id, status, stage, done, total, result, error, created_at, updated_at '
+            'FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'status': row[1],
+            'stage': row[2],
+            'progress': {'done': row[3], 'total': row[4]},
+            'result': json.loads(row[5]) if row[5] is not None else None,
+            'error': row[6],
+            'created_at': row[7],
+            'updated_at': row[8]
+        }
+
+    def get_events(self, job_id: str, after: int = 0) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Get the events a job has published
+
+        Args:
+            job_id (str): ID returned by submit
+            after (int): Only return events with a sequence number above this one
+
+        Returns:
+            List[Tuple[int, Dict[str, Any]]]: (sequence number, event) pairs in publication order
+        """
+        rows = self._connect().execute(
+            'SELECT seq, event FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq', (job_id, after)
+        ).fetchall()
+        return [(seq, json.loads(event)) for seq, event in rows]
+
+    def prune(self):
+        """
+        Remove finished jobs older than ttl_seconds
+        """
+        conn = self._connect()
+        conn.execute("DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?",
+                     (time.time() - self.ttl_seconds,))
+        conn.execute('DELETE FROM job_events WHERE job_id NOT IN (SELECT id FROM jobs)')
+        conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the number of jobs in each status
+        """
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {'workers': self.max_workers, 'jobs': dict(rows)}
@@ -0,0 +1,277 @@
+import time
+import pandas as pd
+from src.services.model_registry import estimate_tokens
+from src.services.prompt_splitter import PromptSplitter
+from typing import List, Dict, Any, Optional, Tuple
+
+class MapReduceAnalyzer:
+    """
+    Service for analyzing experiment data that is too large for a single model call.
+    Each slice of the data is summarized independently (map) and the compact partial
+    analyses are merged into the final JSON analysis with one more call (reduce).
+
+    Every prompt sent is measured against the model's prompt budget: slices whose map prompt
+    does not fit are halved, a single row that still does not fit is divided by the
+    PromptSplitter, and partial analyses too large for one reduce prompt are merged in rounds.
+    """
+    # Columns used to group rows into slices, in order of preference
+    GROUP_COLUMNS = ['metric_name', 'metric', 'variable', 'dimensions_string']
+    # Share of the model's prompt budget filled with data rows in each map prompt
+    SLICE_BUDGET_SHARE = 0.7
+    # Largest number of rounds merging partial analyses before the final reduce prompt fits
+    MAX_MERGE_ROUNDS = 5
+    # Minimum time between 'generate' events while the final response is streamed
+    GENERATE_EVENT_SECONDS = 0.5
+
+    def __init__(self, prompt_builder, summary_generator, max_rows_per_slice: int = 25):
+        """
+        Initialize the MapReduceAnalyzer
+
+        Args:
+            prompt_builder (PromptBuilder): Builds the single-call, map and reduce prompts
+            summary_generator (SummaryGenerator): Parses the partial analyses returned by the map stage
+            max_rows_per_slice (int): Maximum number of data rows sent to the model in one map call
+        """
+        self.prompt_builder = prompt_builder
+        self.summary_generator = summary_generator
+        self.max_rows_per_slice = max(1, int(max_rows_per_slice))
+
+    def split_data(self, data_df: pd.DataFrame, max_rows: Optional[int] = None) -> List[Tuple[str, pd.DataFrame]]:
+        """
+        Split the data into slices of related rows
+
+        Rows of the same metric (or segment) are kept together and consecutive groups are packed
+        into slices of up to max_rows_per_slice rows. A group is only split if it is larger than
+        a slice on its own. Rows without any value are dropped, and rows without a group value
+        form a group of their own.
+
+        Args:
+            data_df (pd.DataFrame): DataFrame containing the experiment data
+            max_rows (int, optional): Rows per slice, max_rows_per_slice by default
+
+        Returns:
+            List[Tuple[str, pd.DataFrame]]: List of (slice name, slice rows) pairs
+        """
+        data_df = data_df.dropna(how='all')
+        if data_df.empty:
+            return []
+        max_rows = max_rows or self.max_rows_per_slice
+
+        group_col = next((col for col in self.GROUP_COLUMNS if col in data_df.columns), None)
+        if group_col is None:
+            groups = [(None, data_df)]
+        else:
+            # groupby(dropna=False) fails on missing keys in pandas 2.1, so they get a name instead
+            keys = data_df[group_col].astype(object)
+            keys = keys.where(keys.notna(), f"(no {group_col})")
+            groups = list(data_df.groupby(keys, sort=False))
+
+        slices = []
+        current_names = []
+        current_frames = []
+        current_rows = 0
+
+        def flush():
+            if current_frames:
+                slices.append((self._slice_name(group_col, current_names, len(slices) + 1),
+                               pd.concat(current_frames)))
+
+        for name, group_df in groups:
+            # Split oversized groups into row blocks of their own
+            if len(group_df) > max_rows:
+                flush()
+                current_names, current_frames, current_rows = [], [], 0
+                for start in range(0, len(group_df), max_rows):
+                    block = group_df.iloc[start:start + max_rows]
+                    slices.append((self._slice_name(group_col, [name], len(slices) + 1), block))
+                continue
+
+            if current_rows + len(group_df) > max_rows:
+                flush()
+                current_names, current_frames, current_rows = [], [], 0
+
+            current_names.append(name)
+            current_frames.append(group_df)
+            current_rows += len(group_df)
+
+        flush()
+        return slices
+
+    def _slice_name(self, group_col: Optional[str], names: List[Any], number: int) -> str:
+        """
+        Build a short human readable name for a slice
+        """
+        if group_col is None or not names:
+            return f"rows part {number}"
+        shown = ", ".join(str(name) for name in names[:3])
+        if len(names) > 3:
+            shown += f" and {len(names) - 3} more"
+        return f"part {number}: {group_col} {shown}"
+
+    def analyze(self, bedrock_service, instructions: str, data_df: pd.DataFrame,
+                field_descriptions: Optional[Dict[str, str]] = None,
+                examples: Optional[List[Dict[str, Any]]] = None,
+                format_options: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Analyze the data and return the raw model response containing the final JSON analysis
+
+        Args:
+            bedrock_service (AWSBedrockService): Service used to call the selected model
+            instructions (str): User instructions for interpreting the data
+            data_df (pd.DataFrame): DataFrame containing the experiment data
+            field_descriptions (dict, optional): Dictionary mapping field names to their descriptions
+            examples (List[Dict[str, Any]], optional): List of examples to include in the prompt
+            format_options (dict, optional): Per-request options passed on to the PromptBuilder
+
+        Returns:
+            str: The model response for the complete analysis
+        """
+        response = ""
+        for event in self.analyze_streaming(bedrock_service, instructions, data_df,
+                                            field_descriptions, examples, format_options):
+            if event['stage'] == 'result':
+                response = event['response']
+        return response
+
+    def analyze_streaming(self, bedrock_service, instructions: str, data_df: pd.DataFrame,
+                          field_descriptions: Optional[Dict[str, str]] = None,
+                          examples: Optional[List[Dict[str, Any]]] = None,
+                          format_options: Optional[Dict[str, Any]] = None):
+        """
+        Generator version of analyze that reports progress as each model call completes
+
+        Yields dictionaries with a 'stage' key:
+            - 'map': a slice was summarized ('slice', 'partial', 'done', 'total')
+            - 'generate': text of the final response generated since the previous event
+              ('text', 'done', 'total')
+            - 'result': the final model response ('response', 'done', 'total')
+        """
+        prompt = self.prompt_builder.build_prompt(instructions, data_df, field_descriptions, examples,
+                                                  format_options)
+        prompt_tokens = estimate_tokens(prompt)
+        budget = bedrock_service.prompt_token_budget()
+
+        # Inputs that fit in the model's context are analyzed with a single call using the full prompt
+        if prompt_tokens <= budget:
+            print(f"Analyzing data with a single model call ({len(prompt)} chars, ~{prompt_tokens} tokens)")
+            yield from self._stream_final_response(bedrock_service, prompt, 0, 1)
+            return
+
+        # Otherwise start with slices about as large as the context allows, leaving room for the
+        # rest of the map prompt, and halve the ones that turn out too large
+        max_rows = max(self.max_rows_per_slice, int(len(data_df) * self.SLICE_BUDGET_SHARE * budget / prompt_tokens))
+        map_prompts = [
+            fitted
+            for name, slice_df in self.split_data(data_df, max_rows)
+            for fitted in self._fit_map_prompt(instructions, name, slice_df, field_descriptions,
+                                               format_options, budget)
+        ]
+        print(f"Map stage: {len(map_prompts)} slices, {sum(len(p) for _, p in map_prompts)} chars in total")
+
+        total = len(map_prompts) + 1
+        start = time.perf_counter()
+        partials = []
+        for partial in self._map(bedrock_service, map_prompts):
+            partials.append(partial)
+            yield {'stage': 'map', 'slice': partial['slice'], 'partial': partial, 'done': len(partials), 'total': total}
+        print(f"Map stage completed in {time.perf_counter() - start:.2f}s")
+
+        done = len(partials)
+        for merge_round in range(1, self.MAX_MERGE_ROUNDS + 1):
+            reduce_prompt = self._fit_reduce_prompt(instructions, partials, examples, budget)
+            if reduce_prompt is not None:
+                break
+            # Merge groups of partial analyses that fit in one prompt, as many groups at once as possible
+            merge_prompts = [
+                (f"merge {merge_round}.{i + 1}", chunk)
+                for i, chunk in enumerate(PromptSplitter(budget).split(
+                    self.prompt_builder.build_reduce_prompt(instructions, partials)))
+            ]
+            if len(merge_prompts) >= len(partials):
+                break
+            print(f"Merge round {merge_round}: {len(partials)} partial analyses in {len(merge_prompts)} calls")
+            total += len(merge_prompts)
+            partials = []
+            for partial in self._map(bedrock_service, merge_prompts):
+                partials.append(partial)
+                done += 1
+                yield {'stage': 'map', 'slice': partial['slice'], 'partial': partial, 'done': done, 'total': total}
+        if reduce_prompt is None:
+            raise ValueError(f"The partial analyses of {len(data_df)} rows do not fit in the context of "
+                             f"{getattr(bedrock_service, 'model_id', 'the model')}")
+
+        print(f"Reduce stage: merging {len(partials)} partial analyses ({len(reduce_prompt)} chars)")
+        yield from self._stream_final_response(bedrock_service, reduce_prompt, total - 1, total)
+
+    def _fit_map_prompt(self, instructions: str, name: str, slice_df: pd.DataFrame,
+                        field_descriptions: Optional[Dict[str, str]], format_options: Optional[Dict[str, Any]],
+                        budget: int) -> List[Tuple[str, str]]:
+        """
+        Build the map prompts of a slice, each within budget estimated tokens
+
+        A slice whose prompt is too large is halved until its halves fit; the prompt of a single
+        row that is still too large is divided between records by the PromptSplitter.
+
+        Returns:
+            List[Tuple[str, str]]: (slice name, map prompt) pairs
+        """
+        prompt = self.prompt_builder.build_map_prompt(instructions, slice_df, name, field_descriptions, format_options)
+        if estimate_tokens(prompt) <= budget:
+            return [(name, prompt)]
+        if len(slice_df) > 1:
+            half = (len(slice_df) + 1) // 2
+            return (self._fit_map_prompt(instructions, f"{name} (1/2)", slice_df.iloc[:half], field_descriptions,
+                                         format_options, budget)
+                    + self._fit_map_prompt(instructions, f"{name} (2/2)", slice_df.iloc[half:], field_descriptions,
+                                           format_options, budget))
+        chunks = PromptSplitter(budget).split(prompt)
+        return [(f"{name} ({i + 1}/{len(chunks)})", chunk) for i, chunk in enumerate(chunks)]
+
+    def _fit_reduce_prompt(self, instructions: str, partials: List[Dict[str, Any]],
+                           examples: Optional[List[Dict[str, Any]]], budget: int) -> Optional[str]:
+        """
+        Build the reduce prompt with as many of the examples as fit in budget estimated tokens
+
+        Returns:
+            Optional[str]: The reduce prompt, or None if the partial analyses alone do not fit
+        """
+        examples = list(examples or [])
+        while True:
+            prompt = self.prompt_builder.build_reduce_prompt(instructions, partials, examples)
+            if estimate_tokens(prompt) <= budget:
+                return prompt
+            if not examples:
+                return None
+            examples.pop()
+
+    def _map(self, bedrock_service, named_prompts: List[Tuple[str, str]]):
+        """
+        Send the prompts concurrently and yield their partial analyses in prompt order
+        """
+        responses = bedrock_service.get_model_responses_streaming([prompt for _, prompt in named_prompts])
+        for (name, _), response in zip(named_prompts, responses):
+            partial = self.summary_generator.parse_partial(response)
+            if partial is None:
+                # Keep whatever the model said so the reduce stage can still use it
+                partial = {'slice': name, 'findings': [response.strip()[:1000]]}
+            partial.setdefault('slice', name)
+            yield partial
+
+    def _stream_final_response(self, bedrock_service, prompt: str, done: int, total: int):
+        """
+        Stream the response to the final prompt as 'generate' events, at most one every
+        GENERATE_EVENT_SECONDS, followed by the 'result' event with the complete response
+        """
+        parts = []
+        pending = []
+        last_event = time.perf_counter()
+        for text in bedrock_service.stream_model_response(prompt):
+            parts.append(text)
+            pending.append(text)
+            if time.perf_counter() - last_event >= self.GENERATE_EVENT_SECONDS:
+                yield {'stage': 'generate', 'text': "".join(pending), 'done': done, 'total': total}
+                pending = []
+                last_event = time.perf_counter()
+        if pending:
+            yield {'stage': 'generate', 'text': "".join(pending), 'done': done, 'total': total}
+        yield {'stage': 'result', 'response': "".join(parts), 'done': total, 'total': total}
@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
+from src.services.client_pool import default_client_pool
+
+class ModelCatalog:
+    """
+    Cached list of the foundation models available in AWS Bedrock
+
+    The list is served from memory and refreshed in the background once it is older than the
+    TTL (stale-while-revalidate), so rendering the form never waits on Bedrock unless the
+    catalog is completely empty. The last good list is optionally written to a JSON snapshot
+    that new workers load at startup.
+    """
+    def __init__(self, region_name: str = 'us-west-2', ttl_seconds: float = 3600,
+                 snapshot_path: Optional[str] = None, retry_seconds: float = 60, client_pool=None):
+        """
+        Initialize the ModelCatalog
+
+        Args:
+            region_name (str): AWS region to list the models of
+            ttl_seconds (float): Age after which the list is refreshed in the background
+            snapshot_path (str, optional): JSON file used to persist the last good list
+            retry_seconds (float): Minimum time between attempts after a failed refresh
+            client_pool (ClientPool, optional): Pool providing the 'bedrock' client
+        """
+        self.region_name = region_name
+        self.ttl_seconds = ttl_seconds
+        self.snapshot_path = snapshot_path
+        self.retry_seconds = retry_seconds
+        self.client_pool = client_pool or default_client_pool
+
+        self.models = []
+        self.etag = None
+        self.fetched_at = None
+        self.last_modified = None
+        self.last_error = None
+        self._last_attempt = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+        self._load_snapshot()
+
+    def _load_snapshot(self):
+        """
+        Populate the catalog from the snapshot file, if there is one
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            self._set_models(snapshot.get('models', []), snapshot.get('fetched_at', 0.0))
+            print(f"Loaded {len(self.models)} models from catalog snapshot {self.snapshot_path}")
+        except Exception as e:
+            print(f"Error loading model catalog snapshot: {str(e)}")
+
+    def _save_snapshot(self):
+        """
+        Atomically write the current list to the snapshot file
+        """
+        if not self.snapshot_path:
+            return
+        try:
+            directory = os.path.dirname(self.snapshot_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'fetched_at': self.fetched_at, 'models': self.models}, f)
+            os.replace(temp_path, self.snapshot_path)
+        except Exception as e:
+            print(f"Error saving model catalog snapshot: {str(e)}")
+
+    def _set_models(self, models: List[Dict[str, Any]], fetched_at: float):
+        etag = hashlib.sha1(json.dumps(models, sort_keys=True).encode('utf-8')).hexdigest()
+        if etag != self.etag:
+            self.last_modified = datetime.fromtimestamp(fetched_at, tz=timezone.utc)
+        self.models = models
+        self.etag = etag
+        self.fetched_at = fetched_at
+
+    def _fetch_models(self) -> List[Dict[str, Any]]:
+        """
+        List the foundation models from AWS Bedrock
+        """
+        bedrock_client = self.client_pool.get_client('bedrock', self.region_name)
+        response = bedrock_client.list_foundation_models()
+        models = []
+        for model in response.get('modelSummaries', []):
+            model_id = model.get('modelId')
+            provider = model.get('providerName')
+            models.append({
+                'id': model_id,
+                'provider': provider,
+                'name': f"{provider} - {model_id}"
+            })
+        return models
+
+    def refresh(self) -> bool:
+        """
+        Fetch the model list now, keeping the current list if the call fails
+
+        Returns:
+            bool: True if the catalog was refreshed
+        """
+        self._last_attempt = time.time()
+        try:
+            models = self._fetch_models()
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Error refreshing model catalog: {e}")
+            return False
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+        with self._lock:
+            self._set_models(models, time.time())
+            self.last_error = None
+        self._save_snapshot()
+        return True
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, name='model-catalog-refresh', daemon=True).start()
+
+    def is_stale(self) -> bool:
+        return self.fetched_at is None or time.time() - self.fetched_at > self.ttl_seconds
+
+    def get_models(self) -> List[Dict[str, Any]]:
+        """
+        Get the available models, refreshing the catalog if needed
+
+        Returns:
+            List[Dict[str, Any]]: List of models with 'id', 'provider' and 'name'
+        """
+        if not self.is_stale():
+            return self.models
+
+        recently_failed = time.time() - self._last_attempt < self.retry_seconds
+        if self.fetched_at is None:
+            # Nothing to serve yet, so the first caller has to wait for Bedrock
+            if not recently_failed:
+                with self._lock:
+                    self._refreshing = True
+                self.refresh()
+        elif not recently_failed:
+            self._refresh_in_background()
+        return self.models
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'models': len(self.models),
+            'fetched_at': self.fetched_at,
+            'stale': self.is_stale(),
+            'last_error': self.last_error
+        }
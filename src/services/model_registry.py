@@ -0,0 +1,118 @@
+"""
+Capabilities of the Bedrock text models and a token estimator for prompts
+
+Prompts are only split when their estimated token count does not fit in the model's context
+window after reserving room for the response, so most analyses are sent in a single call.
+"""
+import re
+from typing import Dict, Any
+
+# Context window and maximum response length in tokens, and price in USD per 1000 tokens
+MODEL_CAPABILITIES = {
+    'anthropic.claude-v2': {
+        'context_window': 100000, 'max_output_tokens': 4096,
+        'input_cost_per_1k': 0.008, 'output_cost_per_1k': 0.024
+    },
+    'anthropic.claude-v2:1': {
+        'context_window': 200000, 'max_output_tokens': 4096,
+        'input_cost_per_1k': 0.008, 'output_cost_per_1k': 0.024
+    },
+    'anthropic.claude-instant-v1': {
+        'context_window': 100000, 'max_output_tokens': 4096,
+        'input_cost_per_1k': 0.0008, 'output_cost_per_1k': 0.0024
+    },
+    'amazon.titan-text-express-v1': {
+        'context_window': 8192, 'max_output_tokens': 8192,
+        'input_cost_per_1k': 0.0008, 'output_cost_per_1k': 0.0016
+    },
+    'amazon.titan-text-lite-v1': {
+        'context_window': 4096, 'max_output_tokens': 4096,
+        'input_cost_per_1k': 0.0003, 'output_cost_per_1k': 0.0004
+    },
+    'meta.llama2-13b-chat-v1': {
+        'context_window': 4096, 'max_output_tokens': 2048,
+        'input_cost_per_1k': 0.00075, 'output_cost_per_1k': 0.001
+    },
+    'meta.llama2-70b-chat-v1': {
+        'context_window': 4096, 'max_output_tokens': 2048,
+        'input_cost_per_1k': 0.00195, 'output_cost_per_1k': 0.00256
+    },
+    'cohere.command-text-v14': {
+        'context_window': 4096, 'max_output_tokens': 4000,
+        'input_cost_per_1k': 0.0015, 'output_cost_per_1k': 0.002
+    },
+    'cohere.command-light-text-v14': {
+        'context_window': 4096, 'max_output_tokens': 4000,
+        'input_cost_per_1k': 0.0003, 'output_cost_per_1k': 0.0006
+    },
+}
+
+# Capabilities assumed for other models of a family, in order of matching
+FAMILY_CAPABILITIES = {
+    'anthropic': MODEL_CAPABILITIES['anthropic.claude-v2'],
+    'amazon.titan': MODEL_CAPABILITIES['amazon.titan-text-lite-v1'],
+    'meta.llama': MODEL_CAPABILITIES['meta.llama2-13b-chat-v1'],
+    'cohere': MODEL_CAPABILITIES['cohere.command-text-v14'],
+    'default': {
+        'context_window': 4096, 'max_output_tokens': 2048,
+        'input_cost_per_1k': 0.0, 'output_cost_per_1k': 0.0
+    }
+}
+
+# Pieces that are rarely merged into one token: short runs of letters, up to three digits,
+# and single punctuation characters. Counting them slightly overestimates prose and estimates
+# numeric tables (which tokenize far worse than 4 characters per token) closely.
+TOKEN_PATTERN = re.compile(r'[A-Za-z]{1,4}|\d{1,3}|[^\sA-Za-z\d]')
+
+
+def get_model_capabilities(model_id: str) -> Dict[str, Any]:
+    """
+    Get the capabilities of a model
+
+    Args:
+        model_id (str): Bedrock model ID, optionally with a version suffix such as ':0'
+
+    Returns:
+        Dict[str, Any]: 'context_window', 'max_output_tokens', 'input_cost_per_1k' and
+        'output_cost_per_1k' of the model, or of its family if the model is not listed
+    """
+    model_id = model_id.lower()
+    if model_id in MODEL_CAPABILITIES:
+        return MODEL_CAPABILITIES[model_id]
+    base_id = model_id.rsplit(':', 1)[0]
+    if base_id in MODEL_CAPABILITIES:
+        return MODEL_CAPABILITIES[base_id]
+    for family, capabilities in FAMILY_CAPABILITIES.items():
+        if family in model_id:
+            return capabilities
+    return FAMILY_CAPABILITIES['default']
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text without a model-specific tokenizer
+
+    Args:
+        text (str): The text to estimate
+
+    Returns:
+        int: Estimated token count, erring on the high side
+    """
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def estimate_cost(model_id: str, input_tokens: int, output_tokens: int) -> float:
+    """
+    Estimate the price of a model call in USD
+
+    Args:
+        model_id (str): Bedrock model ID
+        input_tokens (int): Number of prompt tokens
+        output_tokens (int): Number of generated tokens
+
+    Returns:
+        float: Estimated cost of the call
+    """
+    capabilities = get_model_capabilities(model_id)
+    return (input_tokens * capabilities['input_cost_per_1k']
+            + output_tokens * capabilities['output_cost_per_1k']) / 1000
@@ -1,12 +1,65 @@
 import pandas as pd
+import numpy as np
 import json
 from typing import List, Dict, Any, Optional
+from src.services.column_pruner import ColumnPruner
+from src.utils.weblab_format import is_weblab_format
+
+# JSON structure the model is asked to return for a complete analysis
+OUTPUT_SCHEMA = """```json
+{
+  "summary": "A concise summary of the A/B test results (2-3 paragraphs)",
+  "key_metrics": [
+    {
+      "metric_name": "Name of the metric",
+      "impact range": "Confidence interval of impact percentage",
+      "probability of impact >0": "Probability that the treatment is better than control",
+      "annualized impact": "Estimated annualized impact of the metric",
+      "interpretation": "What this metric means in context"
+    }
+  ],
+  "recommendations": [
+    "Clear, actionable recommendation based on the results",
+    "Additional recommendations if applicable"
+  ],
+  "limitations": [
+    "Any limitations or caveats to consider"
+  ]
+}
+```"""
+
+# Compact JSON structure the model is asked to return for one slice of the data
+PARTIAL_SCHEMA = """```json
+{
+  "slice": "Name of the data slice that was analyzed",
+  "key_metrics": [
+    {
+      "metric_name": "Name of the metric",
+      "impact range": "Confidence interval of impact percentage",
+      "probability of impact >0": "Probability that the treatment is better than control",
+      "annualized impact": "Estimated annualized impact of the metric",
+      "interpretation": "What this metric means in context (one sentence)"
+    }
+  ],
+  "findings": [
+    "Short notable finding about this slice"
+  ],
+  "limitations": [
+    "Data quality issue or caveat specific to this slice"
+  ]
+}
+```"""
 
 class PromptBuilder:
-    def __init__(self):
-        pass
+    def __init__(self, column_pruner=None, correlation_top_k=10, correlation_threshold=0.5):
+        # Removes identifier and constant columns before unrecognized data is formatted
+        self.column_pruner = column_pruner or ColumnPruner()
+        # Defaults for the notable correlations listed for unrecognized data; both can be
+        # overridden per request through format_options
+        self.correlation_top_k = correlation_top_k
+        self.correlation_threshold = correlation_threshold
         
-    def build_prompt(self, instructions, data_df, field_descriptions=None, examples=None):
+    def build_prompt(self, instructions, data_df, field_descriptions=None, examples=None, format_options=None):
         """
         Build a prompt for the GenAI model based on the statistical data, field descriptions, and user instructions
         
@@ -15,26 +68,20 @@ class PromptBuilder:
             data_df (pandas.DataFrame): DataFrame containing the A/B experiment statistical data
             field_descriptions (dict, optional): Dictionary mapping field names to their descriptions
             examples (List[Dict[str, Any]], optional): List of examples to include in the prompt
+            format_options (dict, optional): Per-request formatting options
+                ('correlation_top_k', 'correlation_threshold')
             
         Returns:
             str: A formatted prompt for the GenAI model
         """
         # Convert DataFrame to a more readable format
-        data_str = self._format_dataframe(data_df)
+        data_str = self._format_dataframe(data_df, format_options)
         
         # Format field descriptions if provided
-        descriptions_str = ""
-        if field_descriptions and len(field_descriptions) > 0:
-            descriptions_str = "## FIELD DESCRIPTIONS:\n"
-            for field, description in field_descriptions.items():
-                descriptions_str += f"- {field}: {description}\n"
+        descriptions_str = self._format_field_descriptions(field_descriptions)
         
         # Format examples if provided
-        examples_str = ""
-        if examples and len(examples) > 0:
-            examples_str = "## EXAMPLES OF GOOD ANALYSES:\n"
-            for example in examples:
-                examples_str += self._format_example(example)
+        examples_str = self._format_examples(examples)
         
         # Build the prompt with clear instructions for the model
         prompt = f"""
@@ -51,35 +98,113 @@ Your task is to analyze the following statistical output from an A/B experiment
 
 ## REQUIRED OUTPUT FORMAT:
 Please provide your analysis in the following JSON structure:
-```json
-{{
-  "summary": "A concise summary of the A/B test results (2-3 paragraphs)",
-  "key_metrics": [
-    {{
-      "metric_name": "Name of the metric",
-      "impact range": "Confidence interval of impact percentage",
-      "probability of impact >0": "Probability that the treatment is better than control",
-      "annualized impact": "Estimated annualized impact of the metric",
-      "interpretation": "What this metric means in context"
-    }}
-  ],
-  "recommendations": [
-    "Clear, actionable recommendation based on the results",
-    "Additional recommendations if applicable"
-  ],
-  "limitations": [
-    "Any limitations or caveats to consider"
-  ]
-}}
-```
+{OUTPUT_SCHEMA}
 
 Ensure your analysis is data-driven, statistically sound, and provides clear business recommendations.
 Use the field descriptions to provide more context and accurate interpretations of the metrics.
 Learn from the examples provided to structure your analysis in a similar way.
 """
         return prompt
+
+    def build_map_prompt(self, instructions, slice_df, slice_name, field_descriptions=None, format_options=None):
+        """
+        Build a prompt that asks the model for a compact partial analysis of one slice of the data
         
-    def _format_example(self, example: Dict[str, Any]) -> str:
+        Args:
+            instructions (str): User instructions for interpreting the data
+            slice_df (pandas.DataFrame): The rows of the experiment data belonging to this slice
+            slice_name (str): Human readable name of the slice (e.g. the metrics it contains)
+            field_descriptions (dict, optional): Dictionary mapping field names to their descriptions
+            format_options (dict, optional): Per-request formatting options, as for build_prompt
+            
+        Returns:
+            str: A formatted map-stage prompt for the GenAI model
+        """
+        data_str = self._format_dataframe(slice_df, format_options)
+        descriptions_str = self._format_field_descriptions(field_descriptions)
+        
+        prompt = f"""
+You are an expert data scientist specializing in A/B testing analysis.
+You are analyzing one slice ({slice_name}) of a larger A/B experiment. The other slices are analyzed separately
+and all partial analyses will be merged afterwards, so only describe the data below and keep your answer short.
+
+## STATISTICAL DATA TO ANALYZE ({slice_name}):
+{data_str}
+
+{descriptions_str}
+## USER INSTRUCTIONS:
+{instructions}
+
+## REQUIRED OUTPUT FORMAT:
+Respond only with a JSON object in the following structure:
+{PARTIAL_SCHEMA}
+"""
+        return prompt
+
+    def build_reduce_prompt(self, instructions, partials, examples=None):
+        """
+        Build a prompt that asks the model to merge partial slice analyses into the final analysis
+        
+        Args:
+            instructions (str): User instructions for interpreting the data
+            partials (List[Dict[str, Any]]): Partial analyses produced by the map stage
+            examples (List[Dict[str, Any]], optional): List of examples to include in the prompt
+            
+        Returns:
+            str: A formatted reduce-stage prompt for the GenAI model
+        """
+        examples_str = self._format_examples(examples)
+        partials_str = "\n".join(
+            json.dumps(partial, separators=(',', ':'), default=str) for partial in partials
+        )
+        
+        prompt = f"""
+You are an expert data scientist specializing in A/B testing analysis.
+The statistical output of this A/B experiment was too large to analyze at once, so it was split into {len(partials)} slices
+that were analyzed separately. Your task is to merge the partial analyses below into one clear, actionable summary
+of the whole experiment.
+
+{examples_str}
+## PARTIAL ANALYSES (one JSON object per slice):
+{partials_str}
+
+## USER INSTRUCTIONS:
+{instructions}
+
+## REQUIRED OUTPUT FORMAT:
+Please provide your analysis in the following JSON structure:
+{OUTPUT_SCHEMA}
+
+Include the most important metrics from all slices in key_metrics, resolve any conflicting findings,
+and make sure your recommendations consider the experiment as a whole.
+Learn from the examples provided to structure your analysis in a similar way.
+"""
+        return prompt
+
+    def _format_field_descriptions(self, field_descriptions):
+        """
+        Format field descriptions as a prompt section
+        """
+        descriptions_str = ""
+        if field_descriptions and len(field_descriptions) > 0:
+            descriptions_str = "## FIELD DESCRIPTIONS:\n"
+            for field, description in field_descriptions.items():
+                descriptions_str += f"- {field}: {description}\n"
+        return descriptions_str
+
+    def _format_examples(self, examples):
+        """
+        Format few-shot examples as a prompt section
+        """
+        examples_str = ""
+        if examples and len(examples) > 0:
+            examples_str = "## EXAMPLES OF GOOD ANALYSES:\n"
+            for example in examples:
+                # ExampleManager renders its examples once when they are loaded
+                examples_str += example.get('prompt_text') or self.format_example(example)
+        return examples_str
+        
+    def format_example(self, example: Dict[str, Any]) -> str:
         """
         Format an example for inclusion in the prompt
         
@@ -111,10 +236,11 @@ Learn from the examples provided to structure your analysis in a similar way.
 
 """
         
-    def _format_dataframe(self, df):
+    def _format_dataframe(self, df, format_options=None):
         """
         Format a DataFrame into a readable string representation
         """
+        format_options = format_options or {}
         # Check if the DataFrame is empty
         if df.empty:
             return "No data provided"
@@ -126,91 +252,207 @@ Learn from the examples provided to structure your analysis in a similar way.
         elif all(col in df.columns for col in ['variable', 'coefficient', 'std_error', 't_value', 'p_value']):
             # This looks like a regression analysis output
             return self._format_regression_results(df)
+        elif is_weblab_format(df.columns):
+            # This looks like a weblab experiment export
+            return self._format_weblab_results(df)
         else:
             # Generic format for any DataFrame
+            # Drop identifier columns and collapse constant ones first
+            df, pruning_report = self.column_pruner.prune(df)
+            pruning_str = self.column_pruner.format_report(pruning_report)
+            if df.empty or len(df.columns) == 0:
+                return f"{pruning_str}No varying columns left after pruning"
+            
             # Include descriptive statistics
             desc_stats = df.describe().to_string()
             
-            # Include correlation matrix if there are numeric columns
-            numeric_cols = df.select_dtypes(include=['number']).columns
-            corr_matrix = ""
-            if len(numeric_cols) > 1:
-                corr_matrix = f"\n\nCorrelation Matrix:\n{df[numeric_cols].corr().to_string()}"
+            # Include the strongest correlations between numeric columns
+            corr_matrix = self._format_top_correlations(
+                df,
+                format_options.get('correlation_top_k', self.correlation_top_k),
+                format_options.get('correlation_threshold', self.correlation_threshold)
+            )
                 
             # Include the first few rows of data
             data_sample = f"\n\nData Sample (first 5 rows):\n{df.head().to_string()}"
             
-            return f"Descriptive Statistics:\n{desc_stats}{corr_matrix}{data_sample}"
+            return f"{pruning_str}Descriptive Statistics:\n{desc_stats}{corr_matrix}{data_sample}"
     
+    def _format_top_correlations(self, df, top_k, threshold):
+        """
+        Format the top_k strongest pairwise correlations with an absolute value of at least threshold
+
+        Correlations are computed over pairwise-complete observations with a few matrix
+        products instead of materializing the full matrix as text, so the prompt grows
+        with top_k rather than with the square of the number of columns.
+        """
+        if not top_k or top_k <= 0:
+            return ""
+        numeric_df = df.select_dtypes(include=['number'])
+        # Constant columns have no defined correlation
+        numeric_df = numeric_df.loc[:, numeric_df.nunique() > 1]
+        if len(numeric_df.columns) < 2:
+            return ""
+
+        values = numeric_df.to_numpy(dtype=float)
+        present = ~np.isnan(values)
+        mask = present.astype(float)
+        x = np.where(present, values, 0.0)
+
+        # Pairwise-complete sums: entry [i, j] only uses rows where both columns have a value
+        n = mask.T @ mask
+        sum_x = x.T @ mask
+        sum_xx = (x * x).T @ mask
+        sum_xy = x.T @ x
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = n * sum_xy - sum_x * sum_x.T
+            var = (n * sum_xx - sum_x * sum_x) * (n * sum_xx - sum_x * sum_x).T
+            corr = cov / np.sqrt(var)
+
+        rows, cols = np.triu_indices(len(numeric_df.columns), k=1)
+        pair_corr = corr[rows, cols]
+        pair_n = n[rows, cols]
+        keep = np.isfinite(pair_corr) & (pair_n >= 3) & (np.abs(pair_corr) >= threshold)
+        rows, cols, pair_corr, pair_n = rows[keep], cols[keep], np.clip(pair_corr[keep], -1.0, 1.0), pair_n[keep]
+
+        header = f"\n\nNotable Correlations (top {top_k} with |r| >= {threshold}):\n"
+        if len(pair_corr) == 0:
+            return header + "None found"
+
+        strongest = np.argsort(-np.abs(pair_corr), kind='stable')[:top_k]
+        names = numeric_df.columns
+        lines = [
+            f"- {names[rows[i]]} ~ {names[cols[i]]}: r={pair_corr[i]:.3f} (n={int(pair_n[i])})"
+            for i in strongest
+        ]
+        return header + "\n".join(lines)
+
     def _format_ab_test_results(self, df):
         """
         Format A/B test results in a readable way
         """
-        result = "A/B Test Results:\n\n"
+        metric, control, treatment, diff, p_val = self._row_values(
+            df, ['metric', 'control', 'treatment', 'difference', 'p_value']
+        )
+        p_val_str = self._format_p_values(p_val)
         
         # Format each row nicely
-        for _, row in df.iterrows():
-            metric = row.get('metric', 'Unknown Metric')
-            control = row.get('control', 'N/A')
-            treatment = row.get('treatment', 'N/A')
-            diff = row.get('difference', 'N/A')
-            p_val = row.get('p_value', 'N/A')
-            
-            # Format p-value with stars for significance
-            sig_stars = ''
-            if isinstance(p_val, (int, float)):
-                if p_val < 0.001:
-                    sig_stars = '***'
-                elif p_val < 0.01:
-                    sig_stars = '**'
-                elif p_val < 0.05:
-                    sig_stars = '*'
-                p_val_str = f"{p_val:.4f}{sig_stars}"
-            else:
-                p_val_str = str(p_val)
-            
-            result += f"Metric: {metric}\n"
-            result += f"  Control: {control}\n"
-            result += f"  Treatment: {treatment}\n"
-            result += f"  Difference: {diff}\n"
-            result += f"  P-value: {p_val_str}\n\n"
-            
-        result += "Significance levels: * p<0.05, ** p<0.01, *** p<0.001"
-        return result
+        rows = [
+            f"Metric: {m}\n  Control: {c}\n  Treatment: {t}\n  Difference: {d}\n  P-value: {p}\n\n"
+            for m, c, t, d, p in zip(metric, control, treatment, diff, p_val_str)
+        ]
+        return "A/B Test Results:\n\n" + "".join(rows) + "Significance levels: * p<0.05, ** p<0.01, *** p<0.001"
         
     def _format_regression_results(self, df):
         """
         Format regression analysis results in a readable way
         """
-        result = "Regression Analysis Results:\n\n"
+        var, coef, std_err, t_val, p_val = self._row_values(
+            df, ['variable', 'coefficient', 'std_error', 't_value', 'p_value']
+        )
+        p_val_str = self._format_p_values(p_val)
         
         # Format each row nicely
-        for _, row in df.iterrows():
-            var = row.get('variable', 'Unknown Variable')
-            coef = row.get('coefficient', 'N/A')
-            std_err = row.get('std_error', 'N/A')
-            t_val = row.get('t_value', 'N/A')
-            p_val = row.get('p_value', 'N/A')
-            
-            # Format p-value with stars for significance
-            sig_stars = ''
-            if isinstance(p_val, (int, float)):
-                if p_val < 0.001:
-                    sig_stars = '***'
-                elif p_val < 0.01:
-                    sig_stars = '**'
-                elif p_val < 0.05:
-                    sig_stars = '*'
-                p_val_str = f"{p_val:.4f}{sig_stars}"
-            else:
-                p_val_str = str(p_val)
-            
-            result += f"Variable: {var}\n"
-            result += f"  Coefficient: {coef}\n"
-            result += f"  Std Error: {std_err}\n"
-            result += f"  t-value: {t_val}\n"
-            result += f"  P-value: {p_val_str}\n\n"
-            
-        result += "Significance levels: * p<0.05, ** p<0.01, *** p<0.001"
-        return result
+        rows = [
+            f"Variable: {v}\n  Coefficient: {c}\n  Std Error: {e}\n  t-value: {t}\n  P-value: {p}\n\n"
+            for v, c, e, t, p in zip(var, coef, std_err, t_val, p_val_str)
+        ]
+        return "Regression Analysis Results:\n\n" + "".join(rows) + "Significance levels: * p<0.05, ** p<0.01, *** p<0.001"
+
+    def _format_weblab_results(self, df):
+        """
+        Format a weblab experiment export with one compact line per metric and segment
+
+        Rows without a metric name (the blank lines of some exports) are left out.
+        """
+        df = df[df['metric_name'].notna()]
+        def column(name):
+            if name in df.columns:
+                return df[name].to_numpy()
+            return np.full(len(df), np.nan)
+
+        def number(value, spec):
+            return 'n/a' if pd.isna(value) else format(value, spec)
+
+        header = "Weblab Experiment Results"
+        details = []
+        for name, label in [('weblab_id', 'weblab'), ('analysis_start_date', 'from'), ('analysis_end_date', 'to')]:
+            if name in df.columns and df[name].notna().any():
+                details.append(f"{label} {df[name].dropna().iloc[0]}")
+
+        # Name the compared treatments once if every row compares the same pair
+        pairs = df['treatment_name_a'].astype(str) + ' vs ' + df['treatment_name_b'].astype(str)
+        single_pair = pairs.nunique() == 1
+        if single_pair:
+            details.append(f"{pairs.iloc[0]} (B relative to A)")
+        if details:
+            header += f" ({', '.join(details)})"
+
+        # Segment: the dimension plus the segmentation when it is not the overall population
+        segment = df['dimensions_string'].astype(str)
+        if 'segmentation_name' in df.columns and 'segment_value' in df.columns:
+            segmented = df['segmentation_name'].notna() & (df['segmentation_name'].astype(str) != 'all')
+            segment = segment.where(~segmented, segment + ' / ' + df['segmentation_name'].astype(str)
+                                    + '=' + df['segment_value'].astype(str))
+        if not single_pair:
+            segment = segment + ' [' + pairs + ']'
+
+        # Sample sizes: customer counts when available, otherwise metric counts
+        count_a = np.where(pd.isna(column('customer_count_a')), column('metric_count_a'), column('customer_count_a'))
+        count_b = np.where(pd.isna(column('customer_count_b')), column('metric_count_b'), column('customer_count_b'))
+
+        p_values = column('metric_p_value').astype(float)
+        stars = np.select([p_values < 0.001, p_values < 0.01, p_values < 0.05], ['***', '**', '*'], '')
+
+        rows = [
+            f"- {metric} | {seg}: percent impact {number(impact, '+.4g')} "
+            f"[{number(lower, '+.4g')}, {number(upper, '+.4g')}], "
+            f"P(impact>0)={number(probability, '.3f')}, p={number(p_value, '.4f')}{star}, "
+            f"annualized {number(annualized, ',.0f')} [{number(annualized_lower, ',.0f')}, {number(annualized_upper, ',.0f')}], "
+            f"n={number(n_a, ',.0f')}/{number(n_b, ',.0f')}"
+            for metric, seg, impact, lower, upper, probability, p_value, star,
+                annualized, annualized_lower, annualized_upper, n_a, n_b in zip(
+                df['metric_name'].to_numpy(), segment.to_numpy(),
+                column('overall_percent_impact'), column('overall_percent_ci_lower'), column('overall_percent_ci_upper'),
+                column('overall_posterior_probability_positive'), p_values, stars,
+                column('overall_annualized_impact'), column('overall_annualized_ci_lower'),
+                column('overall_annualized_ci_upper'), count_a, count_b
+            )
+        ]
+        return (f"{header}:\n"
+                "Each line: metric | segment: percent impact [CI lower, CI upper], posterior probability "
+                "of a positive impact, p-value, annualized impact [CI], sample size A/B\n\n"
+                + "\n".join(rows)
+                + "\n\nSignificance levels: * p<0.05, ** p<0.01, *** p<0.001")
+
+    def _row_values(self, df, columns):
+        """
+        Get the values of the given columns as arrays of the scalars a row of the DataFrame holds
+
+        The columns are converted to the dtype shared by the whole frame, so values render
+        exactly as they would in a row (e.g. ints become floats in an all-numeric frame).
+        """
+        common_dtype = df.iloc[:0].to_numpy().dtype
+        values = df[columns].to_numpy(dtype=common_dtype)
+        return [values[:, i] for i in range(len(columns))]
+
+    def _format_p_values(self, p_values):
+        """
+        Format p-values with stars for significance: * p<0.05, ** p<0.01, *** p<0.001
+
+        Numeric values are shown with four decimals, anything else (e.g. 'N/A') as is.
+        """
+        if p_values.dtype == object:
+            is_number = np.fromiter((isinstance(p, (int, float)) for p in p_values), dtype=bool, count=len(p_values))
+        else:
+            # Only float64 scalars are Python floats; NumPy ints and smaller floats are shown as is
+            is_number = np.full(len(p_values), p_values.dtype == np.float64)
+
+        numbers = np.zeros(len(p_values))
+        numbers[is_number] = p_values[is_number].astype(float)
+        stars = np.select([numbers < 0.001, numbers < 0.01, numbers < 0.05], ['***', '**', '*'], '')
 
+        return [
+            f"{p:.4f}{star}" if number else str(p)
+            for p, star, number in zip(p_values, stars, is_number)
+        ]
@@ -0,0 +1,224 @@
+import re
+from typing import List, Tuple, Iterator
+from src.services.model_registry import estimate_tokens
+
+class PromptSplitter:
+    """
+    Splits prompts built by PromptBuilder into chunks that fit in a model's context window
+
+    The prompt is cut into its '## ' sections. The introduction, the user instructions and the
+    required output format are copied into every chunk, so each model call knows its task and
+    the response format. The other sections (examples, data, field descriptions, partial
+    analyses) are divided only between records: whole examples, blank-line separated blocks
+    such as one metric of A/B test results, or single lines such as one weblab row or one field
+    description. A record is only broken up (into lines, then words) if it cannot fit in a chunk
+    on its own, so no chunk ever exceeds max_tokens estimated tokens.
+    """
+    SECTION_PATTERN = re.compile(r'^## [^\n]*$', re.MULTILINE)
+    BLANK_LINES_PATTERN = re.compile(r'\n[ \t]*\n\s*')
+    EXAMPLE_PATTERN = re.compile(r'\n(?=### )')
+    WORD_PATTERN = re.compile(r'\S+')
+    # Sections copied into every chunk, dropped from the end of the list while they take more
+    # than MAX_REPLICATED_SHARE of the budget
+    REPLICATED_SECTIONS = ('REQUIRED OUTPUT FORMAT', 'USER INSTRUCTIONS')
+    MAX_REPLICATED_SHARE = 0.5
+    # A short first block ending in ':' (e.g. a table legend) is repeated when its section continues
+    MAX_LEAD_SHARE = 0.1
+    PART_NOTE = ("(This is part {part} of {parts} of the input. The other parts are analyzed separately, "
+                 "so only describe the data in this part.)")
+
+    def __init__(self, max_tokens: int):
+        """
+        Initialize the PromptSplitter
+
+        Args:
+            max_tokens (int): Largest number of estimated tokens in a chunk
+        """
+        self.max_tokens = max(1, int(max_tokens))
+
+    def split(self, prompt: str) -> List[str]:
+        """
+        Split a prompt into chunks of at most max_tokens estimated tokens
+
+        Args:
+            prompt (str): The prompt to split
+
+        Returns:
+            List[str]: The chunks, or the unchanged prompt if it already fits
+        """
+        if estimate_tokens(prompt) <= self.max_tokens:
+            return [prompt]
+
+        sections = self.parse_sections(prompt)
+        head, content, tail = self._choose_replicated(sections)
+        fixed_tokens = sum(estimate_tokens(text) for text in head + tail)
+        if head or tail:
+            fixed_tokens += estimate_tokens(self.PART_NOTE.format(part=99999, parts=99999))
+
+        bodies = self._pack(content, self.max_tokens - fixed_tokens)
+        if len(bodies) == 1 and not (head or tail):
+            return bodies
+        chunks = []
+        for i, body in enumerate(bodies):
+            parts = list(head)
+            if head or tail:
+                parts.append(self.PART_NOTE.format(part=i + 1, parts=len(bodies)))
+            parts.append(body)
+            parts.extend(tail)
+            chunks.append("\n\n".join(part.strip() for part in parts if part.strip()))
+        return chunks
+
+    def parse_sections(self, prompt: str) -> List[Tuple[str, str]]:
+        """
+        Cut a prompt into its '## ' sections
+
+        Args:
+            prompt (str): The prompt to parse
+
+        Returns:
+            List[Tuple[str, str]]: (title, text) pairs in prompt order, where the text starts
+            with the section's header line. The text before the first header has the title ''.
+        """
+        sections = []
+        title = ''
+        start = 0
+        for match in self.SECTION_PATTERN.finditer(prompt):
+            sections.append((title, prompt[start:match.start()]))
+            title = match.group(0)[3:].strip().rstrip(':').strip()
+            start = match.start()
+        sections.append((title, prompt[start:]))
+        return [(title, text) for title, text in sections if text.strip()]
+
+    def _choose_replicated(self, sections: List[Tuple[str, str]]):
+        """
+        Decide which sections are copied into every chunk
+
+        Returns:
+            Tuple: texts of the replicated sections before the first divided section, the
+            divided (title, text) sections, and texts of the replicated sections after them
+        """
+        if not any(title for title, _ in sections):
+            # Not a PromptBuilder prompt: everything is divided
+            return [], sections, []
+
+        for count in range(len(self.REPLICATED_SECTIONS), -1, -1):
+            names = self.REPLICATED_SECTIONS[:count]
+            head, content, tail = [], [], []
+            for title, text in sections:
+                replicated = count > 0 and (title == '' or title.startswith(names))
+                if not replicated:
+                    content.append((title, text))
+                elif content:
+                    tail.append(text)
+                else:
+                    head.append(text)
+            replicated_tokens = sum(estimate_tokens(text) for text in head + tail)
+            if replicated_tokens <= self.max_tokens * self.MAX_REPLICATED_SHARE:
+                return head, content, tail
+        return [], sections, []
+
+    def _records(self, title: str, text: str) -> Tuple[str, List[str]]:
+        """
+        Get the header line and the records of a section
+        """
+        if title:
+            header, _, body = text.partition('\n')
+        else:
+            header, body = '', text
+        if title.startswith('EXAMPLES'):
+            blocks = self.EXAMPLE_PATTERN.split(body)
+        else:
+            blocks = self.BLANK_LINES_PATTERN.split(body)
+        return header.strip(), [block.strip('\n') for block in blocks if block.strip()]
+
+    def _pieces(self, block: str, limit: int) -> Iterator[Tuple[str, str, int]]:
+        """
+        Yield (text, separator, tokens) pieces of a block with at most limit estimated tokens each
+
+        The block is kept whole if it fits, and is otherwise divided into lines, then words,
+        then runs of characters.
+        """
+        tokens = estimate_tokens(block)
+        if tokens <= limit:
+            yield block, '\n\n', tokens
+            return
+        lines = block.split('\n')
+        for i, line in enumerate(lines):
+            line_separator = '\n\n' if i == len(lines) - 1 else '\n'
+            tokens = estimate_tokens(line)
+            if tokens <= limit:
+                yield line, line_separator, tokens
+                continue
+            words = self.WORD_PATTERN.findall(line)
+            for j, word in enumerate(words):
+                separator = line_separator if j == len(words) - 1 else ' '
+                tokens = estimate_tokens(word)
+                if tokens <= limit:
+                    yield word, separator, tokens
+                    continue
+                # No run of limit characters has more than limit tokens
+                for start in range(0, len(word), limit):
+                    end = start + limit
+                    yield word[start:end], separator if end >= len(word) else '', estimate_tokens(word[start:end])
+
+    def _pack(self, sections: List[Tuple[str, str]], budget: int) -> List[str]:
+        """
+        Pack the records of the divided sections into as few chunk bodies as possible
+
+        Args:
+            sections: (title, text) sections to divide, in prompt order
+            budget (int): Estimated tokens available for the divided sections in each chunk
+
+        Returns:
+            List[str]: The chunk bodies
+        """
+        bodies = []
+        current = []
+        used = 0
+
+        def flush():
+            nonlocal current, used
+            if current:
+                bodies.append("".join(current).strip())
+            current = []
+            used = 0
+
+        for title, text in sections:
+            header, blocks = self._records(title, text)
+            continued = f"## {title} (continued):" if title else ''
+            lead = None
+            if (len(blocks) > 1 and blocks[0].split('\n', 1)[0].rstrip().endswith(':')
+                    and estimate_tokens(blocks[0]) <= self.max_tokens * self.MAX_LEAD_SHARE):
+                lead = blocks[0]
+            header_tokens = max(estimate_tokens(header), estimate_tokens(continued))
+            lead_tokens = estimate_tokens(lead) if lead else 0
+            limit = budget - header_tokens - lead_tokens
+            if limit < 1:
+                # The budget is too small to repeat headers; only the records are kept
+                header = continued = ''
+                lead, header_tokens, lead_tokens = None, 0, 0
+                limit = max(1, budget)
+
+            def opening(i):
+                # Header lines written before the section's first piece in a chunk
+                if not seen:
+                    return [header + '\n'] if header else []
+                texts = [continued + '\n'] if continued else []
+                if lead and i > 0:
+                    texts.append(lead + '\n\n')
+                return texts
+
+            started = seen = False
+            for i, block in enumerate(blocks):
+                for piece, separator, cost in self._pieces(block, limit):
+                    texts = [] if started else opening(i)
+                    if current and used + sum(map(estimate_tokens, texts)) + cost > budget:
+                        flush()
+                        started = False
+                        texts = opening(i)
+                    current.extend(texts)
+                    current.append(piece + separator)
+                    used += sum(map(estimate_tokens, texts)) + cost
+                    started = seen = True
+        flush()
+        return bodies
@@ -0,0 +1,264 @@
+import os
+import time
+import random
+import threading
+from typing import Callable, Dict, Any, Optional, Tuple
+from botocore.exceptions import BotoCoreError, ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+
+# Error codes of throttled requests; the request rate of the model is reduced when one is received.
+# Codes are compared in lower case because errors in response streams use camelCase names.
+THROTTLING_ERROR_CODES = {'throttlingexception', 'toomanyrequestsexception', 'throttling'}
+# Error codes of transient failures of the service, retried without changing the request rate
+TRANSIENT_ERROR_CODES = {'serviceunavailableexception', 'internalserverexception',
+                         'modelnotreadyexception', 'modeltimeoutexception'}
+
+THROTTLED = 'throttled'
+TRANSIENT = 'transient'
+
+
+def error_code(error: Exception) -> Optional[str]:
+    """
+    Get the AWS error code of a ClientError, or None for other errors
+    """
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code')
+    return None
+
+
+def classify_error(error: Exception) -> Optional[str]:
+    """
+    Decide whether a failed call is worth retrying
+
+    Returns:
+        Optional[str]: THROTTLED for throttling errors, TRANSIENT for server errors (5xx) and
+        connection failures, None for errors that would fail again (validation, access, ...)
+    """
+    if isinstance(error, ClientError):
+        code = (error_code(error) or '').lower()
+        if code in THROTTLING_ERROR_CODES:
+            return THROTTLED
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        if code in TRANSIENT_ERROR_CODES or status >= 500:
+            return TRANSIENT
+        return None
+    if isinstance(error, (BotoConnectionError, HTTPClientError)):
+        return TRANSIENT
+    return None
+
+
+class ModelInvocationError(Exception):
+    """
+    A model call failed, either with an error that is not retried or after the last retry
+
+    Attributes:
+        model_id (str): ID of the model that was called
+        code (str): AWS error code, None for connection failures
+        retries (int): Number of times the call was retried before giving up
+    """
+    def __init__(self, model_id: str, error: Exception, retries: int = 0):
+        self.model_id = model_id
+        self.code = error_code(error)
+        self.retries = retries
+        attempts = f" after {retries} retries" if retries else ""
+        super().__init__(f"Call to {model_id} failed{attempts}: {error}")
+
+
+class _ModelBucket:
+    """
+    Token bucket and counters of one model
+    """
+    def __init__(self, rate: float, burst: float):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        # Requests sent before this time were sent at the rate before the last decrease
+        self.decreased_at = float('-inf')
+        self.counters = {'requests': 0, 'succeeded': 0, 'throttled': 0, 'transient_errors': 0, 'failed': 0,
+                         'retries': 0, 'rate_decreases': 0, 'wait_seconds': 0.0, 'backoff_seconds': 0.0}
+
+
+class AdaptiveRateLimiter:
+    """
+    Client-side request rate limit per model, adapted to the throttling of the service
+
+    Every call to a model takes a token from the model's bucket, which is refilled at the
+    model's current rate and holds at most burst tokens; callers wait for their token, so the
+    threads of a process share the rate instead of each sending as fast as it can. The rate is
+    adapted with AIMD: every successful call raises it by additive_increase requests per second
+    over one second of calls, and a throttled call halves it (decrease_factor), at most once per
+    round of calls sent at the old rate. Throttled calls, server errors and connection failures
+    are retried up to max_retries times after an exponential backoff with full jitter, so
+    retrying threads don't hit the service again at the same moment.
+
+    The limiter keeps its state per process: after a fork the child starts with fresh buckets.
+    """
+    def __init__(self, initial_rate: float = 5.0, min_rate: float = 0.2, max_rate: float = 50.0,
+                 burst: float = 10, additive_increase: float = 2.0, decrease_factor: float = 0.5,
+                 max_retries: int = 5, base_backoff_seconds: float = 0.5, max_backoff_seconds: float = 20.0):
+        """
+        Initialize the AdaptiveRateLimiter
+
+        Args:
+            initial_rate (float): Requests per second allowed for a model before any feedback
+            min_rate (float): Lowest rate a model is slowed down to
+            max_rate (float): Highest rate a model is sped up to
+            burst (float): Largest number of requests sent at once after a quiet period
+            additive_increase (float): Requests per second added to the rate for each second of successful calls
+            decrease_factor (float): Factor the rate is multiplied with when a call is throttled
+            max_retries (int): Largest number of retries of a call (0 to never retry)
+            base_backoff_seconds (float): Upper bound of the wait before the first retry, doubled for every retry
+            max_backoff_seconds (float): Largest wait before a retry
+        """
+        self.initial_rate = max(min_rate, min(initial_rate, max_rate))
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = max(1.0, float(burst))
+        self.additive_increase = additive_increase
+        self.decrease_factor = decrease_factor
+        self.max_retries = max(0, int(max_retries))
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _bucket(self, model_id: str) -> _ModelBucket:
+        if self._pid != os.getpid():
+            # Locks may have been held by other threads of the parent at the time of the fork
+            self._lock = threading.Lock()
+            self._buckets = {}
+            self._pid = os.getpid()
+        bucket = self._buckets.get(model_id)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.setdefault(model_id, _ModelBucket(self.initial_rate, self.burst))
+        return bucket
+
+    def acquire(self, model_id: str) -> float:
+        """
+        Wait until a call to the model is allowed
+
+        Tokens are reserved in arrival order: a caller finding the bucket empty takes a token
+        it is owed and sleeps until it has been refilled.
+
+        Returns:
+            float: time.monotonic() at which the call may be sent
+        """
+        bucket = self._bucket(model_id)
+        with bucket.lock:
+            now = time.monotonic()
+            bucket.tokens = min(bucket.burst, bucket.tokens + (now - bucket.updated) * bucket.rate)
+            bucket.updated = now
+            bucket.tokens -= 1
+            wait = -bucket.tokens / bucket.rate if bucket.tokens < 0 else 0.0
+            bucket.counters['requests'] += 1
+            bucket.counters['wait_seconds'] += wait
+        if wait > 0:
+            time.sleep(wait)
+        return now + wait
+
+    def record_success(self, model_id: str):
+        """
+        Raise the rate of a model after a successful call
+        """
+        bucket = self._bucket(model_id)
+        with bucket.lock:
+            # A rate of r gets r successful calls per second, so the rate grows by
+            # additive_increase per second however fast the calls are
+            bucket.rate = min(self.max_rate, bucket.rate + self.additive_increase / bucket.rate)
+            bucket.counters['succeeded'] += 1
+
+    def record_throttle(self, model_id: str, sent_at: float):
+        """
+        Lower the rate of a model after a throttled call
+
+        Args:
+            model_id (str): ID of the model
+            sent_at (float): time.monotonic() at which the throttled call was sent; calls sent
+                before the last decrease were sent at the old rate and don't lower it again
+        """
+        bucket = self._bucket(model_id)
+        with bucket.lock:
+            bucket.counters['throttled'] += 1
+            if sent_at < bucket.decreased_at:
+                return
+            bucket.rate = max(self.min_rate, bucket.rate * self.decrease_factor)
+            bucket.decreased_at = time.monotonic()
+            # Don't let the calls waiting for a retry burst out at once
+            bucket.tokens = min(bucket.tokens, 0.0)
+            bucket.counters['rate_decreases'] += 1
+
+    def backoff_seconds(self, retry: int) -> float:
+        """
+        Get a random wait before a retry, between 0 and base_backoff_seconds * 2 ** retry
+        """
+        return random.uniform(0, min(self.max_backoff_seconds, self.base_backoff_seconds * 2 ** retry))
+
+    def call(self, model_id: str, fn: Callable[[], Any]) -> Tuple[Any, int]:
+        """
+        Call a model within its rate limit, retrying throttled and failed calls
+
+        Args:
+            model_id (str): ID of the model, which selects the token bucket
+            fn (callable): Makes the call and returns its result; raises BotoCoreError or ClientError
+
+        Returns:
+            Tuple[Any, int]: The result of fn and the number of retries it took
+
+        Raises:
+            ModelInvocationError: If the call fails with an error that is not retried, or still
+                fails after max_retries retries
+        """
+        retries = 0
+        while True:
+            sent_at = self.acquire(model_id)
+            try:
+                result = fn()
+            except (BotoCoreError, ClientError) as e:
+                kind = classify_error(e)
+                bucket = self._bucket(model_id)
+                if kind == THROTTLED:
+                    self.record_throttle(model_id, sent_at)
+                elif kind == TRANSIENT:
+                    with bucket.lock:
+                        bucket.counters['transient_errors'] += 1
+                if kind is None or retries >= self.max_retries:
+                    with bucket.lock:
+                        bucket.counters['failed'] += 1
+                    raise ModelInvocationError(model_id, e, retries) from e
+                delay = self.backoff_seconds(retries)
+                retries += 1
+                with bucket.lock:
+                    bucket.counters['retries'] += 1
+                    bucket.counters['backoff_seconds'] += delay
+                print(f"Call to {model_id} {kind} ({error_code(e) or type(e).__name__}), "
+                      f"retry {retries}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            self.record_success(model_id)
+            return result, retries
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the current rate and the call counters of each model
+        """
+        models = {}
+        for model_id, bucket in list(self._buckets.items()):
+            with bucket.lock:
+                models[model_id] = dict(bucket.counters, rate=round(bucket.rate, 3),
+                                        wait_seconds=round(bucket.counters['wait_seconds'], 3),
+                                        backoff_seconds=round(bucket.counters['backoff_seconds'], 3))
+        return {
+            'initial_rate': self.initial_rate,
+            'min_rate': self.min_rate,
+            'max_rate': self.max_rate,
+            'max_retries': self.max_retries,
+            'models': models
+        }
+
+
+# Limiter shared by all services in this process
+default_rate_limiter = AdaptiveRateLimiter()
@@ -0,0 +1,223 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any
+
+class LRUCache:
+    """
+    In-process cache backend with a bounded number of entries and a time-to-live
+    """
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600):
+        """
+        Initialize the LRUCache
+
+        Args:
+            max_entries (int): Maximum number of entries kept; the least recently used are evicted first
+            ttl_seconds (float): Number of seconds an entry stays valid after it was stored
+        """
+        self.name = 'memory'
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """
+    On-disk cache backend stored in a SQLite database, shared by every process that uses the same file
+    """
+    # Expired and surplus entries are removed after this many writes
+    PRUNE_EVERY = 100
+
+    def __init__(self, db_path: str, max_entries: int = 10000, ttl_seconds: float = 7 * 24 * 3600):
+        """
+        Initialize the SQLiteCache
+
+        Args:
+            db_path (str): Path to the SQLite database file (created on first use)
+            max_entries (int): Maximum number of entries kept; the least recently used are evicted first
+            ttl_seconds (float): Number of seconds an entry stays valid after it was stored
+        """
+        self.name = 'sqlite'
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Get the connection for the current thread, opening a new one after a fork
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entries ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            conn.commit()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            'SELECT value FROM cache_entries WHERE key = ? AND expires_at >= ?', (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE cache_entries SET accessed_at = ? WHERE key = ?', (now, key))
+        conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache_entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+            (key, json.dumps(value), now + self.ttl_seconds, now)
+        )
+        conn.commit()
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        """
+        Remove expired entries and the least recently used entries above max_entries
+        """
+        conn = self._connect()
+        conn.execute('DELETE FROM cache_entries WHERE expires_at < ?', (time.time(),))
+        conn.execute(
+            'DELETE FROM cache_entries WHERE key IN ('
+            'SELECT key FROM cache_entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+        conn.commit()
+
+    def clear(self):
+        conn = self._connect()
+        conn.execute('DELETE FROM cache_entries')
+        conn.commit()
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+
+
+class ResponseCache:
+    """
+    Content-addressed cache for model responses
+
+    Responses are keyed by a hash of the model id and the full request body, which contains the
+    prompt text and the inference parameters. Backends are checked in order (e.g. memory first,
+    then disk) and a hit in a slower backend is copied into the faster ones.
+    """
+    def __init__(self, backends: List[Any]):
+        """
+        Initialize the ResponseCache
+
+        Args:
+            backends (List): Cache backends (LRUCache, SQLiteCache) ordered from fastest to slowest
+        """
+        self.backends = backends
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_id: str, request_body: str) -> str:
+        """
+        Build the cache key for a model request
+
+        Args:
+            model_id (str): ID of the model the request is sent to
+            request_body (str): JSON request body including the prompt and inference parameters
+
+        Returns:
+            str: Hex digest identifying the request
+        """
+        digest = hashlib.sha256()
+        digest.update(model_id.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(request_body.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        for i, backend in enumerate(self.backends):
+            try:
+                value = backend.get(key)
+            except Exception as e:
+                print(f"Error reading from {backend.name} cache: {e}")
+                continue
+            if value is not None:
+                for faster_backend in self.backends[:i]:
+                    faster_backend.set(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value: str):
+        for backend in self.backends:
+            try:
+                backend.set(key, value)
+            except Exception as e:
+                print(f"Error writing to {backend.name} cache: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get hit/miss counters and the number of entries held by each backend
+        """
+        lookups = self.hits + self.misses
+        backends = {}
+        for backend in self.backends:
+            try:
+                backends[backend.name] = len(backend)
+            except Exception:
+                backends[backend.name] = None
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': backends
+        }
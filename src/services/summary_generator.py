@@ -1,7 +1,185 @@
 import json
 import re
 
+class IncrementalJSONParser:
+    """
+    Parser for a JSON object that arrives in fragments, such as a streamed model response
+
+    Text before the first '{' (for example a ```json fence or an introduction) and after the
+    matching '}' is ignored. Every fragment is scanned once, and each top-level field and each
+    item of a top-level array is reported as soon as it is complete, so a caller can show
+    'summary' and the first 'key_metrics' before the model has written the rest.
+
+    The response is kept as UTF-8 in a bytearray, which grows in place, so adding a fragment
+    does not copy the text received before it. The characters the parser looks for are all
+    ASCII and never occur inside the encoding of another character.
+    """
+    # Characters that change the parser state outside and inside strings
+    STRUCTURE_PATTERN = re.compile(rb'[{}\[\],:"]')
+    STRING_PATTERN = re.compile(rb'["\\]')
+
+    def __init__(self):
+        self.text = bytearray()
+        self.start = None
+        self.end = None
+        self._result = None
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._string_start = None
+        self._expect_key = False
+        self._key = None
+        self._value_start = None
+        self._item_start = None
+        self._item_index = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, fragment):
+        """
+        Add the next fragment of the response
+
+        Args:
+            fragment (str): Text following the previous fragment
+
+        Returns:
+            list: Events for the fields completed by this fragment, as dictionaries with the
+            'key' and 'value' of a top-level field, or the 'key', 'index' and 'value' of an
+            item of a top-level array
+        """
+        text = self.text
+        text += fragment.encode('utf-8')
+        events = []
+        while self._pos < len(text) and self.end is None:
+            if self.start is None:
+                start = text.find(b'{', self._pos)
+                if start < 0:
+                    self._pos = len(text)
+                    break
+                self.start = start
+                self._pos = start
+
+            if self._in_string:
+                match = self.STRING_PATTERN.search(text, self._pos)
+                if match is None:
+                    self._pos = len(text)
+                    break
+                i = match.start()
+                if text[i:i + 1] == b'\\':
+                    if i + 1 >= len(text):
+                        # Wait for the escaped character
+                        self._pos = i
+                        break
+                    self._pos = i + 2
+                    continue
+                self._in_string = False
+                self._pos = i + 1
+                if len(self._stack) == 1 and self._expect_key:
+                    try:
+                        self._key = json.loads(text[self._string_start:i + 1])
+                    except json.JSONDecodeError:
+                        self._key = None
+                    self._expect_key = False
+                continue
+
+            match = self.STRUCTURE_PATTERN.search(text, self._pos)
+            if match is None:
+                self._pos = len(text)
+                break
+            i = match.start()
+            char = text[i:i + 1]
+            self._pos = i + 1
+            depth = len(self._stack)
+
+            if char == b'"':
+                self._in_string = True
+                self._string_start = i
+            elif char in b'{[':
+                self._stack.append(char)
+                if depth == 0:
+                    self._expect_key = True
+                elif depth == 1 and char == b'[':
+                    self._item_start = i + 1
+                    self._item_index = 0
+            elif char == b':':
+                if depth == 1:
+                    self._value_start = i + 1
+            elif char == b',':
+                if depth == 1:
+                    events.extend(self._close_field(i))
+                    self._expect_key = True
+                elif depth == 2 and self._stack[1] == b'[':
+                    events.extend(self._close_item(i))
+                    self._item_start = i + 1
+            elif char in b'}]':
+                if depth == 2 and char == b']' and self._stack[1] == b'[':
+                    events.extend(self._close_item(i))
+                elif depth == 1 and char == b'}':
+                    events.extend(self._close_field(i))
+                    self._result = self._parse(self.text[self.start:i + 1])
+                    if self._result is None:
+                        # Braces in the text before the JSON, e.g. "{metric}"; look for the next object
+                        self._restart(self.start + 1)
+                        continue
+                    self.end = i + 1
+                self._stack.pop()
+        return events
+
+    def _restart(self, position):
+        self.start = None
+        self._pos = position
+        self._stack = []
+        self._key = None
+        self._value_start = None
+        self._expect_key = False
+
+    def _parse(self, json_str):
+        try:
+            result = json.loads(json_str)
+        except json.JSONDecodeError:
+            return None
+        return result if isinstance(result, dict) else None
+
+    def _close_item(self, end):
+        item_text = self.text[self._item_start:end]
+        if not item_text.strip():
+            return []
+        index = self._item_index
+        self._item_index += 1
+        try:
+            value = json.loads(item_text)
+        except json.JSONDecodeError:
+            return []
+        return [{'key': self._key, 'index': index, 'value': value}]
+
+    def _close_field(self, end):
+        if self._key is None or self._value_start is None:
+            return []
+        key = self._key
+        self._key = None
+        value_text = self.text[self._value_start:end]
+        self._value_start = None
+        try:
+            value = json.loads(value_text)
+        except json.JSONDecodeError:
+            return []
+        return [{'key': key, 'value': value}]
+
+    def result(self):
+        """
+        Get the parsed object once it is complete
+
+        Returns:
+            dict: The complete JSON object, or None if it has not been closed yet
+        """
+        return self._result
+
 class SummaryGenerator:
+    # Number of '{' positions tried when looking for the JSON object in a response
+    MAX_JSON_ATTEMPTS = 20
+
     def __init__(self):
         pass
         
@@ -43,27 +221,57 @@ class SummaryGenerator:
                 'raw_response': model_response
             }
     
+    def parse_partial(self, model_response):
+        """
+        Parse the JSON object returned for a single slice of the data in the map stage
+
+        Args:
+            model_response (str): The raw response from the GenAI model
+
+        Returns:
+            dict: The parsed partial analysis, or None if the response contains no JSON object
+        """
+        json_data = self._extract_json(model_response)
+        if isinstance(json_data, dict):
+            return json_data
+        return None
+
+    def parse_stream(self, fragments):
+        """
+        Parse a streamed model response and yield its fields as soon as they are complete
+
+        Args:
+            fragments: Iterable of pieces of the model response, in order
+
+        Yields:
+            dict: Events with the 'key' and 'value' of a completed top-level field, or the
+            'key', 'index' and 'value' of a completed item of a top-level array
+        """
+        parser = IncrementalJSONParser()
+        for fragment in fragments:
+            yield from parser.feed(fragment)
+            if parser.complete:
+                return
+
     def _extract_json(self, text):
         """
         Extract JSON from the model response
         """
-        # Try to find JSON in the response using regex
-        json_match = re.search(r'```json\s*([\s\S]*?)\s*```', text)
-        if json_match:
-            json_str = json_match.group(1)
-        else:
-            # Try to find JSON without the markdown code block
-            json_match = re.search(r'(\{[\s\S]*\})', text)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                return None
-                
-        try:
-            # Parse the JSON string
-            return json.loads(json_str)
-        except json.JSONDecodeError:
-            return None
+        # Decode the first JSON object in the response, skipping any ```json fence or text
+        # around it. Unlike a greedy regex this never backtracks over the rest of the response.
+        decoder = json.JSONDecoder()
+        start = text.find('{')
+        attempts = 0
+        while start >= 0 and attempts < self.MAX_JSON_ATTEMPTS:
+            try:
+                json_data, _ = decoder.raw_decode(text, start)
+                if isinstance(json_data, dict):
+                    return json_data
+            except json.JSONDecodeError:
+                pass
+            start = text.find('{', start + 1)
+            attempts += 1
+        return None
     
     def _parse_text_response(self, text):
         """
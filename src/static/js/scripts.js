@@ -44,6 +44,18 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    function showProgress(message) {
+        const loadingOverlay = document.getElementById('loading-overlay');
+        let progressText = document.getElementById('loading-progress');
+        if (!progressText) {
+            progressText = document.createElement('p');
+            progressText.id = 'loading-progress';
+            progressText.style.marginLeft = '20px';
+            loadingOverlay.appendChild(progressText);
+        }
+        progressText.textContent = message;
+    }
+    
     function hideLoading() {
         const loadingOverlay = document.getElementById('loading-overlay');
         if (loadingOverlay) {
@@ -75,12 +87,164 @@ document.addEventListener('DOMContentLoaded', function() {
         return true;
     }
     
+    // Poll a background analysis job until it finishes, then show its results
+    function pollJob(statusUrl, jobId) {
+        fetch(statusUrl)
+            .then(response => response.json())
+            .then(job => {
+                if (!job.status || job.status === 'succeeded' || job.status === 'failed') {
+                    // The results page is rendered by the server from the stored job
+                    window.location.href = '/?job=' + encodeURIComponent(jobId);
+                    return;
+                }
+                if (job.progress && job.progress.total > 0) {
+                    showProgress(`Analyzing... ${job.progress.done} of ${job.progress.total} model calls done`);
+                } else {
+                    showProgress(job.status === 'queued' ? 'Waiting for a free worker...' : 'Analyzing...');
+                }
+                setTimeout(() => pollJob(statusUrl, jobId), 1000);
+            })
+            .catch(() => setTimeout(() => pollJob(statusUrl, jobId), 2000));
+    }
+    
+    // Show the summary of one slice of the data while the rest is still being analyzed
+    function renderPartial(event) {
+        const container = document.getElementById('partial-results');
+        const section = document.createElement('div');
+        section.className = 'partial-result';
+        
+        const title = document.createElement('h3');
+        title.textContent = event.slice;
+        section.appendChild(title);
+        
+        const partial = event.partial || {};
+        const items = (partial.key_metrics || [])
+            .map(metric => [metric.metric_name, metric.interpretation].filter(Boolean).join(': '))
+            .concat(partial.findings || []);
+        const list = document.createElement('ul');
+        items.forEach(item => {
+            const listItem = document.createElement('li');
+            listItem.textContent = item;
+            list.appendChild(listItem);
+        });
+        section.appendChild(list);
+        container.appendChild(section);
+    }
+    
+    // Get the section of the live results for a field, creating it on first use
+    function liveSection(key, title, tagName, className) {
+        let section = document.getElementById('live-' + key);
+        if (!section) {
+            const wrapper = document.createElement('div');
+            wrapper.className = 'result-section';
+            const heading = document.createElement('h3');
+            heading.textContent = title;
+            wrapper.appendChild(heading);
+            section = document.createElement(tagName);
+            section.id = 'live-' + key;
+            if (className) {
+                section.className = className;
+            }
+            wrapper.appendChild(section);
+            document.getElementById('live-results').appendChild(wrapper);
+        }
+        return section;
+    }
+    
+    // Show a field of the final analysis as soon as the model has finished writing it
+    function renderField(field) {
+        const isItem = field.index !== undefined;
+        if (field.key === 'summary' && typeof field.value === 'string') {
+            liveSection('summary', 'Summary', 'div', 'summary-content').textContent = field.value;
+        } else if (field.key === 'statistical_significance' && typeof field.value === 'string') {
+            liveSection('statistical_significance', 'Statistical Significance', 'p').textContent = field.value;
+        } else if (field.key === 'key_metrics' && isItem) {
+            let body = document.getElementById('live-key_metrics-body');
+            if (!body) {
+                const table = liveSection('key_metrics', 'Key Metrics', 'table');
+                table.innerHTML = '<thead><tr><th>Metric</th><th>Value</th><th>Interpretation</th></tr></thead>';
+                body = document.createElement('tbody');
+                body.id = 'live-key_metrics-body';
+                table.appendChild(body);
+            }
+            const row = document.createElement('tr');
+            const metric = field.value || {};
+            [metric.metric_name, metric.value, metric.interpretation].forEach(value => {
+                const cell = document.createElement('td');
+                cell.textContent = value === undefined ? '' : value;
+                row.appendChild(cell);
+            });
+            body.appendChild(row);
+        } else if ((field.key === 'recommendations' || field.key === 'limitations') && isItem) {
+            const title = field.key === 'recommendations' ? 'Recommended Actions' : 'Limitations';
+            const listItem = document.createElement('li');
+            listItem.textContent = field.value;
+            liveSection(field.key, title, 'ul', field.key + '-list').appendChild(listItem);
+        } else {
+            return;
+        }
+        // The rendered fields replace the raw text of the response
+        document.getElementById('generated-text').style.display = 'none';
+    }
+    
+    // Follow a background analysis job through its server-sent events
+    function streamJob(data) {
+        const progressContainer = document.getElementById('progress-container');
+        const progressStatus = document.getElementById('progress-status');
+        const showResults = () => {
+            window.location.href = '/?job=' + encodeURIComponent(data.job_id);
+        };
+        
+        hideLoading();
+        document.getElementById('partial-results').innerHTML = '';
+        document.getElementById('generated-text').textContent = '';
+        document.getElementById('live-results').innerHTML = '';
+        progressStatus.textContent = 'Reading data...';
+        progressContainer.style.display = 'block';
+        
+        const events = new EventSource(data.events_url);
+        events.addEventListener('parse', event => {
+            const details = JSON.parse(event.data);
+            progressStatus.textContent = `Read ${details.rows} rows, analyzing...`;
+        });
+        events.addEventListener('map', event => {
+            const details = JSON.parse(event.data);
+            progressStatus.textContent = `Analyzing... ${details.done} of ${details.total} model calls done`;
+            renderPartial(details);
+        });
+        events.addEventListener('generate', event => {
+            const details = JSON.parse(event.data);
+            const generatedText = document.getElementById('generated-text');
+            progressStatus.textContent = 'Writing the analysis...';
+            if (!document.getElementById('live-results').hasChildNodes()) {
+                generatedText.style.display = 'block';
+            }
+            generatedText.textContent += details.text;
+            generatedText.scrollTop = generatedText.scrollHeight;
+        });
+        events.addEventListener('field', event => {
+            renderField(JSON.parse(event.data));
+        });
+        events.addEventListener('summary', () => {
+            progressStatus.textContent = 'Analysis complete';
+        });
+        events.addEventListener('end', () => {
+            events.close();
+            showResults();
+        });
+        events.onerror = () => {
+            // The browser reconnects on its own unless the stream was closed for good
+            if (events.readyState === EventSource.CLOSED) {
+                progressContainer.style.display = 'none';
+                showLoading();
+                pollJob(data.status_url, data.job_id);
+            }
+        };
+    }
+    
     // Add event listener for form submission
     if (analysisForm) {
         analysisForm.addEventListener('submit', function(event) {
-            // We don't prevent default because we want the form to submit normally
-            // This is because we're using server-side rendering for the results
-            
             // Validate the form
             if (!validateForm()) {
                 event.preventDefault();
@@ -89,6 +253,31 @@ document.addEventListener('DOMContentLoaded', function() {
             
             // Show loading indicator
             showLoading();
+            
+            // Run the analysis as a background job so the request returns right away.
+            // Without fetch the form is submitted normally and rendered by the server.
+            if (!window.fetch) {
+                return;
+            }
+            event.preventDefault();
+            fetch('/jobs', { method: 'POST', body: new FormData(analysisForm) })
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.job_id) {
+                        hideLoading();
+                        alert(data.error || 'The analysis could not be started.');
+                        return;
+                    }
+                    if (window.EventSource && data.events_url) {
+                        streamJob(data);
+                    } else {
+                        pollJob(data.status_url, data.job_id);
+                    }
+                })
+                .catch(() => {
+                    hideLoading();
+                    alert('The analysis could not be started.');
+                });
         });
     }
     
@@ -1,15 +1,44 @@
 import unittest
 import os
+import shutil
+import tempfile
+import time
+import re
 import pandas as pd
+import numpy as np
 import json
-from io import StringIO
+from collections import Counter
+from io import StringIO, BytesIO
 from unittest.mock import Mock, patch
+
+# Keep the uploads and caches of the app out of the working directory
+TEST_DATA_DIR = tempfile.mkdtemp()
+os.environ['UPLOAD_FOLDER'] = os.path.join(TEST_DATA_DIR, 'uploads')
+os.environ['CACHE_DIR'] = os.path.join(TEST_DATA_DIR, 'cache')
+
 from src.app import app
 from src.services.prompt_builder import PromptBuilder
-from src.services.summary_generator import SummaryGenerator
-from src.utils.file_handler import FileHandler
+from src.services.summary_generator import SummaryGenerator, IncrementalJSONParser
+from src.utils.file_handler import FileHandler, UploadLimitError
 from src.services.aws_bedrock import AWSBedrockService
-from src.services.example_manager import ExampleManager
+from src.services.example_manager import ExampleManager, ExampleIndex
+from src.services.example_vectors import VectorIndex
+from src.services.map_reduce_analyzer import MapReduceAnalyzer
+from src.services.response_cache import ResponseCache, LRUCache, SQLiteCache
+from src.services.client_pool import ClientPool, default_client_pool
+from src.services.rate_limiter import AdaptiveRateLimiter, ModelInvocationError
+from botocore.exceptions import ClientError
+from src.services.model_catalog import ModelCatalog
+from src.services.column_pruner import ColumnPruner
+from src.utils.weblab_format import WEBLAB_COLUMNS
+from src.services.job_manager import JobManager
+from src.services.batch_analyzer import BatchAnalyzer
+from src.services.file_watcher import FileWatcher
+from src.services.model_registry import estimate_tokens
+from src.services.prompt_splitter import PromptSplitter
+from src.utils.description_index import DescriptionIndex
+from src.utils.dataframe_cache import DataFrameCache
+from src.utils.retention import RetentionManager, shard_path
 
 class TestApp(unittest.TestCase):
     def setUp(self):
@@ -24,110 +53,15 @@ average_order_value,45.5,48.2,2.7,0.03
 bounce_rate,0.35,0.32,-0.03,0.06
 """
         # Create a test file
-        os.makedirs('test_uploads', exist_ok=True)
-        with open('test_uploads/test.csv', 'w') as f:
+        self.upload_folder = tempfile.mkdtemp()
+        self.test_csv_path = os.path.join(self.upload_folder, 'test.csv')
+        with open(self.test_csv_path, 'w') as f:
             f.write(self.test_csv_data)
 
     def tearDown(self):
         # Clean up test files
-        if os.path.exists('test_uploads/test.csv'):
-            os.remove('test_uploads/test.csv')
-        if os.path.exists('test_uploads'):
-            os.rmdir('test_uploads')
-
-    # Add new test class for AWSBedrockService
-    class TestAWSBedrockService(unittest.TestCase):
-        def setUp(self):
-            self.bedrock_service = AWSBedrockService('anthropic.claude-v2')
-
-        @patch('boto3.client')
-        def test_chunk_size_selection(self, mock_boto3):
-            """Test that correct chunk sizes are selected for different models"""
-            # Test for different model types
-            models = {
-                'anthropic.claude-v2': 1800,
-                'amazon.titan': 1500,
-                'meta.llama': 1500,
-                'cohere.command': 1500,
-                'unknown.model': 1000
-            }
-            
-            for model_id, expected_size in models.items():
-                service = AWSBedrockService(model_id)
-                self.assertEqual(service._get_chunk_size(), expected_size)
-
-        def test_split_into_chunks(self):
-            """Test the chunk splitting functionality"""
-            # Create a long text with known sentence boundaries
-            long_text = "This is sentence one. This is sentence two. " * 50
-            chunk_size = 100
-            
-            chunks = self.bedrock_service._split_into_chunks(long_text, chunk_size)
-            
-            # Verify each chunk
-            for chunk in chunks:
-                self.assertLessEqual(len(chunk), chunk_size)
-                # Verify chunks end with complete sentences
-                self.assertTrue(chunk.endswith('.') or chunk.endswith('!') or chunk.endswith('?'))
-
-        @patch('boto3.client')
-        def test_process_chunk(self, mock_boto3):
-            """Test processing of individual chunks"""
-            # Mock the AWS response
-            mock_response = {
-                'body': Mock(read=lambda: json.dumps({'completion': 'Test response'}))
-            }
-            mock_boto3.return_value.invoke_model.return_value = mock_response
-            
-            response = self.bedrock_service._process_chunk("Test prompt")
-            self.assertEqual(response, 'Test response')
-
-        @patch('boto3.client')
-        def test_get_model_response(self, mock_boto3):
-            """Test the complete response generation process"""
-            # Mock the AWS response
-            mock_response = {
-                'body': Mock(read=lambda: json.dumps({'completion': 'Test response'}))
-            }
-            mock_boto3.return_value.invoke_model.return_value = mock_response
-            
-            # Test with a long prompt
-            long_prompt = "Test prompt. " * 1000
-            response = self.bedrock_service.get_model_response(long_prompt)
-            
-            # Verify the response
-            self.assertIsInstance(response, str)
-            self.assertTrue(len(response) > 0)
-
-        @patch('boto3.client')
-        def test_streaming_response(self, mock_boto3):
-            """Test the streaming response functionality"""
-            # Mock the AWS response
-            mock_response = {
-                'body': Mock(read=lambda: json.dumps({'completion': 'Test response'}))
-            }
-            mock_boto3.return_value.invoke_model.return_value = mock_response
-            
-            # Test with a long prompt
-            long_prompt = "Test prompt. " * 1000
-            responses = list(self.bedrock_service.get_model_response_streaming(long_prompt))
-            
-            # Verify we got multiple chunks
-            self.assertTrue(len(responses) > 0)
-            for response in responses:
-                self.assertIsInstance(response, str)
-
-        def test_error_handling(self):
-            """Test error handling in the service"""
-            # Test with invalid model ID
-            with self.assertRaises(Exception):
-                AWSBedrockService('invalid.model')
-            
-            # Test with empty prompt
-            response = self.bedrock_service.get_model_response("")
-            self.assertTrue("Error" in response)
+        shutil.rmtree(self.upload_folder, ignore_errors=True)
 
-    # Existing tests...
     def test_index_route(self):
         response = self.app.get('/')
         self.assertEqual(response.status_code, 200)
@@ -207,9 +141,9 @@ bounce_rate,0.35,0.32,-0.03,0.06
         self.assertEqual(result['recommendations'][0], "Implement the treatment version")
     
     def test_file_handler(self):
-        file_handler = FileHandler(upload_folder='test_uploads')
+        file_handler = FileHandler(upload_folder=self.upload_folder)
         
-        df = file_handler.read_csv('test_uploads/test.csv')
+        df = file_handler.read_csv(self.test_csv_path)
         self.assertEqual(len(df), 3)
         self.assertEqual(len(df.columns), 5)
         
@@ -239,7 +173,7 @@ bounce_rate,0.35,0.32,-0.03,0.06
             
         try:
             # Test with field_name,description format
-            file_handler_with_desc_1 = FileHandler(upload_folder='test_uploads', descriptions_path=temp_path_1)
+            file_handler_with_desc_1 = FileHandler(upload_folder=self.upload_folder, descriptions_path=temp_path_1)
             descriptions_1 = file_handler_with_desc_1.get_field_descriptions(df)
             self.assertIn('conversion_rate', descriptions_1)
             self.assertEqual(descriptions_1['conversion_rate'], 'The percentage of users who completed a desired action')
@@ -247,7 +181,7 @@ bounce_rate,0.35,0.32,-0.03,0.06
             self.assertEqual(descriptions_1['p_value'], 'The probability that the observed difference occurred by chance')
             
             # Test with Column,Description format
-            file_handler_with_desc_2 = FileHandler(upload_folder='test_uploads', descriptions_path=temp_path_2)
+            file_handler_with_desc_2 = FileHandler(upload_folder=self.upload_folder, descriptions_path=temp_path_2)
             descriptions_2 = file_handler_with_desc_2.get_field_descriptions(df)
             self.assertIn('conversion_rate', descriptions_2)
             self.assertEqual(descriptions_2['conversion_rate'], 'The percentage of users who completed a desired action')
@@ -255,7 +189,7 @@ bounce_rate,0.35,0.32,-0.03,0.06
             self.assertEqual(descriptions_2['p_value'], 'The probability that the observed difference occurred by chance')
             
             # Test with custom column names
-            file_handler_with_desc_3 = FileHandler(upload_folder='test_uploads', descriptions_path=temp_path_3)
+            file_handler_with_desc_3 = FileHandler(upload_folder=self.upload_folder, descriptions_path=temp_path_3)
             descriptions_3 = file_handler_with_desc_3.get_field_descriptions(df)
             self.assertIn('conversion_rate', descriptions_3)
             self.assertEqual(descriptions_3['conversion_rate'], 'The percentage of users who completed a desired action')
@@ -368,6 +302,14 @@ revenue,1000,1200,200,0.02
             selected = example_manager.select_examples(test_df, max_examples=1)
             self.assertEqual(len(selected), 1)
             self.assertEqual(selected[0]['metadata']['id'], 'test1')  # Should select test1 due to metric overlap
+            self.assertAlmostEqual(selected[0]['relevance_score'], 2 / 3)
+            self.assertIn('### EXAMPLE: Test Example 1', selected[0]['prompt_text'])
+            self.assertIn('### EXAMPLE: Test Example 1', PromptBuilder().build_prompt('x', test_df, examples=selected))
+
+            # Examples sharing no metric still fill up the selection
+            selected = example_manager.select_examples(test_df, max_examples=3)
+            self.assertEqual([e['metadata']['id'] for e in selected], ['test1', 'test2'])
+            self.assertEqual(selected[1]['relevance_score'], 0.0)
             
             # Test random example selection
             random_examples = example_manager.get_random_examples(max_examples=1)
@@ -378,7 +320,1613 @@ revenue,1000,1200,200,0.02
             # Clean up
             shutil.rmtree(temp_dir)
 
-if __name__ == '__main__':
-    unittest.main()
+class TestColumnarStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_round_trip_is_memory_mapped(self):
+        import numpy as np
+        from src.utils.columnar_store import ColumnarStore
+        store = ColumnarStore(self.temp_dir, 'npy')
+        df = pd.DataFrame({
+            'metric': ['a', np.nan, 'b', 'a'],
+            'value': [1.5, np.nan, 2.0, 3.0],
+            'count': [1, 2, 3, 4],
+            'rate': [0.1, 0.2, 0.3, 0.4],
+            'flag': [True, False, True, True],
+            'segment': pd.Categorical(['x', 'y', None, 'x'], categories=['z', 'y', 'x']),
+            'day': pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04'])
+        })
+        self.assertTrue(store.write('frame', df))
+        loaded = store.read('frame')
+        pd.testing.assert_frame_equal(loaded, df)
+        self.assertIsInstance(loaded['value'].values.base, np.memmap)
+        # DataFrames the format cannot hold are left to the caller
+        self.assertFalse(store.write('mixed', pd.DataFrame({'value': [1, 'a']})))
+        self.assertFalse(store.write('indexed', df.set_index('day')))
+        self.assertIsNone(store.read('missing'))
+
+    def test_parsed_uploads_and_example_data_are_stored_columnar(self):
+        examples_dir = os.path.join(self.temp_dir, 'examples')
+        shutil.copytree('src/examples', examples_dir)
+        cache_dir = os.path.join(self.temp_dir, 'cache')
+        manager = ExampleManager(examples_dir=examples_dir, data_cache_dir=cache_dir)
+        with patch('src.services.example_manager.pd.read_csv', side_effect=AssertionError("parsed again")):
+            cached = ExampleManager(examples_dir=examples_dir, data_cache_dir=cache_dir)
+        self.assertEqual(len(cached._index.entries), len(manager._index.entries))
+        for entry in manager._index.entries:
+            example_id = entry['metadata']['id']
+            pd.testing.assert_frame_equal(cached.get_example_data(example_id), manager.get_example_data(example_id))
+
+        file_handler = FileHandler(upload_folder=self.temp_dir, dataframe_cache=DataFrameCache(cache_dir))
+        df = file_handler.read_csv('src/uploads/ASIN-B01M0EW6RB.csv')
+        self.assertTrue(any(name.endswith('.npy') for _, names, _ in os.walk(cache_dir) for name in names))
+        other_handler = FileHandler(upload_folder=self.temp_dir, dataframe_cache=DataFrameCache(cache_dir))
+        pd.testing.assert_frame_equal(other_handler.read_csv('src/uploads/ASIN-B01M0EW6RB.csv'), df)
+        self.assertEqual(other_handler.dataframe_cache.stats()['disk_hits'], 1)
+
+    def test_copies_of_changed_example_data_are_swept(self):
+        examples_dir = os.path.join(self.temp_dir, 'examples')
+        shutil.copytree('src/examples', examples_dir)
+        cache_dir = os.path.join(self.temp_dir, 'cache')
+
+        def stored():
+            return {os.path.relpath(os.path.join(root, name), cache_dir).split(os.sep)[1]
+                    for root, names, _ in os.walk(cache_dir) for name in names if name.endswith('.npy')}
+
+        ExampleManager(examples_dir=examples_dir, data_cache_dir=cache_dir)
+        old = stored()
+        self.assertTrue(old)
+        self.assertTrue(all(ExampleManager.STORED_PATH_PATTERN.match(f"{name[:2]}/{name}") for name in old))
+        # Each changed data file gets a new copy under a new key
+        week_ago = time.time() - 7 * 24 * 3600
+        for shard in os.listdir(cache_dir):
+            for name in os.listdir(os.path.join(cache_dir, shard)):
+                os.utime(os.path.join(cache_dir, shard, name), (week_ago, week_ago))
+        data_dir = os.path.join(examples_dir, 'data')
+        for name in os.listdir(data_dir):
+            os.utime(os.path.join(data_dir, name), (week_ago, week_ago))
+        ExampleManager(examples_dir=examples_dir, data_cache_dir=cache_dir)
+        self.assertEqual(len(stored()), 2 * len(old))
+
+        manager = RetentionManager(interval_seconds=0, grace_seconds=0)
+        manager.manage('examples', cache_dir, ExampleManager.STORED_PATH_PATTERN, max_age_seconds=24 * 3600)
+        manager.sweep()
+        current = stored()
+        self.assertEqual(len(current), len(old))
+        self.assertFalse(current & old)
+
+class TestRetentionManager(unittest.TestCase):
+    OWNED = re.compile(r'^([0-9a-f]{2})/\1\d+\.(csv|npy)$')
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.now = time.time()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def add(self, name, size, hours_ago, directory=False):
+        path = shard_path(self.temp_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if directory:
+            os.makedirs(path)
+            for part in range(2):
+                with open(os.path.join(path, f"{part}.npy"), 'wb') as f:
+                    f.write(b'x' * (size // 2))
+        else:
+            with open(path, 'wb') as f:
+                f.write(b'x' * size)
+        used_at = self.now - hours_ago * 3600
+        os.utime(path, (used_at, used_at))
+        return path
 
+    def test_sweep_evicts_expired_then_least_recently_used(self):
+        expired = self.add('aa01.csv', 100, hours_ago=24 * 40)
+        oldest = self.add('bb01.npy', 100, hours_ago=10, directory=True)
+        older = self.add('bb02.csv', 100, hours_ago=5)
+        recent = self.add('cc01.csv', 100, hours_ago=2)
+        in_use = self.add('dd01.csv', 500, hours_ago=0)
+        # Files not matching the pattern are neither counted nor evicted
+        foreign = [self.add('ee01.txt', 100, hours_ago=24 * 40), os.path.join(self.temp_dir, 'sample.csv')]
+        with open(foreign[1], 'w') as f:
+            f.write('metric,value\n')
+        os.utime(foreign[1], (self.now - 24 * 40 * 3600,) * 2)
+        manager = RetentionManager(interval_seconds=0, grace_seconds=3600)
+        manager.manage('uploads', self.temp_dir, self.OWNED, max_bytes=700, max_age_seconds=30 * 24 * 3600)
 
+        self.assertEqual(manager.sweep()['uploads'],
+                         {'files': 3, 'bytes': 700, 'evicted_files': 3, 'evicted_bytes': 200})
+        self.assertFalse(os.path.exists(expired))
+        self.assertFalse(os.path.exists(oldest))
+        for path in (older, recent, in_use):
+            self.assertTrue(os.path.exists(path))
+
+        # Entries in use are kept even above the size limit
+        manager.manage('uploads', self.temp_dir, self.OWNED, max_bytes=100, max_age_seconds=None)
+        manager.sweep()
+        self.assertFalse(os.path.exists(older))
+        self.assertTrue(os.path.exists(in_use))
+        self.assertTrue(all(os.path.exists(path) for path in foreign))
+        stats = manager.stats()['directories']['uploads']
+        self.assertEqual((stats['files'], stats['bytes'], stats['evicted_files']), (1, 500, 2))
+
+    def test_reading_an_upload_marks_it_used(self):
+        file_handler = FileHandler(upload_folder=self.temp_dir)
+        from werkzeug.datastructures import FileStorage
+        file_path = file_handler.save_file(FileStorage(stream=BytesIO(b"metric,value\na,1\n"), filename='a.csv'))
+        os.utime(file_path, (self.now - 7200, self.now - 7200))
+        file_handler.read_csv(file_path)
+        self.assertGreater(os.path.getmtime(file_path), self.now - 60)
+
+    def test_only_stored_uploads_and_parsed_files_are_swept(self):
+        from werkzeug.datastructures import FileStorage
+        uploads = os.path.join(self.temp_dir, 'uploads')
+        parsed = os.path.join(self.temp_dir, 'parsed')
+        file_handler = FileHandler(upload_folder=uploads, dataframe_cache=DataFrameCache(parsed))
+        file_path = file_handler.save_file(FileStorage(stream=BytesIO(b"metric,value\na,1\n"), filename='a.csv'))
+        file_handler.read_csv(file_path)
+        stale_part = os.path.join(uploads, 'tmpk2x_9q1.part')
+        kept = [os.path.join(uploads, 'ASIN-B01M0EW6RB-trimmed1.csv'), os.path.join(parsed, 'README')]
+        for path in [stale_part] + kept:
+            with open(path, 'w') as f:
+                f.write('x')
+        manager = RetentionManager(interval_seconds=0, grace_seconds=0)
+        manager.manage('uploads', uploads, FileHandler.STORED_PATH_PATTERN, max_age_seconds=0)
+        manager.manage('parsed', parsed, DataFrameCache.STORED_PATH_PATTERN, max_age_seconds=0)
+        time.sleep(0.01)
+
+        results = manager.sweep()
+        self.assertEqual((results['uploads']['evicted_files'], results['uploads']['files']), (2, 0))
+        self.assertGreater(results['parsed']['evicted_files'], 0)
+        self.assertFalse(os.path.exists(file_path) or os.path.exists(stale_part))
+        self.assertTrue(all(os.path.exists(path) for path in kept))
+
+class TestExampleIndex(unittest.TestCase):
+    def legacy_rank(self, examples, input_metrics, max_examples):
+        """Jaccard scores over every example, as select_examples computed them before the index"""
+        scored = []
+        for position, example in enumerate(examples):
+            example_metrics = set(example.get('metrics', []))
+            if not example_metrics:
+                score = 0.5
+            else:
+                union = len(input_metrics | example_metrics)
+                score = len(input_metrics & example_metrics) / union if union > 0 else 0
+            scored.append((score, position))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return scored[:max_examples]
+
+    def test_rank_matches_jaccard_over_all_examples(self):
+        import random
+        rng = random.Random(3)
+        metrics = [f'metric_{i}' for i in range(60)]
+        examples = [
+            {'id': f'e{i}', 'metrics': rng.sample(metrics, rng.randint(0, 8))}
+            for i in range(500)
+        ]
+        index = ExampleIndex([{'metadata': example} for example in examples])
+        for _ in range(50):
+            input_metrics = set(rng.sample(metrics, rng.randint(1, 12)))
+            max_examples = rng.randint(1, 5)
+            expected = self.legacy_rank(examples, input_metrics, max_examples)
+            actual = index.rank(input_metrics, max_examples)
+            self.assertEqual([p for _, p in actual], [p for _, p in expected])
+            for (score, _), (expected_score, _) in zip(actual, expected):
+                self.assertAlmostEqual(score, expected_score)
+
+class TestExampleVectors(unittest.TestCase):
+    DOCUMENTS = [
+        ('checkout', 'Checkout funnel\ncheckout_completion_rate\nadd_to_cart_rate'),
+        ('retail', 'Retail weblab\nTotalUnits\nPaidUnits\nglance_views'),
+        ('engagement', 'Engagement\nbounce_rate\ntime_on_site'),
+    ]
+
+    def test_search_matches_differently_named_metrics(self):
+        index = VectorIndex.build(self.DOCUMENTS)
+        results = index.search(['Total Units\nPaid Units\nGlance Views', 'Add To Cart Rate', 'nothing'], 2)
+
+        self.assertEqual(results[0][0][1], 1)
+        self.assertEqual(results[1][0][1], 0)
+        self.assertGreater(results[0][0][0], results[0][1][0])
+        self.assertEqual(results[2], [(0.0, 0), (0.0, 1)])
+
+    def test_saved_index_is_rebuilt_incrementally(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'vectors.npz')
+            VectorIndex.build(self.DOCUMENTS).save(path)
+            documents = self.DOCUMENTS + [('pricing', 'Pricing\nrevenue_per_visit')]
+            documents[2] = ('engagement', 'Engagement\nbounce_rate\nsession_length')
+
+            rebuilt = VectorIndex.build(documents, previous=VectorIndex.load(path))
+            self.assertEqual(rebuilt.vectorized, 2)
+            fresh = VectorIndex.build(documents)
+            queries = ['Revenue per visit', 'Session length', 'Paid units']
+            self.assertEqual(rebuilt.search(queries, 3), fresh.search(queries, 3))
+            self.assertIsNone(VectorIndex.load(os.path.join(temp_dir, 'missing.npz')))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_example_manager_vector_retrieval(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(temp_dir, 'data'))
+            os.makedirs(os.path.join(temp_dir, 'analyses'))
+            examples = []
+            for example_id, text in self.DOCUMENTS:
+                name, *metrics = text.split('\n')
+                examples.append({'id': example_id, 'name': name, 'data_file': f'{example_id}.csv',
+                                 'analysis_file': f'{example_id}.json', 'metrics': metrics})
+                pd.DataFrame({'metric': metrics, 'control': 1.0, 'treatment': 1.1, 'difference': 0.1,
+                              'p_value': 0.04}).to_csv(os.path.join(temp_dir, 'data', f'{example_id}.csv'), index=False)
+                with open(os.path.join(temp_dir, 'analyses', f'{example_id}.json'), 'w') as f:
+                    json.dump({'summary': name}, f)
+            with open(os.path.join(temp_dir, 'metadata.json'), 'w') as f:
+                json.dump({'examples': examples}, f)
+
+            vector_path = os.path.join(temp_dir, 'vectors.npz')
+            manager = ExampleManager(temp_dir, retrieval='vector', vector_index_path=vector_path)
+            weblab_df = pd.DataFrame({'metric_name': ['Total Units', 'Paid Units', 'Paid Units']})
+            selected = manager.select_examples(weblab_df, max_examples=1)
+            self.assertEqual(selected[0]['metadata']['id'], 'retail')
+            self.assertEqual(ExampleManager(temp_dir).select_examples(weblab_df, max_examples=1)[0]['relevance_score'], 0.0)
+
+            self.assertTrue(os.path.exists(vector_path))
+            self.assertEqual(ExampleManager(temp_dir, retrieval='vector', vector_index_path=vector_path)
+                             ._index.vectors.vectorized, 0)
+            with self.assertRaises(ValueError):
+                ExampleManager(temp_dir, retrieval='bm25')
+        finally:
+            shutil.rmtree(temp_dir)
+
+class TestAWSBedrockService(unittest.TestCase):
+    def setUp(self):
+        # Make sure every test gets a client created by its own boto3 mock
+        default_client_pool.reset()
+
+    def mock_service(self, mock_boto3):
+        """Create a Claude service whose calls all answer 'Test response'"""
+        mock_boto3.return_value.invoke_model.return_value = {
+            'body': Mock(read=lambda: json.dumps({'completion': 'Test response'}))
+        }
+        return AWSBedrockService('anthropic.claude-v2')
+
+    def test_token_budget_selection(self):
+        """Test that the prompt budget follows each model's context window"""
+        budgets = {
+            'anthropic.claude-v2': 100000 - 2048 - 64,
+            'amazon.titan-text-express-v1': 8192 - 2048 - 64,
+            'meta.llama2-13b-chat-v1': 4096 - 2048 - 64,
+            'cohere.command-text-v14': 4096 - 2048 - 64,
+            'unknown.model': 4096 - 2048 - 64
+        }
+
+        for model_id, expected_budget in budgets.items():
+            service = AWSBedrockService(model_id)
+            self.assertEqual(service.prompt_token_budget(), expected_budget)
+
+    def test_check_prompt_size(self):
+        """Test that prompts over the budget are rejected instead of being split"""
+        service = AWSBedrockService('meta.llama2-13b-chat-v1')
+        budget = service.prompt_token_budget()
+        splitter = PromptSplitter(budget)
+        long_prompt = "metric,control,treatment\n" + "conversion_rate,0.12,0.15\n" * 1000
+        with self.assertRaises(ValueError):
+            service._check_prompt_size(long_prompt)
+        # The parts the PromptSplitter makes of it are accepted
+        parts = splitter.split(long_prompt)
+        self.assertGreater(len(parts), 1)
+        for part in parts:
+            service._check_prompt_size(part)
+
+    @patch('boto3.client')
+    def test_process_chunk(self, mock_boto3):
+        """Test processing of individual chunks"""
+        response = self.mock_service(mock_boto3)._process_chunk("Test prompt")
+        self.assertEqual(response, 'Test response')
+
+    @patch('boto3.client')
+    def test_get_model_response(self, mock_boto3):
+        """Test the complete response generation process"""
+        service = self.mock_service(mock_boto3)
+        long_prompt = "Test prompt. " * 1000
+        self.assertEqual(service.get_model_response(long_prompt), 'Test response')
+        self.assertEqual(list(service.get_model_response_streaming(long_prompt)), ['Test response'])
+        self.assertEqual(mock_boto3.return_value.invoke_model.call_count, 2)
+
+class TestAWSBedrockConcurrency(unittest.TestCase):
+    def setUp(self):
+        # Make sure every test gets a client created by its own boto3 mock
+        default_client_pool.reset()
+
+    def _mock_invoke(self, **kwargs):
+        """Fake invoke_model that echoes the prompt back after a short, uneven delay"""
+        import time
+        prompt = json.loads(kwargs['body'])['prompt']
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # Earlier chunks take longer so completion order differs from chunk order
+        time.sleep(0.05 if 'sentence 0' in prompt else 0.01)
+        with self.lock:
+            self.in_flight -= 1
+        return {'body': Mock(read=lambda: json.dumps({'completion': prompt.split('Human: ')[1]}))}
+
+    @patch('boto3.client')
+    def test_parallel_dispatch_preserves_order(self, mock_boto3):
+        import threading
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        mock_boto3.return_value.invoke_model.side_effect = self._mock_invoke
+
+        service = AWSBedrockService('anthropic.claude-v2', max_concurrency=3)
+        chunks = [f"This is sentence {i}." for i in range(6)]
+        responses = list(service._dispatch_chunks(chunks))
+
+        self.assertEqual([r.split('\n')[0] for r in responses], chunks)
+        self.assertLessEqual(self.max_in_flight, 3)
+        self.assertGreater(self.max_in_flight, 1)
+        self.assertEqual([t['chunk'] for t in service.chunk_timings], list(range(6)))
+        self.assertTrue(all(t['latency_seconds'] > 0 for t in service.chunk_timings))
+
+    @patch('boto3.client')
+    def test_serial_dispatch_with_concurrency_of_one(self, mock_boto3):
+        import threading
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        mock_boto3.return_value.invoke_model.side_effect = self._mock_invoke
+
+        service = AWSBedrockService('anthropic.claude-v2', max_concurrency=1)
+        responses = service.get_model_responses([f"This is sentence {i}." for i in range(4)])
+
+        self.assertEqual(self.max_in_flight, 1)
+        self.assertEqual(len(service.chunk_timings), 4)
+        self.assertTrue(responses[0].startswith("This is sentence 0."))
+
+    @patch('boto3.client')
+    def test_prompt_that_fits_is_sent_in_one_call(self, mock_boto3):
+        mock_boto3.return_value.invoke_model.return_value = {
+            'body': Mock(read=lambda: json.dumps({'completion': 'Test response'}))
+        }
+        prompt = "metric,control,treatment\n" + "conversion_rate,0.12,0.15\n" * 2000
+
+        self.assertEqual(AWSBedrockService('anthropic.claude-v2').get_model_response(prompt), 'Test response')
+        self.assertEqual(mock_boto3.return_value.invoke_model.call_count, 1)
+
+        # The same prompt is too long for Llama 2; it is rejected instead of being sent or cut
+        service = AWSBedrockService('meta.llama2-13b-chat-v1')
+        self.assertFalse(service.fits_in_context(prompt))
+        with self.assertRaises(ValueError):
+            service.get_model_response(prompt)
+        with self.assertRaises(ValueError):
+            list(service.stream_model_response(prompt))
+        self.assertEqual(mock_boto3.return_value.invoke_model.call_count, 1)
+
+    @patch('boto3.client')
+    def test_response_length_is_capped_by_the_model(self, mock_boto3):
+        # 2048 tokens, as every request asked for before responses were sized per model
+        claude = AWSBedrockService('anthropic.claude-v2')
+        self.assertEqual(json.loads(claude._build_request_body("Hi"))['max_tokens_to_sample'], 2048)
+        self.assertEqual(claude.prompt_token_budget(),
+                         claude.capabilities['context_window'] - 2048 - AWSBedrockService.PROMPT_OVERHEAD_TOKENS)
+        titan = AWSBedrockService('amazon.titan-text-express-v1')
+        self.assertEqual(json.loads(titan._build_request_body("Hi"))['textGenerationConfig']['maxTokenCount'],
+                         min(2048, titan.capabilities['max_output_tokens']))
+
+# Event payloads recorded from invoke_model_with_response_stream, one list per model family
+RECORDED_STREAMS = {
+    'anthropic.claude-v2': [
+        {'completion': ' {"summary":', 'stop_reason': None, 'stop': None},
+        {'completion': ' "Treatment', 'stop_reason': None, 'stop': None},
+        {'completion': ' wins"}', 'stop_reason': 'stop_sequence', 'stop': '\n\nHuman:',
+         'amazon-bedrock-invocationMetrics': {'inputTokenCount': 12, 'outputTokenCount': 7}}
+    ],
+    'amazon.titan-text-express-v1': [
+        {'outputText': '{"summary":', 'index': 0, 'totalOutputTextTokenCount': None, 'completionReason': None},
+        {'outputText': ' "Treatment wins"}', 'index': 0, 'totalOutputTextTokenCount': 7,
+         'completionReason': 'FINISH', 'inputTextTokenCount': 12}
+    ],
+    'meta.llama2-13b-chat-v1': [
+        {'generation': '{"summary": "Treatment', 'prompt_token_count': 12, 'generation_token_count': 4,
+         'stop_reason': None},
+        {'generation': ' wins"}', 'prompt_token_count': None, 'generation_token_count': 7, 'stop_reason': 'stop'}
+    ],
+    'cohere.command-text-v14': [
+        {'text': '{"summary":', 'is_finished': False},
+        {'text': ' "Treatment wins"}', 'is_finished': False},
+        {'is_finished': True, 'finish_reason': 'COMPLETE',
+         'response': {'generations': [{'text': '{"summary": "Treatment wins"}'}]}}
+    ]
+}
+
+class TestPromptSplitter(unittest.TestCase):
+    def random_prompt(self, rng):
+        """Build a prompt with awkward metric names, decimals and optional examples and descriptions"""
+        words = ['conversion', 'rate.', 'v1.2', 'e.g.', '0.12', 'Revenue!', 'units?', '{x}', 'a' * 40]
+        rows = rng.randint(50, 300)
+        df = pd.DataFrame({
+            'metric': [' '.join(rng.choice(words) for _ in range(rng.randint(1, 6))) for _ in range(rows)],
+            'control': [round(rng.random(), rng.randint(1, 6)) for _ in range(rows)],
+            'treatment': [round(rng.random(), 3) for _ in range(rows)],
+            'difference': [round(rng.uniform(-1, 1), 4) for _ in range(rows)],
+            'p_value': [rng.random() / 10 for _ in range(rows)]
+        })
+        examples = [
+            {'metadata': {'name': f'Example {i}'}, 'data': df.head(rng.randint(1, 20)).assign(metric='example'),
+             'analysis': {'summary': 'Fine. ' * rng.randint(1, 50)}}
+            for i in range(rng.randint(0, 3))
+        ]
+        descriptions = {f'field_{i}': 'Described. ' * rng.randint(1, 5) for i in range(rng.randint(0, 40))}
+        instructions = 'Focus on revenue. ' * rng.randint(1, 10)
+        prompt = PromptBuilder().build_prompt(instructions, df, descriptions, examples)
+        return prompt, instructions.strip(), df
+
+    def test_fuzzed_prompts_are_split_between_records_within_the_budget(self):
+        import random
+        rng = random.Random(7)
+        for _ in range(25):
+            prompt, instructions, df = self.random_prompt(rng)
+            budget = rng.randint(1500, 4000)
+            chunks = PromptSplitter(budget).split(prompt)
+
+            self.assertTrue(all(estimate_tokens(chunk) <= budget for chunk in chunks))
+            if len(chunks) == 1:
+                continue
+            for chunk in chunks:
+                self.assertIn(instructions, chunk)
+                self.assertIn('## REQUIRED OUTPUT FORMAT:', chunk)
+                self.assertIn('"recommendations": [', chunk)
+            # Every metric block and example is kept whole in exactly one chunk
+            data = prompt.split('## STATISTICAL DATA TO ANALYZE:')[1].split('## FIELD DESCRIPTIONS')[0]
+            records = [block.strip() for block in data.split('\n\n') if block.startswith('Metric: ')]
+            records += ['### EXAMPLE: ' + block.split('\n')[0] for block in prompt.split('### EXAMPLE: ')[1:]]
+            self.assertEqual(len([r for r in records if r.startswith('Metric: ')]), len(df))
+            for record in records:
+                self.assertEqual(sum(record in chunk for chunk in chunks), 1, record)
+
+    def test_oversized_record_is_split_between_words(self):
+        line = ' '.join(f'value{i}.5' for i in range(2000)) + ' ' + 'x' * 500
+        chunks = PromptSplitter(200).split(line)
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(estimate_tokens(chunk) <= 200 for chunk in chunks))
+        # Words are kept whole; only the 500 character word is cut
+        self.assertEqual(' '.join(chunks).split()[:2000], line.split()[:2000])
+        self.assertEqual(''.join(chunks).replace(' ', ''), line.replace(' ', ''))
+
+    def test_upload_files_keep_rows_whole_and_repeat_the_legend(self):
+        file_handler = FileHandler(os.path.join(TEST_DATA_DIR, 'uploads'))
+        uploads = os.path.join(os.path.dirname(__file__), 'uploads')
+        for name in sorted(os.listdir(uploads)):
+            df = file_handler.read_csv(os.path.join(uploads, name))
+            prompt = PromptBuilder().build_prompt("Summarize", df)
+            chunks = PromptSplitter(2000).split(prompt)
+
+            self.assertTrue(all(estimate_tokens(chunk) <= 2000 for chunk in chunks))
+            def rows(text):
+                return Counter(line for line in text.split('\n') if line.startswith('- '))
+            self.assertEqual(sum((rows(chunk) for chunk in chunks), Counter()), rows(prompt))
+            if len(chunks) > 1:
+                self.assertTrue(all('Each line: metric | segment' in chunk for chunk in chunks))
+                self.assertIn('## STATISTICAL DATA TO ANALYZE (continued):', chunks[1])
+
+class StubBedrockRuntime:
+    """Local stand-in for the bedrock-runtime client that replays recorded event streams"""
+    def __init__(self, streams):
+        self.streams = streams
+        self.bodies = []
+        self.events_read = 0
+
+    def invoke_model_with_response_stream(self, modelId, body, contentType, accept):
+        self.bodies.append(json.loads(body))
+
+        def replay():
+            for payload in self.streams[modelId]:
+                self.events_read += 1
+                if 'exception' in payload:
+                    yield payload['exception']
+                else:
+                    yield {'chunk': {'bytes': json.dumps(payload).encode('utf-8')}}
+        return {'body': replay()}
+
+class TestResponseStreaming(unittest.TestCase):
+    def service(self, model_id, streams=RECORDED_STREAMS, cache=None):
+        self.runtime = StubBedrockRuntime(streams)
+        client_pool = Mock(get_client=Mock(return_value=self.runtime))
+        return AWSBedrockService(model_id, cache=cache, client_pool=client_pool)
+
+    def test_every_model_family_streams_text_incrementally(self):
+        for model_id in RECORDED_STREAMS:
+            service = self.service(model_id)
+            stream = service.stream_model_response("Analyze")
+            # The first piece is available after reading only the first event
+            self.assertTrue(next(stream))
+            self.assertEqual(self.runtime.events_read, 1)
+            self.assertGreaterEqual(len(list(stream)), 1, model_id)
+
+    def test_streamed_text_matches_complete_response(self):
+        for model_id in RECORDED_STREAMS:
+            text = "".join(self.service(model_id).stream_model_response("Analyze"))
+            self.assertEqual(json.loads(text), {'summary': 'Treatment wins'}, model_id)
+        self.assertTrue(self.runtime.bodies[-1]['stream'])
+
+    def test_stream_errors_and_cache(self):
+        streams = {'anthropic.claude-v2': RECORDED_STREAMS['anthropic.claude-v2'][:1] + [
+            {'exception': {'throttlingException': {'message': 'Too many requests'}}}
+        ]}
+        stream = self.service('anthropic.claude-v2', streams).stream_model_response("Analyze")
+        self.assertTrue(next(stream))
+        # Text was already yielded, so the error is raised instead of retrying
+        with self.assertRaises(ModelInvocationError) as raised:
+            list(stream)
+        self.assertIn("Too many requests", str(raised.exception))
+
+        cache = ResponseCache([LRUCache()])
+        service = self.service('anthropic.claude-v2', cache=cache)
+        first = "".join(service.stream_model_response("Analyze"))
+        # The complete response is cached and shared with regular calls
+        self.assertEqual(list(self.service('anthropic.claude-v2', cache=cache).stream_model_response("Analyze")),
+                         [first])
+        self.assertEqual(self.runtime.events_read, 0)
+        self.assertEqual(cache.get(cache.make_key('anthropic.claude-v2', service._build_request_body("Analyze"))),
+                         first)
+
+class TestIncrementalJSONParser(unittest.TestCase):
+    RESPONSE = {
+        'summary': 'Treatment "T1" wins {clearly}, [mostly]',
+        'key_metrics': [
+            {'metric_name': 'OPS', 'value': '+1.2%', 'interpretation': 'More sales, per customer'},
+            {'metric_name': 'Units', 'value': 3, 'interpretation': 'Back\\slash'}
+        ],
+        'statistical_significance': 'p < 0.05',
+        'recommendations': ['Ship T1', 'Monitor returns'],
+        'limitations': []
+    }
+
+    def response_text(self):
+        return "Here is the analysis of {metric}:\n```json\n" + json.dumps(self.RESPONSE, indent=2) + "\n```\nDone {}"
+
+    def test_fields_are_emitted_as_they_close(self):
+        import random
+        text = self.response_text()
+        rng = random.Random(7)
+        for _ in range(50):
+            parser = IncrementalJSONParser()
+            events = []
+            position = 0
+            while position < len(text):
+                size = rng.randint(1, 9)
+                events.extend((position + size, event) for event in parser.feed(text[position:position + size]))
+                position += size
+
+            self.assertEqual(parser.result(), self.RESPONSE)
+            fields = {event['key']: event['value'] for _, event in events if 'index' not in event}
+            self.assertEqual(fields, self.RESPONSE)
+            items = [(event['key'], event['index'], event['value']) for _, event in events if 'index' in event]
+            self.assertEqual(items, [('key_metrics', 0, self.RESPONSE['key_metrics'][0]),
+                                     ('key_metrics', 1, self.RESPONSE['key_metrics'][1]),
+                                     ('recommendations', 0, 'Ship T1'),
+                                     ('recommendations', 1, 'Monitor returns')])
+            # The first key metric is available before the model has written the limitations
+            first_metric_at = next(at for at, event in events if event.get('index') == 0)
+            self.assertLess(first_metric_at, text.index('"limitations"'))
+
+    def test_incomplete_response(self):
+        parser = IncrementalJSONParser()
+        events = parser.feed('```json\n{"summary": "Partial", "key_metrics": [{"metric_name": "OPS"}, {"metr')
+        self.assertEqual(events, [{'key': 'summary', 'value': 'Partial'},
+                                  {'key': 'key_metrics', 'index': 0, 'value': {'metric_name': 'OPS'}}])
+        self.assertFalse(parser.complete)
+        self.assertIsNone(parser.result())
+
+    def test_fragments_are_appended_in_place(self):
+        response = {'summary': 'Conversion \u2191 1.2% \u2014 \u00e9t\u00e9 "T1" wins', 'recommendations': ['\U0001F680 Ship']}
+        text = json.dumps(response, ensure_ascii=False)
+        parser = IncrementalJSONParser()
+        buffer = parser.text
+        events = [event for char in text for event in parser.feed(char)]
+        # The text received so far is never copied to add a fragment
+        self.assertIs(parser.text, buffer)
+        self.assertEqual(parser.result(), response)
+        self.assertEqual(events[0], {'key': 'summary', 'value': response['summary']})
+
+    def test_extract_json_without_regex_backtracking(self):
+        generator = SummaryGenerator()
+        self.assertEqual(generator._extract_json(self.response_text()), self.RESPONSE)
+        self.assertEqual(generator._extract_json(json.dumps(self.RESPONSE)), self.RESPONSE)
+        self.assertIsNone(generator._extract_json('{"summary": "never closed' + ' and more' * 1000))
+        self.assertIsNone(generator._extract_json('No JSON here'))
+
+class TestMapReduceAnalyzer(unittest.TestCase):
+    class FakeBedrockService:
+        """Stands in for AWSBedrockService and answers map and reduce prompts"""
+        def __init__(self, budget=600, findings="fine"):
+            self.prompts = []
+            self.budget = budget
+            self.findings = findings
+
+        def prompt_token_budget(self):
+            return self.budget
+
+        def get_model_responses(self, prompts):
+            return list(self.get_model_responses_streaming(prompts))
+
+        def stream_model_response(self, prompt):
+            response = next(self.get_model_responses_streaming([prompt]))
+            for start in range(0, len(response), 10):
+                yield response[start:start + 10]
+
+        def get_model_responses_streaming(self, prompts):
+            for prompt in prompts:
+                self.prompts.append(prompt)
+                if "PARTIAL ANALYSES" in prompt:
+                    yield '```json\n{"summary": "Merged", "key_metrics": [], "recommendations": ["Ship it"], "limitations": []}\n```'
+                else:
+                    yield json.dumps({"key_metrics": [{"metric_name": "m"}], "findings": [self.findings]})
+
+    def setUp(self):
+        self.analyzer = MapReduceAnalyzer(PromptBuilder(), SummaryGenerator(), max_rows_per_slice=4)
+        self.df = pd.DataFrame({
+            'metric': ['a', 'a', 'b', 'b', 'b', 'c', 'd', 'd', 'd', 'd', 'd', 'd'],
+            'control': range(12),
+            'treatment': range(12),
+            'difference': [0.0] * 12,
+            'p_value': [0.01] * 12
+        })
+
+    def test_split_data_keeps_metric_groups_together(self):
+        slices = self.analyzer.split_data(self.df)
+        self.assertEqual([len(slice_df) for _, slice_df in slices], [2, 4, 4, 2])
+        self.assertEqual(sorted(slices[0][1]['metric'].unique()), ['a'])
+        self.assertEqual(sorted(slices[1][1]['metric'].unique()), ['b', 'c'])
+        self.assertEqual(sum(len(slice_df) for _, slice_df in slices), len(self.df))
+
+    def test_split_data_with_missing_metric_names(self):
+        # Like weblab exports with blank lines: empty rows and a row without a metric name
+        df = pd.DataFrame({
+            'metric_name': ['a', np.nan, 'a', np.nan, np.nan, 'b'],
+            'value': [1.0, np.nan, 2.0, np.nan, 5.0, 3.0]
+        })
+        slices = self.analyzer.split_data(df)
+        self.assertEqual(sum(len(slice_df) for _, slice_df in slices), 4)
+        self.assertIn('(no metric_name)', slices[0][0])
+
+        weblab_df = FileHandler(os.path.join(TEST_DATA_DIR, 'uploads')).read_csv(os.path.join(
+            os.path.dirname(__file__), 'uploads', '1e4349d2-7a3b-4490-84e6-d1952b973d5c.1724180909369933555-1.csv'))
+        self.assertEqual(sum(len(slice_df) for _, slice_df in self.analyzer.split_data(weblab_df)),
+                         len(weblab_df.dropna(how='all')))
+
+    def test_analyze_maps_slices_and_reduces_once(self):
+        service = self.FakeBedrockService()
+        events = list(self.analyzer.analyze_streaming(service, "Focus on d", self.df))
+
+        stages = [e['stage'] for e in events]
+        self.assertEqual(stages, ['map'] * (len(service.prompts) - 1) + ['generate', 'result'])
+        self.assertGreater(len(service.prompts), 2)
+        self.assertTrue(all(estimate_tokens(prompt) <= service.budget for prompt in service.prompts))
+        self.assertIn("PARTIAL ANALYSES", service.prompts[-1])
+        self.assertIn('"findings":["fine"]', service.prompts[-1])
+
+        result = SummaryGenerator().generate_summary(events[-1]['response'])
+        self.assertEqual(result['summary'], 'Merged')
+        self.assertEqual(result['recommendations'], ['Ship it'])
+
+    def test_analyze_few_rows_over_budget_are_still_sliced(self):
+        service = self.FakeBedrockService(budget=500)
+        self.assertGreater(estimate_tokens(PromptBuilder().build_prompt("Focus on a", self.df.head(3))), 500)
+        self.analyzer.analyze(service, "Focus on a", self.df.head(3))
+        self.assertEqual(len(service.prompts), 2)
+        self.assertTrue(all(estimate_tokens(prompt) <= 500 for prompt in service.prompts))
+        self.assertIn("## REQUIRED OUTPUT FORMAT:", service.prompts[0])
+
+    def test_oversized_slices_are_halved_and_rows_split(self):
+        df = self.df.copy()
+        df['metric'] = df['metric'] + ' ' + 'long metric name ' * 10
+        # One row on its own is still too large for a map prompt
+        df.loc[11, 'metric'] = 'huge ' * 400
+        service = self.FakeBedrockService(budget=700)
+        events = list(self.analyzer.analyze_streaming(service, "Focus on d", df))
+
+        self.assertTrue(all(estimate_tokens(prompt) <= 700 for prompt in service.prompts))
+        slices = [e['slice'] for e in events if e['stage'] == 'map']
+        self.assertTrue(any('(1/2)' in name for name in slices))
+        self.assertGreater(sum('huge' in prompt for prompt in service.prompts[:-1]), 1)
+        self.assertEqual(events[-1]['stage'], 'result')
+
+    def test_partial_analyses_too_large_for_one_reduce_prompt_are_merged(self):
+        service = self.FakeBedrockService(budget=700, findings='fine ' * 60)
+        analyzer = MapReduceAnalyzer(PromptBuilder(), SummaryGenerator(), max_rows_per_slice=1)
+        df = pd.concat([self.df] * 3, ignore_index=True)
+        df['metric'] = [f"metric {i}" for i in range(len(df))]
+        events = list(analyzer.analyze_streaming(service, "Focus on d", df))
+
+        self.assertTrue(all(estimate_tokens(prompt) <= 700 for prompt in service.prompts))
+        self.assertTrue(any(e['stage'] == 'map' and e['slice'].startswith('merge 1.') for e in events))
+        self.assertEqual(events[-1]['done'], events[-1]['total'])
+        self.assertEqual(SummaryGenerator().generate_summary(events[-1]['response'])['summary'], 'Merged')
+
+    def test_analyze_data_that_fits_in_context_uses_single_call(self):
+        service = self.FakeBedrockService(budget=100000)
+        events = list(self.analyzer.analyze_streaming(service, "Focus on d", self.df))
+        self.assertEqual(len(service.prompts), 1)
+        self.assertNotIn('map', [e['stage'] for e in events])
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        default_client_pool.reset()
+
+    def test_lru_cache_evicts_and_expires(self):
+        cache = LRUCache(max_entries=2, ttl_seconds=60)
+        cache.set('a', '1')
+        cache.set('b', '2')
+        cache.get('a')
+        cache.set('c', '3')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), '1')
+
+        expired = LRUCache(max_entries=2, ttl_seconds=-1)
+        expired.set('a', '1')
+        self.assertIsNone(expired.get('a'))
+
+    def test_sqlite_cache_backfills_memory_tier(self):
+        import tempfile
+        import shutil
+        temp_dir = tempfile.mkdtemp()
+        try:
+            db_path = os.path.join(temp_dir, 'responses.sqlite3')
+            SQLiteCache(db_path).set('key', 'stored response')
+
+            memory = LRUCache()
+            cache = ResponseCache([memory, SQLiteCache(db_path)])
+            self.assertEqual(cache.get('key'), 'stored response')
+            self.assertEqual(memory.get('key'), 'stored response')
+            self.assertIsNone(cache.get('other'))
+            self.assertEqual(cache.stats()['hits'], 1)
+            self.assertEqual(cache.stats()['misses'], 1)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @patch('boto3.client')
+    def test_bedrock_service_uses_cache(self, mock_boto3):
+        mock_boto3.return_value.invoke_model.side_effect = lambda **kwargs: {
+            'body': Mock(read=lambda: json.dumps({'completion': 'Fresh response'}))
+        }
+        cache = ResponseCache([LRUCache()])
+
+        first = AWSBedrockService('anthropic.claude-v2', cache=cache)._process_chunk("Same prompt")
+        second = AWSBedrockService('anthropic.claude-v2', cache=cache)._process_chunk("Same prompt")
+        self.assertEqual(first, second)
+        self.assertEqual(mock_boto3.return_value.invoke_model.call_count, 1)
+
+        # Different models never share entries and refresh_cache forces a new call
+        AWSBedrockService('amazon.titan-text-express-v1', cache=cache)._process_chunk("Same prompt")
+        AWSBedrockService('anthropic.claude-v2', cache=cache, refresh_cache=True)._process_chunk("Same prompt")
+        self.assertEqual(mock_boto3.return_value.invoke_model.call_count, 3)
+
+class TestClientPool(unittest.TestCase):
+    @patch('boto3.client')
+    def test_clients_are_shared_per_service_and_region(self, mock_boto3):
+        mock_boto3.side_effect = lambda service, **kwargs: Mock(service=service, region=kwargs['region_name'])
+        pool = ClientPool(max_pool_connections=8)
+
+        first = AWSBedrockService('anthropic.claude-v2', client_pool=pool)
+        second = AWSBedrockService('amazon.titan-text-express-v1', client_pool=pool)
+        self.assertIs(first.client, second.client)
+        self.assertIsNot(pool.get_client('bedrock-runtime', 'us-east-1'), first.client)
+        self.assertIsNot(pool.get_client('bedrock', 'us-west-2'), first.client)
+        self.assertEqual(mock_boto3.call_count, 3)
+        self.assertEqual(mock_boto3.call_args.kwargs['config'].max_pool_connections, 8)
+
+        pool.reset()
+        pool.get_client('bedrock-runtime', 'us-west-2')
+        self.assertEqual(mock_boto3.call_count, 4)
+
+class TestModelCatalog(unittest.TestCase):
+    def setUp(self):
+        self.client = Mock()
+        self.client.list_foundation_models.return_value = {
+            'modelSummaries': [{'modelId': 'anthropic.claude-v2', 'providerName': 'Anthropic'}]
+        }
+        self.pool = Mock()
+        self.pool.get_client.return_value = self.client
+
+    def test_serves_cached_and_stale_models(self):
+        catalog = ModelCatalog(ttl_seconds=60, client_pool=self.pool)
+        models = catalog.get_models()
+        self.assertEqual(models[0]['name'], 'Anthropic - anthropic.claude-v2')
+        catalog.get_models()
+        self.assertEqual(self.client.list_foundation_models.call_count, 1)
+
+        # A stale catalog is served immediately while it is refreshed in the background
+        catalog.fetched_at -= 120
+        self.client.list_foundation_models.side_effect = Exception('ThrottlingException')
+        self.assertEqual(catalog.get_models(), models)
+
+    def test_snapshot_populates_new_catalog(self):
+        import tempfile
+        import shutil
+        temp_dir = tempfile.mkdtemp()
+        try:
+            snapshot_path = os.path.join(temp_dir, 'models.json')
+            ModelCatalog(snapshot_path=snapshot_path, client_pool=self.pool).refresh()
+
+            failing_pool = Mock()
+            failing_pool.get_client.return_value.list_foundation_models.side_effect = Exception('offline')
+            catalog = ModelCatalog(snapshot_path=snapshot_path, client_pool=failing_pool)
+            self.assertEqual(catalog.get_models()[0]['id'], 'anthropic.claude-v2')
+            failing_pool.get_client.assert_not_called()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_models_route_supports_conditional_requests(self):
+        import src.app
+        catalog = ModelCatalog(client_pool=self.pool)
+        with patch.object(src.app, 'model_catalog', catalog):
+            client = app.test_client()
+            response = client.get('/models')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()['models'][0]['id'], 'anthropic.claude-v2')
+
+            etag = response.headers['ETag']
+            cached = client.get('/models', headers={'If-None-Match': etag})
+            self.assertEqual(cached.status_code, 304)
+        self.assertEqual(self.client.list_foundation_models.call_count, 1)
+
+    def test_models_route_before_the_first_list_is_loaded(self):
+        import src.app
+        catalog = ModelCatalog(client_pool=self.pool)
+        # Another request has just started the first refresh, which hasn't finished yet
+        catalog._last_attempt = time.time()
+        with patch.object(src.app, 'model_catalog', catalog):
+            response = app.test_client().get('/models')
+        self.assertEqual(response.status_code, 503)
+        self.assertNotIn('ETag', response.headers)
+        self.client.list_foundation_models.assert_not_called()
+
+class TestColumnPruner(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'job_id': [1695156856779344680, 1695156856779344681, 1695156856779344682],
+            'weblab_id': ['CEPSTARFISH_756503'] * 3,
+            'metric_hash_key': ['057bf378-b531-4d23-a2e7-cf373e299d94', '157bf378-b531-4d23-a2e7-cf373e299d94',
+                                '257bf378-b531-4d23-a2e7-cf373e299d94'],
+            'analysis_create_time': ['2023-09-19 20:54:16', '2023-09-19 20:55:16', '2023-09-19 20:56:16'],
+            'metric_name': ['OPS', 'Units', 'Glance Views'],
+            'metric_count_a': [568373, 568374, 568375],
+            'metric_sample_mean_a': [133.5, 0.07, 1.74],
+            'metric_base_mean_a': [133.5, 0.07, 1.74],
+            'active_alarm_names': [None, None, None]
+        })
+
+    def test_classify_columns(self):
+        categories = ColumnPruner().classify(self.df)
+        self.assertEqual(categories, {
+            'job_id': 'identifier',
+            'weblab_id': 'constant',
+            'metric_hash_key': 'identifier',
+            'analysis_create_time': 'metadata',
+            'metric_name': 'dimension',
+            'metric_count_a': 'count',
+            'metric_sample_mean_a': 'statistic',
+            'metric_base_mean_a': 'duplicate',
+            'active_alarm_names': 'empty'
+        })
+
+    def test_generic_prompt_uses_pruned_columns(self):
+        pruner = ColumnPruner()
+        pruned_df, report = pruner.prune(self.df)
+        self.assertEqual(list(pruned_df.columns),
+                         ['analysis_create_time', 'metric_name', 'metric_count_a', 'metric_sample_mean_a'])
+        self.assertEqual(report['constants'], {'weblab_id': 'CEPSTARFISH_756503'})
+
+        data_str = PromptBuilder()._format_dataframe(self.df)
+        self.assertIn("Constant fields (same value in every row): weblab_id=CEPSTARFISH_756503", data_str)
+        self.assertIn("metric_base_mean_a=metric_sample_mean_a", data_str)
+        self.assertNotIn("1695156856779344680", data_str)
+
+class TestTopCorrelations(unittest.TestCase):
+    def setUp(self):
+        import numpy as np
+        rng = np.random.default_rng(0)
+        base = rng.normal(size=200)
+        self.df = pd.DataFrame({
+            'a': base,
+            'b': base * 2 + rng.normal(scale=0.1, size=200),
+            'c': -base + rng.normal(scale=0.5, size=200),
+            'd': rng.normal(size=200),
+            'constant': [1.0] * 200
+        })
+        self.df.loc[::7, 'c'] = None
+
+    def test_matches_pandas_correlation(self):
+        text = PromptBuilder()._format_top_correlations(self.df, top_k=2, threshold=0.5)
+        expected = self.df[['a', 'b', 'c', 'd']].corr()
+        lines = text.strip().split('\n')[1:]
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith(f"- a ~ b: r={expected.loc['a', 'b']:.3f}"))
+        self.assertTrue(lines[1].startswith(f"- a ~ c: r={expected.loc['a', 'c']:.3f}"))
+        self.assertNotIn('constant', text)
+
+    def test_prompt_size_is_bounded_by_top_k(self):
+        import numpy as np
+        wide_df = pd.DataFrame(np.random.default_rng(1).normal(size=(50, 120)),
+                               columns=[f"stat_{i}" for i in range(120)])
+        builder = PromptBuilder()
+        text = builder._format_top_correlations(wide_df, top_k=5, threshold=0.0)
+        self.assertEqual(len(text.strip().split('\n')), 6)
+
+        data_str = builder._format_dataframe(wide_df, {'correlation_top_k': 3, 'correlation_threshold': 0.99})
+        self.assertIn("Notable Correlations (top 3 with |r| >= 0.99):\nNone found", data_str)
+        self.assertNotIn("Correlation Matrix", data_str)
+
+class TestResultFormatters(unittest.TestCase):
+    def test_ab_test_results_format(self):
+        df = pd.DataFrame({
+            'metric': ['conversion_rate', 'revenue', 'bounce_rate', 'sessions'],
+            'control': [0.12, 1000, 0.35, 10],
+            'treatment': [0.15, 1200, 0.32, 11],
+            'difference': [0.03, 200, -0.03, 1],
+            'p_value': [0.0004, 0.02, float('nan'), 'N/A']
+        })
+        expected = (
+            "A/B Test Results:\n\n"
+            "Metric: conversion_rate\n  Control: 0.12\n  Treatment: 0.15\n  Difference: 0.03\n  P-value: 0.0004***\n\n"
+            "Metric: revenue\n  Control: 1000.0\n  Treatment: 1200.0\n  Difference: 200.0\n  P-value: 0.0200*\n\n"
+            "Metric: bounce_rate\n  Control: 0.35\n  Treatment: 0.32\n  Difference: -0.03\n  P-value: nan\n\n"
+            "Metric: sessions\n  Control: 10.0\n  Treatment: 11.0\n  Difference: 1.0\n  P-value: N/A\n\n"
+            "Significance levels: * p<0.05, ** p<0.01, *** p<0.001"
+        )
+        self.assertEqual(PromptBuilder()._format_ab_test_results(df), expected)
+
+    def test_regression_results_format(self):
+        df = pd.DataFrame({
+            'variable': ['intercept', 'treatment'],
+            'coefficient': [1.5, 0.2],
+            'std_error': [0.1, 0.05],
+            't_value': [15.0, 4.0],
+            'p_value': [0.000001, 0.005]
+        })
+        expected = (
+            "Regression Analysis Results:\n\n"
+            "Variable: intercept\n  Coefficient: 1.5\n  Std Error: 0.1\n  t-value: 15.0\n  P-value: 0.0000***\n\n"
+            "Variable: treatment\n  Coefficient: 0.2\n  Std Error: 0.05\n  t-value: 4.0\n  P-value: 0.0050**\n\n"
+            "Significance levels: * p<0.05, ** p<0.01, *** p<0.001"
+        )
+        self.assertEqual(PromptBuilder()._format_regression_results(df), expected)
+
+class TestWeblabFormat(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.temp_dir, 'weblab.csv')
+        pd.DataFrame({
+            'job_id': ['job-1', 'job-1'],
+            'weblab_id': ['WL_1', 'WL_1'],
+            'analysis_start_date': ['20240307', '20240307'],
+            'analysis_end_date': ['20240320', '20240320'],
+            'metric_name': ['OPS', 'OPS'],
+            'dimensions_string': ['all:all', 'asin:B01'],
+            'segmentation_name': ['all', 'device'],
+            'segment_value': ['all', 'mobile'],
+            'treatment_name_a': ['C', 'C'],
+            'treatment_name_b': ['T1', 'T1'],
+            'customer_count_a': [1000, None],
+            'customer_count_b': [1010, None],
+            'metric_count_a': [1200, 300],
+            'metric_count_b': [1210, 310],
+            'metric_p_value': [0.004, 0.5],
+            'overall_percent_impact': [1.25, -0.5],
+            'overall_percent_ci_lower': [0.5, -2.0],
+            'overall_percent_ci_upper': [2.0, 1.0],
+            'overall_annualized_impact': [120000, -500],
+            'overall_annualized_ci_lower': [50000, -2000],
+            'overall_annualized_ci_upper': [190000, 1000],
+            'overall_posterior_probability_positive': [0.99, 0.3],
+            'unused_column': ['x', 'y']
+        }).to_csv(self.csv_path, index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_read_csv_projects_weblab_columns(self):
+        df = FileHandler(self.temp_dir).read_csv(self.csv_path)
+        self.assertNotIn('job_id', df.columns)
+        self.assertNotIn('unused_column', df.columns)
+        self.assertTrue(set(df.columns) <= set(WEBLAB_COLUMNS))
+        self.assertEqual(df['overall_percent_impact'].dtype, 'float64')
+        self.assertEqual(df['analysis_start_date'].iloc[0], '20240307')
+
+    def test_weblab_results_format(self):
+        df = FileHandler(self.temp_dir).read_csv(self.csv_path)
+        formatted = PromptBuilder()._format_dataframe(df)
+        self.assertTrue(formatted.startswith(
+            "Weblab Experiment Results (weblab WL_1, from 20240307, to 20240320, C vs T1 (B relative to A)):"))
+        self.assertIn("- OPS | all:all: percent impact +1.25 [+0.5, +2], P(impact>0)=0.990, p=0.0040**, "
+                      "annualized 120,000 [50,000, 190,000], n=1,000/1,010", formatted)
+        # Falls back to metric counts and names the segmentation
+        self.assertIn("- OPS | asin:B01 / device=mobile: percent impact -0.5 [-2, +1], P(impact>0)=0.300, "
+                      "p=0.5000, annualized -500 [-2,000, 1,000], n=300/310", formatted)
+
+    def test_weblab_rows_without_metric_name_are_left_out(self):
+        df = FileHandler(self.temp_dir).read_csv(self.csv_path)
+        blank = pd.DataFrame({'metric_name': [np.nan] * 3, 'dimensions_string': ['all:all', np.nan, np.nan]})
+        formatted = PromptBuilder()._format_dataframe(pd.concat([df, blank], ignore_index=True))
+        self.assertEqual(formatted.count("\n- "), 2)
+        self.assertNotIn("nan", formatted)
+
+        path = os.path.join(os.path.dirname(__file__), 'uploads',
+                            '1e4349d2-7a3b-4490-84e6-d1952b973d5c.1724180909369933555-1.csv')
+        export = FileHandler(self.temp_dir).read_csv(path)
+        formatted = PromptBuilder()._format_dataframe(export)
+        self.assertEqual(formatted.count("\n- "), export['metric_name'].notna().sum())
+        self.assertNotIn("- nan |", formatted)
+
+class TestStreamingIngestion(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.csv_bytes = ("metric,control,treatment\n"
+                          + "".join(f"m{i},{i},{i + 0.5}\n" for i in range(50))).encode('utf-8')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def upload(self, data, filename='data.csv'):
+        from werkzeug.datastructures import FileStorage
+        return FileStorage(stream=BytesIO(data), filename=filename)
+
+    def test_ingest_upload_parses_in_chunks_and_saves(self):
+        file_handler = FileHandler(upload_folder=self.temp_dir, chunk_rows=7)
+        file_path, df = file_handler.ingest_upload(self.upload(self.csv_bytes))
+        with open(file_path, 'rb') as f:
+            self.assertEqual(f.read(), self.csv_bytes)
+        pd.testing.assert_frame_equal(df, pd.read_csv(file_path))
+
+    def test_limits_reject_upload_and_remove_file(self):
+        for file_handler in [FileHandler(upload_folder=self.temp_dir, max_rows=20, chunk_rows=7),
+                             FileHandler(upload_folder=self.temp_dir, max_bytes=200)]:
+            with self.assertRaises(UploadLimitError):
+                file_handler.ingest_upload(self.upload(self.csv_bytes))
+            self.assertEqual([name for _, _, names in os.walk(self.temp_dir) for name in names], [])
+
+    def test_invalid_upload_is_rejected_before_it_is_read_to_the_end(self):
+        data = b"name,label\n" + b"alpha,beta\n" * 500000
+        stream = BytesIO(data)
+        file_handler = FileHandler(upload_folder=self.temp_dir, chunk_rows=1000)
+        from werkzeug.datastructures import FileStorage
+        with self.assertRaises(ValueError):
+            file_handler.ingest_upload(FileStorage(stream=stream, filename='data.csv'))
+        self.assertLess(stream.tell(), len(data))
+        self.assertEqual([name for _, _, names in os.walk(self.temp_dir) for name in names], [])
+
+    def test_uploads_are_content_addressed(self):
+        file_handler = FileHandler(upload_folder=self.temp_dir)
+        other_bytes = self.csv_bytes.replace(b'm1,', b'x1,')
+        first_path, _ = file_handler.ingest_upload(self.upload(self.csv_bytes, 'results.csv'))
+        other_path, _ = file_handler.ingest_upload(self.upload(other_bytes, 'results.csv'))
+        again_path = file_handler.save_file(self.upload(self.csv_bytes, 'copy.csv'))
+        # Same name never collides, same content is stored once
+        self.assertNotEqual(first_path, other_path)
+        self.assertEqual(first_path, again_path)
+        stored = [os.path.join(root, name) for root, _, names in os.walk(self.temp_dir) for name in names]
+        self.assertEqual(sorted(stored), sorted([first_path, other_path]))
+        # Sharded by the first two characters of the hash
+        self.assertEqual(os.path.basename(os.path.dirname(first_path)), os.path.basename(first_path)[:2])
+        with open(other_path, 'rb') as f:
+            self.assertEqual(f.read(), other_bytes)
+
+    def test_parsed_uploads_are_cached(self):
+        cache_dir = os.path.join(self.temp_dir, 'parsed')
+        file_handler = FileHandler(upload_folder=self.temp_dir, dataframe_cache=DataFrameCache(cache_dir))
+        file_path, df = file_handler.ingest_upload(self.upload(self.csv_bytes))
+        with patch.object(FileHandler, '_read_csv_chunks', side_effect=AssertionError("parsed again")):
+            pd.testing.assert_frame_equal(file_handler.read_csv(file_path), df)
+            pd.testing.assert_frame_equal(file_handler.read_csv(file_path), df)
+            # Another worker finds the parsed file on disk
+            other_handler = FileHandler(upload_folder=self.temp_dir, dataframe_cache=DataFrameCache(cache_dir))
+            pd.testing.assert_frame_equal(other_handler.read_csv(file_path), df)
+        self.assertEqual(file_handler.dataframe_cache.stats()['memory_hits'], 2)
+        self.assertEqual(other_handler.dataframe_cache.stats()['disk_hits'], 1)
+
+    def test_dataframe_cache_evicts_least_recently_used(self):
+        df = pd.DataFrame({'value': range(1000)})
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        cache = DataFrameCache(max_entries=10, max_memory_bytes=int(size * 2.5))
+        for key in ['a', 'b']:
+            cache.set(key, df)
+        cache.get('a')
+        cache.set('c', df)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_first_chunk_is_validated(self):
+        class CountingStream:
+            def __init__(self, data):
+                self.stream = BytesIO(data)
+                self.bytes_read = 0
+
+            def read(self, size=-1):
+                data = self.stream.read(size)
+                self.bytes_read += len(data)
+                return data
+
+        text_rows = ("name,label\n" + "a,b\n" * 200000).encode('utf-8')
+        stream = CountingStream(text_rows)
+        file_handler = FileHandler(upload_folder=self.temp_dir, chunk_rows=100)
+        file_handler.BUFFER_SIZE = 4096
+        with self.assertRaises(ValueError) as context:
+            file_handler._read_csv_chunks(stream, validate=True)
+        self.assertIn("numeric column", str(context.exception))
+        self.assertLess(stream.bytes_read, len(text_rows))
+
+    def test_oversized_request_is_rejected(self):
+        import src.app
+        app.config['TESTING'] = True
+        limit = app.config['MAX_CONTENT_LENGTH']
+        app.config['MAX_CONTENT_LENGTH'] = 100
+        try:
+            with patch.object(src.app, 'model_catalog', Mock(get_models=Mock(return_value=[]))):
+                response = app.test_client().post('/', data={
+                    'csv_file': (BytesIO(self.csv_bytes), 'data.csv'),
+                    'model_name': 'model'
+                }, content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 413)
+            self.assertIn(b'larger than the limit', response.data)
+        finally:
+            app.config['MAX_CONTENT_LENGTH'] = limit
+
+class TestJobManager(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.job_manager = JobManager(os.path.join(self.temp_dir, 'jobs.sqlite3'), max_workers=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def wait_for(self, job_manager, job_id):
+        import time
+        for _ in range(200):
+            job = job_manager.get(job_id)
+            if job['status'] in ('succeeded', 'failed'):
+                return job
+            time.sleep(0.01)
+        self.fail("Job did not finish")
+
+    def test_job_reports_progress_and_result(self):
+        def work(value, progress):
+            progress(1, 2, 'map')
+            progress(2, 2, 'summary')
+            return {'summary': value}
+
+        job_id = self.job_manager.submit(work, 'done')
+        job = self.wait_for(self.job_manager, job_id)
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['progress'], {'done': 2, 'total': 2})
+        self.assertEqual(job['result'], {'summary': 'done'})
+
+        # Any process using the same database sees the job
+        other_worker = JobManager(self.job_manager.db_path)
+        self.assertEqual(other_worker.get(job_id)['result'], {'summary': 'done'})
+        self.assertIsNone(other_worker.get('missing'))
+
+    def test_failed_job_records_error(self):
+        def work(progress):
+            raise ValueError("The CSV file is empty")
+
+        job = self.wait_for(self.job_manager, self.job_manager.submit(work))
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['error'], "The CSV file is empty")
+        self.assertEqual(self.job_manager.stats()['jobs'], {'failed': 1})
+
+    def test_job_routes(self):
+        import src.app
+        app.config['TESTING'] = True
+        client = app.test_client()
+        result = {'summary': 'Treatment wins', 'key_metrics': [], 'recommendations': [], 'limitations': []}
+        run = Mock(return_value=result)
+        with patch.object(src.app, 'job_manager', self.job_manager), \
+             patch.object(src.app.analysis_pipeline, 'run', run), \
+             patch.object(src.app, 'file_handler', FileHandler(upload_folder=self.temp_dir)), \
+             patch.object(src.app, 'model_catalog', Mock(get_models=Mock(return_value=[]))):
+            response = client.post('/jobs', data={
+                'csv_file': (BytesIO(b"metric,control\nconversion_rate,0.1\n"), 'data.csv'),
+                'model_name': 'anthropic.claude-v2',
+                'instructions': 'Focus on conversion'
+            }, content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 202)
+            job_id = response.get_json()['job_id']
+            self.wait_for(self.job_manager, job_id)
+
+            job = client.get(f'/jobs/{job_id}').get_json()
+            self.assertEqual(job['status'], 'succeeded')
+            self.assertEqual(job['result'], result)
+            self.assertEqual(run.call_args.kwargs['instructions'], 'Focus on conversion')
+            self.assertIn(b'Treatment wins', client.get(f'/?job={job_id}').data)
+            self.assertEqual(client.get('/jobs/missing').status_code, 404)
+
+            response = client.post('/jobs', data={'model_name': 'anthropic.claude-v2'})
+            self.assertEqual(response.status_code, 400)
+
+    def test_event_stream_sends_partials_before_job_finishes(self):
+        import threading
+        import src.app
+        app.config['TESTING'] = True
+        gate = threading.Event()
+
+        def work(progress):
+            progress(0, 0, 'parse', {'stage': 'parse', 'rows': 40, 'columns': 5})
+            progress(1, 3, 'map', {'stage': 'map', 'slice': 'part 1', 'partial': {'findings': ['up']},
+                                   'done': 1, 'total': 3})
+            gate.wait(5)
+            progress(3, 3, 'summary', {'stage': 'summary', 'result': {'summary': 'ok'}, 'done': 3, 'total': 3})
+            return {'summary': 'ok'}
+
+        with patch.object(src.app, 'job_manager', self.job_manager), \
+             patch.object(src.app, 'JOB_EVENT_POLL_SECONDS', 0.01):
+            job_id = self.job_manager.submit(work)
+            response = app.test_client().get(f'/jobs/{job_id}/events', buffered=False)
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            chunks = iter(response.response)
+            received = ''
+            while 'event: map' not in received:
+                received += next(chunks).decode('utf-8')
+            # The first slice arrives while the job is still running
+            self.assertEqual(self.job_manager.get(job_id)['status'], 'running')
+            self.assertIn('id: 2\nevent: map\ndata: ', received)
+
+            gate.set()
+            received += ''.join(chunk.decode('utf-8') for chunk in chunks)
+            response.close()
+            self.assertIn('event: summary', received)
+            self.assertTrue(received.endswith('event: end\ndata: {"status": "succeeded", "error": null}\n\n'))
+
+            # Reconnecting clients only get the events after the last one they received
+            resumed = app.test_client().get(f'/jobs/{job_id}/events', headers={'Last-Event-ID': '2'})
+            self.assertNotIn('event: map', resumed.get_data(as_text=True))
+            self.assertIn('event: summary', resumed.get_data(as_text=True))
+
+            # A malformed ID replays every event instead of failing the request
+            for last_event_id in ['abc', '2.5', '-3']:
+                replayed = app.test_client().get(f'/jobs/{job_id}/events', headers={'Last-Event-ID': last_event_id})
+                self.assertEqual(replayed.status_code, 200)
+                self.assertIn('id: 2\nevent: map', replayed.get_data(as_text=True))
+
+
+class TestBatchAnalyzer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_run_bounds_concurrency_and_isolates_failures(self):
+        import threading
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def run(file_path, instructions, model_name, use_examples, bypass_cache, format_options):
+            with lock:
+                active.append(file_path)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(file_path)
+            if file_path == 'broken.csv':
+                raise ValueError("The CSV file is empty")
+            return {'summary': file_path, 'statistical_significance': 'p<0.05',
+                    'key_metrics': [{'metric_name': 'conversion', 'impact range': '[+0.5%, +1.5%]',
+                                     'probability of impact >0': '98%', 'annualized impact': '$1.2M',
+                                     'interpretation': f'More orders in {file_path}'}] +
+                                   ([{'metric_name': 'revenue', 'impact range': '[-1%, +3%]',
+                                      'probability of impact >0': '80%', 'annualized impact': '$0.4M',
+                                      'interpretation': 'Flat'}] if file_path == 'b.csv' else []),
+                    'recommendations': [f'Ship {file_path}']}
+
+        analyzer = BatchAnalyzer(Mock(run=Mock(side_effect=run)), max_concurrency=2)
+        events = []
+        names = ['a.csv', 'broken.csv', 'b.csv', 'c.csv', 'd.csv']
+        batch = analyzer.run([(name, name) for name in names], 'Focus on conversion', 'model',
+                             progress=lambda done, total, stage, event: events.append(event))
+
+        self.assertEqual(max(peak), 2)
+        self.assertEqual([e['name'] for e in batch['experiments']], names)
+        self.assertEqual(batch['experiments'][1]['error'], "The CSV file is empty")
+        self.assertEqual(sorted(e['name'] for e in events), sorted(names))
+        self.assertEqual(events[-1]['done'], 5)
+        rollup = batch['rollup']
+        self.assertEqual((rollup['succeeded'], rollup['failed']), (4, 1))
+        self.assertEqual(rollup['failures'], [{'name': 'broken.csv', 'error': "The CSV file is empty"}])
+        self.assertEqual([m['metric_name'] for m in rollup['key_metrics']], ['conversion', 'revenue'])
+        self.assertEqual(len(rollup['key_metrics'][0]['experiments']), 4)
+        self.assertEqual(rollup['key_metrics'][1]['experiments'], [{
+            'name': 'b.csv', 'impact range': '[-1%, +3%]', 'probability of impact >0': '80%',
+            'annualized impact': '$0.4M', 'interpretation': 'Flat'}])
+        json.dumps(batch)
+
+    def test_batch_route_accepts_files_and_archive(self):
+        import zipfile
+        import src.app
+        app.config['TESTING'] = True
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('sprint/exp2.csv', "metric,control\nrevenue,10\n")
+            zf.writestr('__MACOSX/sprint/._exp2.csv', "junk")
+            zf.writestr('notes.txt', "not an experiment")
+        archive.seek(0)
+        job_manager = JobManager(os.path.join(self.temp_dir, 'jobs.sqlite3'))
+        run = Mock(return_value={'summary': 'ok', 'key_metrics': [], 'recommendations': []})
+        with patch.object(src.app, 'job_manager', job_manager), \
+             patch.object(src.app, 'batch_analyzer', BatchAnalyzer(Mock(run=run))), \
+             patch.object(src.app, 'file_handler', FileHandler(upload_folder=self.temp_dir)):
+            client = app.test_client()
+            response = client.post('/batches', data={
+                'csv_files': [(BytesIO(b"metric,control\nconversion_rate,0.1\n"), 'exp1.csv'),
+                              (BytesIO(b"metric,control\nconversion_rate,0.2\n"), 'exp1.csv')],
+                'archive': (archive, 'sprint.zip'),
+                'model_name': 'anthropic.claude-v2',
+                'instructions': 'Compare the sprint'
+            }, content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.get_json()['experiments'], 3)
+            job_id = response.get_json()['job_id']
+            for _ in range(200):
+                job = job_manager.get(job_id)
+                if job['status'] in ('succeeded', 'failed'):
+                    break
+                time.sleep(0.01)
+            self.assertEqual(job['status'], 'succeeded')
+            self.assertEqual([e['name'] for e in job['result']['experiments']], ['exp1.csv', 'exp1.csv (2)', 'exp2.csv'])
+            self.assertEqual(job['result']['rollup']['succeeded'], 3)
+            self.assertEqual(run.call_args.args[1], 'Compare the sprint')
+
+            response = client.post('/batches', data={'model_name': 'anthropic.claude-v2'})
+            self.assertEqual(response.status_code, 400)
+
+    def test_rejected_batch_leaves_no_files(self):
+        import zipfile
+        import src.app
+        app.config['TESTING'] = True
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('exp3.csv', "metric,control\nrevenue,10\n")
+            zf.writestr('exp4.csv', "metric,control\nrevenue,20\n")
+        archive.seek(0)
+        upload_folder = os.path.join(self.temp_dir, 'uploads')
+        with patch.object(src.app, 'BATCH_MAX_EXPERIMENTS', 2), \
+             patch.object(src.app, 'file_handler', FileHandler(upload_folder=upload_folder)):
+            client = app.test_client()
+
+            def csv_files(count):
+                return [(BytesIO(f"metric,control\nconversion_rate,0.{i}\n".encode()), f'exp{i}.csv')
+                        for i in range(count)]
+
+            # Too many files are rejected before any is saved
+            with patch.object(FileHandler, 'save_file', side_effect=AssertionError("saved")):
+                response = client.post('/batches', data={'csv_files': csv_files(3), 'model_name': 'anthropic.claude-v2'},
+                                       content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 400)
+            # Files saved before the archive went over the limit are removed again
+            response = client.post('/batches', data={'csv_files': csv_files(1), 'archive': (archive, 'sprint.zip'),
+                                                     'model_name': 'anthropic.claude-v2'},
+                                   content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("more than the limit of 1", response.get_json()['error'])
+            self.assertEqual([name for _, _, names in os.walk(upload_folder) for name in names], [])
+
+class TestFileWatcher(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.temp_dir, 'data'))
+        os.makedirs(os.path.join(self.temp_dir, 'analyses'))
+        self.examples = []
+        self.add_example('checkout', ['conversion_rate', 'add_to_cart_rate'])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def add_example(self, example_id, metrics):
+        pd.DataFrame({'metric': metrics, 'control': 1.0, 'treatment': 1.1, 'difference': 0.1, 'p_value': 0.04}
+                     ).to_csv(os.path.join(self.temp_dir, 'data', f'{example_id}.csv'), index=False)
+        with open(os.path.join(self.temp_dir, 'analyses', f'{example_id}.json'), 'w') as f:
+            json.dump({'summary': example_id}, f)
+        self.examples.append({'id': example_id, 'name': example_id, 'data_file': f'{example_id}.csv',
+                              'analysis_file': f'{example_id}.json', 'metrics': metrics})
+        self.write_metadata(json.dumps({'examples': self.examples}))
+
+    def write_metadata(self, text):
+        path = os.path.join(self.temp_dir, 'metadata.json')
+        with open(path, 'w') as f:
+            f.write(text)
+        # Make the change visible even on file systems with coarse modification times
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9 * (len(self.examples) + len(text))))
+
+    def test_examples_are_reloaded_and_swapped_on_change(self):
+        manager = ExampleManager(self.temp_dir)
+        watcher = FileWatcher(interval_seconds=0)
+        watcher.watch('examples', manager.watched_paths, manager.reload)
+        revenue_df = pd.DataFrame({'metric': ['revenue']})
+        self.assertEqual(watcher.check(), {'examples': False})
+        old_index = manager._index
+
+        self.add_example('pricing', ['revenue', 'average_order_value'])
+        self.assertEqual(watcher.check(), {'examples': True})
+        self.assertEqual(manager.select_examples(revenue_df, max_examples=1)[0]['metadata']['id'], 'pricing')
+        # The unchanged example was taken over, and the old index was left untouched
+        self.assertIs(manager._index.by_id['checkout'], old_index.by_id['checkout'])
+        self.assertEqual(len(old_index.entries), 1)
+        stats = watcher.stats()['watches']['examples']
+        self.assertEqual(stats['reloads'], 1)
+        self.assertEqual(stats['last_counts'], {'examples': 2, 'loaded': 2, 'reused': 1})
+
+        # A half-written metadata file keeps the current examples until it is fixed
+        self.write_metadata('{"examples": [')
+        self.assertEqual(watcher.check(), {'examples': False})
+        self.assertEqual(len(manager.get_all_examples()), 2)
+        self.assertEqual(watcher.stats()['watches']['examples']['failures'], 1)
+        # The broken file is not reloaded again until it changes
+        self.assertEqual(watcher.check(), {'examples': False})
+        self.assertEqual(watcher.stats()['watches']['examples']['failures'], 1)
+        self.write_metadata(json.dumps({'examples': self.examples[:1]}))
+        self.assertEqual(watcher.check(), {'examples': True})
+        self.assertEqual([e['id'] for e in manager.get_all_examples()], ['checkout'])
+
+    def test_field_descriptions_are_reloaded(self):
+        path = os.path.join(self.temp_dir, 'descriptions.csv')
+        with open(path, 'w') as f:
+            f.write("field_name,description\nrevenue,Total revenue\n")
+        file_handler = FileHandler(upload_folder=os.path.join(self.temp_dir, 'uploads'), descriptions_path=path)
+        watcher = FileWatcher(interval_seconds=0)
+        watcher.watch('field_descriptions', lambda: [path], file_handler.reload_field_descriptions)
+
+        with open(path, 'a') as f:
+            f.write("units,Units sold\n")
+        self.assertEqual(watcher.check(), {'field_descriptions': True})
+        self.assertEqual(file_handler.get_field_descriptions(pd.DataFrame({'metric': ['units']})),
+                         {'units': 'Units sold'})
+        self.assertEqual(watcher.stats()['watches']['field_descriptions']['last_counts'], {'descriptions': 2})
+
+class TestDescriptionIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = DescriptionIndex({
+            'overall_percent_impact': 'Percent impact',
+            'overall_*': 'Overall statistic',
+            'overall_posterior_*': 'Posterior statistic',
+            'metric_*_share': 'Share of a segment',
+            'Segment-?.Count (All)': 'Segment count',
+            'conversion_rate': 'Conversion rate'
+        })
+
+    def test_match_kinds(self):
+        matches = self.index.match(['overall_percent_impact', 'Conversion Rate', 'overall_p_value',
+                                    'overall_posterior_mean', 'metric_mobile_share', 'unknown', 'Conversion Rate'])
+        self.assertEqual(matches, [
+            ('overall_percent_impact', 'Percent impact', 0),
+            ('Conversion Rate', 'Conversion rate', 1),
+            ('overall_p_value', 'Overall statistic', 2),
+            # The longest prefix wins
+            ('overall_posterior_mean', 'Posterior statistic', 2),
+            ('metric_mobile_share', 'Share of a segment', 3)
+        ])
+        # Patterns are normalized like the names, keeping their wildcards
+        self.assertEqual(self.index.match(['segment_a_count_all', 'Segment B Count (all)', 'segment_ab_count_all']), [
+            ('segment_a_count_all', 'Segment count', 3),
+            ('Segment B Count (all)', 'Segment count', 3)
+        ])
+
+    def test_lookup_groups_ranks_and_caps(self):
+        names = ['overall_a', 'overall_b', 'conversion_rate'] + [f'overall_{i}' for i in range(10)]
+        self.assertEqual(self.index.lookup(names), {
+            'conversion_rate': 'Conversion rate',
+            'overall_a, overall_b, overall_0, overall_1, overall_2, overall_3 (+6 more)': 'Overall statistic'
+        })
+        self.assertEqual(self.index.lookup(names, max_descriptions=1), {'conversion_rate': 'Conversion rate'})
+
+    def test_file_handler_describes_columns_and_metric_names(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'descriptions.csv')
+            with open(path, 'w') as f:
+                f.write("field_name,description\nmetric_name,Metric name\noverall_*,Overall statistic\n"
+                        "Units Sold,Units sold\n")
+            file_handler = FileHandler(upload_folder=os.path.join(temp_dir, 'uploads'), descriptions_path=path,
+                                       max_descriptions=2)
+            df = pd.DataFrame({'metric_name': ['units_sold', 'revenue'], 'overall_percent_impact': [1.0, 2.0],
+                               'overall_p_value': [0.1, 0.2]})
+            self.assertEqual(file_handler.get_field_descriptions(df), {
+                'metric_name': 'Metric name',
+                'units_sold': 'Units sold'
+            })
+            self.assertEqual(file_handler.get_field_descriptions(df, max_descriptions=5)[
+                'overall_percent_impact, overall_p_value'], 'Overall statistic')
+        finally:
+            shutil.rmtree(temp_dir)
+
+def throttling_error(code='ThrottlingException', status=429):
+    return ClientError({'Error': {'Code': code, 'Message': 'Rate exceeded'},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, 'InvokeModel')
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+    def limiter(self, **kwargs):
+        options = dict(initial_rate=20, burst=1, max_retries=3, base_backoff_seconds=0.001)
+        options.update(kwargs)
+        return AdaptiveRateLimiter(**options)
+
+    def test_retries_throttled_calls_and_lowers_the_rate(self):
+        limiter = self.limiter(max_rate=20)
+        outcomes = [throttling_error(), throttling_error('ServiceUnavailableException', 503), 'done']
+
+        def call():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        self.assertEqual(limiter.call('anthropic.claude-v2', call), ('done', 2))
+        stats = limiter.stats()['models']['anthropic.claude-v2']
+        self.assertEqual((stats['requests'], stats['retries'], stats['throttled'], stats['transient_errors']),
+                         (3, 2, 1, 1))
+        self.assertEqual(stats['rate_decreases'], 1)
+        self.assertLess(stats['rate'], 20)
+
+        # Throttles of calls sent before the decrease don't lower the rate again
+        limiter.record_throttle('anthropic.claude-v2', sent_at=0)
+        self.assertEqual(limiter.stats()['models']['anthropic.claude-v2']['rate_decreases'], 1)
+        # Successful calls raise it again, up to max_rate
+        for _ in range(1000):
+            limiter.record_success('anthropic.claude-v2')
+        self.assertEqual(limiter.stats()['models']['anthropic.claude-v2']['rate'], limiter.max_rate)
+
+    def test_errors_are_raised_with_their_retries(self):
+        limiter = self.limiter()
+        with self.assertRaises(ModelInvocationError) as raised:
+            limiter.call('model', Mock(side_effect=throttling_error()))
+        self.assertEqual((raised.exception.code, raised.exception.retries), ('ThrottlingException', 3))
+
+        validation = Mock(side_effect=throttling_error('ValidationException', 400))
+        with self.assertRaises(ModelInvocationError) as raised:
+            limiter.call('model', validation)
+        self.assertEqual((raised.exception.retries, validation.call_count), (0, 1))
+
+    def test_calls_are_paced_per_model(self):
+        limiter = self.limiter(initial_rate=50, max_rate=50)
+        start = time.perf_counter()
+        for _ in range(6):
+            limiter.acquire('model')
+        # One call from the bucket right away, the others 1/50 s apart
+        self.assertGreaterEqual(time.perf_counter() - start, 0.09)
+        start = time.perf_counter()
+        limiter.acquire('other-model')
+        self.assertLess(time.perf_counter() - start, 0.01)
+
+    def test_service_retries_chunks_and_raises_failures(self):
+        runtime = Mock()
+        runtime.invoke_model.side_effect = [
+            throttling_error(), {'body': Mock(read=lambda: json.dumps({'completion': 'Test response'}))}
+        ]
+        service = AWSBedrockService('anthropic.claude-v2', client_pool=Mock(get_client=Mock(return_value=runtime)),
+                                    rate_limiter=self.limiter())
+        self.assertEqual(service.get_model_response("Test prompt"), 'Test response')
+        self.assertEqual(service.chunk_timings[0]['retries'], 1)
+        self.assertEqual(service.retries, 1)
+
+        runtime.invoke_model.side_effect = throttling_error('AccessDeniedException', 403)
+        with self.assertRaises(ModelInvocationError):
+            service.get_model_response("Test prompt")
+
+        # botocore does not retry model calls itself
+        pool = ClientPool()
+        self.assertEqual(pool.config_for('bedrock-runtime').retries['max_attempts'], 1)
+        self.assertEqual(pool.config_for('bedrock').retries['max_attempts'], 3)
+
+def tearDownModule():
+    shutil.rmtree(TEST_DATA_DIR, ignore_errors=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+"""
+Columnar on-disk format for parsed DataFrames
+
+Each DataFrame is written once and opened memory-mapped afterwards, so loading it costs little
+more than opening its files and the pages are shared through the OS page cache by every worker
+process that reads it. With pyarrow installed DataFrames are stored as Feather (Arrow IPC)
+files; otherwise each DataFrame is a directory of NumPy .npy files holding one 2-D array per
+column dtype, and text columns are dictionary-encoded as integer codes plus an array of their
+distinct values.
+"""
+import os
+import json
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from typing import Optional
+from src.utils.retention import shard_path
+
+try:
+    import pyarrow  # noqa: F401
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+FORMAT_VERSION = 1
+
+
+class ColumnarStore:
+    """
+    Directory of DataFrames in a memory-mappable columnar format, addressed by key
+
+    DataFrames returned by read are backed by read-only memory maps and must not be modified
+    in place. write returns False for DataFrames the format cannot hold (a non-default index,
+    non-string column names, or text columns that also hold other objects), so callers can
+    fall back to another format.
+    """
+    FORMATS = ('feather', 'npy')
+
+    def __init__(self, directory: str, format: Optional[str] = None):
+        """
+        Initialize the ColumnarStore
+
+        Args:
+            directory (str): Folder holding the stored DataFrames
+            format (str, optional): 'feather' or 'npy'; defaults to 'feather' when pyarrow is installed
+        """
+        format = format or ('feather' if PYARROW_AVAILABLE else 'npy')
+        if format not in self.FORMATS:
+            raise ValueError(f"Unknown columnar format: {format}")
+        if format == 'feather' and not PYARROW_AVAILABLE:
+            raise ValueError("The feather format requires pyarrow")
+        self.directory = directory
+        self.format = format
+
+    def path(self, key: str) -> str:
+        """
+        Get the file (feather) or directory (npy) a DataFrame is stored in, sharded by the
+        first two characters of its key
+        """
+        return shard_path(self.directory, f"{key}.{self.format}")
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    @staticmethod
+    def supports(df: pd.DataFrame) -> bool:
+        """
+        Check whether a DataFrame can be stored and read back unchanged
+        """
+        if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+            return False
+        if not all(isinstance(column, str) for column in df.columns) or not df.columns.is_unique:
+            return False
+        for column in df.columns:
+            series = df[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                values = series.cat.categories
+            elif series.dtype == object:
+                values = series.dropna()
+            elif isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biufcmM':
+                continue
+            else:
+                return False
+            if not all(isinstance(value, str) for value in values):
+                return False
+        return True
+
+    def write(self, key: str, df: pd.DataFrame) -> bool:
+        """
+        Store a DataFrame, replacing any previous version atomically
+
+        Returns:
+            bool: Whether the DataFrame was stored
+        """
+        if not self.supports(df):
+            return False
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if self.format == 'feather':
+                df.to_feather(temp_path)
+                os.replace(temp_path, path)
+            else:
+                self._write_npy(temp_path, df)
+                try:
+                    os.rename(temp_path, path)
+                except OSError:
+                    # Written concurrently by another process: same key, same content
+                    if not os.path.isdir(path):
+                        raise
+            return True
+        finally:
+            if os.path.isdir(temp_path):
+                shutil.rmtree(temp_path, ignore_errors=True)
+            elif os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def _write_npy(directory: str, df: pd.DataFrame):
+        """
+        Write the columns of each dtype as the rows of one 2-D array, so a DataFrame is a handful
+        of files however many columns it has, and text columns as rows of one code array
+        """
+        os.makedirs(directory)
+        columns = []
+        blocks = {}
+        codes = []
+        values = []
+        for name in df.columns:
+            series = df[name]
+            if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object:
+                if isinstance(series.dtype, pd.CategoricalDtype):
+                    column_codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+                else:
+                    column_codes, uniques = pd.factorize(series)
+                columns.append({'name': name, 'encoding': 'dictionary', 'row': len(codes),
+                                'categorical': isinstance(series.dtype, pd.CategoricalDtype),
+                                'values': [len(values), len(values) + len(uniques)]})
+                codes.append(column_codes)
+                values.extend(uniques)
+            else:
+                dtype = series.dtype.str
+                block = blocks.setdefault(dtype, [])
+                columns.append({'name': name, 'encoding': 'plain', 'block': dtype, 'row': len(block)})
+                block.append(series.to_numpy())
+
+        block_files = {}
+        for number, (dtype, arrays) in enumerate(blocks.items()):
+            block_files[dtype] = f"block{number}.npy"
+            np.save(os.path.join(directory, block_files[dtype]), np.stack(arrays))
+        if codes:
+            np.save(os.path.join(directory, 'codes.npy'), np.stack(codes).astype(np.int32))
+            np.save(os.path.join(directory, 'values.npy'), np.array(values, dtype=str))
+        with open(os.path.join(directory, 'columns.json'), 'w') as f:
+            json.dump({'version': FORMAT_VERSION, 'rows': len(df), 'blocks': block_files, 'columns': columns}, f)
+
+    def read(self, key: str) -> Optional[pd.DataFrame]:
+        """
+        Open a stored DataFrame memory-mapped
+
+        Returns:
+            Optional[pd.DataFrame]: The DataFrame, or None if it is missing or unreadable
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            if self.format == 'feather':
+                return pd.read_feather(path, memory_map=True)
+            return self._read_npy(path)
+        except Exception as e:
+            print(f"Error reading columnar file {path}: {str(e)}")
+            return None
+
+    @staticmethod
+    def _read_npy(directory: str) -> Optional[pd.DataFrame]:
+        with open(os.path.join(directory, 'columns.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != FORMAT_VERSION:
+            return None
+        blocks = {dtype: np.load(os.path.join(directory, name), mmap_mode='r')
+                  for dtype, name in meta['blocks'].items()}
+        codes = values = None
+        if any(column['encoding'] == 'dictionary' for column in meta['columns']):
+            codes = np.load(os.path.join(directory, 'codes.npy'), mmap_mode='r')
+            values = np.load(os.path.join(directory, 'values.npy')).astype(object)
+
+        data = {}
+        for column in meta['columns']:
+            if column['encoding'] == 'plain':
+                data[column['name']] = blocks[column['block']][column['row']]
+                continue
+            start, end = column['values']
+            column_codes = codes[column['row']]
+            if column['categorical']:
+                data[column['name']] = pd.Categorical.from_codes(np.asarray(column_codes),
+                                                                 categories=values[start:end])
+            else:
+                # Code -1 (missing) picks the NaN appended after the distinct values
+                data[column['name']] = np.append(values[start:end], np.nan)[column_codes]
+        return pd.DataFrame(data, index=pd.RangeIndex(meta['rows']), copy=False)
+
+    def delete(self, key: str):
+        """
+        Remove a stored DataFrame
+        """
+        path = self.path(key)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,156 @@
+import os
+import re
+import pickle
+import threading
+import pandas as pd
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+from src.utils.columnar_store import ColumnarStore
+from src.utils.retention import shard_path
+
+class DataFrameCache:
+    """
+    Cache of parsed DataFrames keyed by the content hash of the file they were read from
+
+    Recently used DataFrames are kept in memory, up to max_entries and max_memory_bytes, and
+    every DataFrame is also written to directory in a columnar format (see ColumnarStore), so
+    other worker processes and later restarts open it memory-mapped instead of parsing the CSV
+    again. DataFrames the columnar format cannot hold are pickled instead. Cached DataFrames
+    are shared between requests and must not be modified in place.
+    """
+    # Paths in directory written by the cache: the columnar and pickled copies in the shard of
+    # their key, and temporary files of copies being written
+    STORED_PATH_PATTERN = re.compile(r'^([0-9a-f]{2})/\1[0-9a-f-]*\.(npy|feather|pkl)(\.\d+\.\d+\.tmp)?$')
+
+    def __init__(self, directory: Optional[str] = None, max_entries: int = 16,
+                 max_memory_bytes: int = 512 * 1024 * 1024, format: Optional[str] = None):
+        """
+        Initialize the DataFrameCache
+
+        Args:
+            directory (str, optional): Folder of the on-disk copies; None keeps them in memory only
+            max_entries (int): Largest number of DataFrames kept in memory
+            max_memory_bytes (int): Largest total size of the DataFrames kept in memory
+            format (str, optional): Columnar format on disk, see ColumnarStore
+        """
+        self.directory = directory
+        self.store = ColumnarStore(directory, format) if directory else None
+        self.max_entries = max_entries
+        self.max_memory_bytes = max_memory_bytes
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    def _path(self, key: str) -> str:
+        return shard_path(self.directory, f"{key}.pkl")
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """
+        Get a cached DataFrame from memory, or from disk
+
+        Returns:
+            Optional[pd.DataFrame]: A shallow copy of the cached DataFrame, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return entry[0].copy(deep=False)
+
+        df = self._read(key)
+        with self._lock:
+            if df is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['disk_hits'] += 1
+            self._remember(key, df)
+        return df.copy(deep=False)
+
+    def set(self, key: str, df: pd.DataFrame):
+        """
+        Cache a DataFrame in memory and on disk
+        """
+        self._write(key, df)
+        with self._lock:
+            self._stats['writes'] += 1
+            self._remember(key, df)
+
+    def _remember(self, key: str, df: pd.DataFrame):
+        """
+        Add a DataFrame to the in-memory LRU, evicting the least recently used ones; needs the lock
+        """
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if key in self._entries:
+            self._memory_bytes -= self._entries.pop(key)[1]
+        if size > self.max_memory_bytes:
+            return
+        self._entries[key] = (df, size)
+        self._memory_bytes += size
+        while len(self._entries) > self.max_entries or self._memory_bytes > self.max_memory_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._memory_bytes -= evicted_size
+            self._stats['evictions'] += 1
+
+    def _read(self, key: str) -> Optional[pd.DataFrame]:
+        if not self.directory:
+            return None
+        df = self.store.read(key)
+        path = self.store.path(key)
+        if df is None:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    df = pickle.load(f)
+            except FileNotFoundError:
+                return None
+            except Exception as e:
+                print(f"Error reading cached DataFrame {path}: {str(e)}")
+                return None
+        # Keep recently read files from being swept as unused
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return df
+
+    def _write(self, key: str, df: pd.DataFrame):
+        if not self.directory:
+            return
+        try:
+            if self.store.write(key, df):
+                return
+        except Exception as e:
+            print(f"Error writing columnar DataFrame {self.store.path(key)}: {str(e)}")
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except Exception as e:
+            # The cache is an optimization; the parsed DataFrame is still returned
+            print(f"Error writing cached DataFrame {path}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the hit, miss and eviction counts and the memory held
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'memory_bytes': self._memory_bytes,
+                'max_memory_bytes': self.max_memory_bytes,
+                'directory': self.directory,
+                'format': self.store.format if self.store else None,
+                **self._stats
+            }
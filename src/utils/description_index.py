@@ -0,0 +1,171 @@
+"""
+Lookup of field descriptions for the columns and metrics of an uploaded file
+
+The descriptions dictionary can hold tens of thousands of entries. Besides exact field names
+it may contain prefixes such as 'overall_*' and shell-style patterns such as 'metric_*_a',
+which describe whole families of columns. All keys are indexed once when the file is loaded,
+and the names of an upload are matched with one batched hash lookup plus dictionary probes
+for the names that are not spelled exactly like a key.
+"""
+import re
+import fnmatch
+import pandas as pd
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Match kinds, from the most to the least specific
+EXACT, NORMALIZED, PREFIX, PATTERN = range(4)
+
+SEPARATORS = re.compile(r'[^0-9a-z]+')
+# Wildcards of shell-style patterns: '*', '?' and character sets such as '[ab]'
+WILDCARDS = re.compile(r'(\*|\?|\[[^\]]*\])')
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalize a field name for matching: lower case with runs of other characters replaced by '_'
+
+    'Overall Percent-Impact', 'overall_percent_impact' and 'OVERALL__PERCENT_IMPACT' all
+    normalize to 'overall_percent_impact'.
+    """
+    return SEPARATORS.sub('_', str(name).lower()).strip('_')
+
+
+def normalize_pattern(pattern: str) -> str:
+    """
+    Normalize a shell-style pattern like normalize_name, keeping its wildcards
+
+    'Metric-*-Share' normalizes to 'metric_*_share', so it matches the normalized names it
+    is compared with.
+    """
+    parts = WILDCARDS.split(str(pattern).lower())
+    # split puts the wildcards at the odd positions
+    return ''.join(part if i % 2 else SEPARATORS.sub('_', part) for i, part in enumerate(parts)).strip('_')
+
+
+class DescriptionIndex:
+    """
+    Index of field descriptions supporting exact, normalized, prefix and pattern matches
+
+    A key ending in a single '*' (e.g. 'overall_*') is a prefix; other keys containing '*',
+    '?' or '[' are shell-style patterns. A name gets the description of its exact key if
+    there is one, otherwise of its normalized key, otherwise of the longest matching prefix,
+    otherwise of the first matching pattern.
+    """
+    # Names listed for one description before the rest are summarized
+    MAX_NAMES_PER_DESCRIPTION = 6
+
+    def __init__(self, descriptions: Dict[str, str]):
+        """
+        Build the index
+
+        Args:
+            descriptions (Dict[str, str]): Field names, prefixes or patterns and their descriptions
+        """
+        self.descriptions = descriptions
+        exact_keys, exact_values = [], []
+        normalized = {}
+        prefixes = {}
+        self.patterns = []
+        for key, description in descriptions.items():
+            key = str(key)
+            description = str(description)
+            wildcard = any(char in key for char in '*?[')
+            if key.endswith('*') and not any(char in key[:-1] for char in '*?['):
+                prefixes.setdefault(normalize_name(key[:-1]), description)
+            elif wildcard:
+                self.patterns.append((re.compile(fnmatch.translate(normalize_pattern(key))), description))
+            else:
+                exact_keys.append(key)
+                exact_values.append(description)
+                normalized.setdefault(normalize_name(key), description)
+
+        self.exact_keys = pd.Index(exact_keys)
+        self.exact_values = exact_values
+        self.normalized = normalized
+        # Prefixes grouped by length, so each length is matched with one lookup
+        self.prefixes_by_length = {}
+        for prefix, description in prefixes.items():
+            self.prefixes_by_length.setdefault(len(prefix), {})[prefix] = description
+        self.prefix_lengths = sorted(self.prefixes_by_length, reverse=True)
+
+    def __len__(self):
+        return len(self.descriptions)
+
+    def match(self, names: Iterable[str]) -> List[Tuple[str, str, int]]:
+        """
+        Find the description of each name
+
+        Exact names are looked up for the whole batch with one hash-table probe; only the
+        remaining names are normalized and tried against the normalized keys, their prefixes
+        (one dictionary probe per prefix length, longest first) and the patterns.
+
+        Args:
+            names: Column names and metric values to describe
+
+        Returns:
+            List[Tuple[str, str, int]]: (name, description, kind) for each distinct name that has a
+            description, in input order; kind is EXACT, NORMALIZED, PREFIX or PATTERN
+        """
+        names = pd.unique(pd.Series(list(names), dtype=object).dropna().astype(str))
+        if len(names) == 0:
+            return []
+        positions = self.exact_keys.get_indexer(names)
+
+        matches = []
+        for name, position in zip(names, positions):
+            if position >= 0:
+                matches.append((name, self.exact_values[position], EXACT))
+                continue
+            normalized = SEPARATORS.sub('_', name.lower()).strip('_')
+            description = self.normalized.get(normalized)
+            if description is not None:
+                matches.append((name, description, NORMALIZED))
+                continue
+            for length in self.prefix_lengths:
+                if length <= len(normalized):
+                    description = self.prefixes_by_length[length].get(normalized[:length])
+                    if description is not None:
+                        matches.append((name, description, PREFIX))
+                        break
+            else:
+                for pattern, description in self.patterns:
+                    if pattern.match(normalized):
+                        matches.append((name, description, PATTERN))
+                        break
+        return matches
+
+    def lookup(self, names: Iterable[str], max_descriptions: Optional[int] = None) -> Dict[str, str]:
+        """
+        Get the descriptions of a set of names for the prompt
+
+        Names sharing a description are listed together under it, and descriptions are ranked
+        by how specifically they matched and then by the position of their first name, so the
+        most relevant ones are kept when max_descriptions cuts the list.
+
+        Args:
+            names: Column names and metric values to describe, most important first
+            max_descriptions (int, optional): Largest number of descriptions returned
+
+        Returns:
+            Dict[str, str]: Maps the comma-separated names of each description to the description
+        """
+        matches = self.match(names)
+        # Group the names by description, keeping the best kind and first position of each
+        groups = {}
+        for order, (name, description, kind) in enumerate(matches):
+            group = groups.get(description)
+            if group is None:
+                groups[description] = [kind, order, [name]]
+            else:
+                group[0] = min(group[0], kind)
+                group[2].append(name)
+        ranked = sorted(groups.items(), key=lambda item: (item[1][0], item[1][1]))
+        if max_descriptions is not None:
+            ranked = ranked[:max_descriptions]
+        return {self._format_names(group[2]): description for description, group in ranked}
+
+    def _format_names(self, names: List[str]) -> str:
+        if len(names) <= self.MAX_NAMES_PER_DESCRIPTION:
+            return ', '.join(names)
+        shown = ', '.join(names[:self.MAX_NAMES_PER_DESCRIPTION])
+        return f"{shown} (+{len(names) - self.MAX_NAMES_PER_DESCRIPTION} more)"
@@ -1,19 +1,119 @@
+import io
 import os
+import re
+import csv
+import hashlib
+import tempfile
+import zipfile
 import pandas as pd
 from werkzeug.utils import secure_filename
+from werkzeug.datastructures import FileStorage
+from src.utils.weblab_format import WEBLAB_COLUMNS, is_weblab_format
+from src.utils.description_index import DescriptionIndex
+from src.utils.dataframe_cache import DataFrameCache
+from src.utils.retention import shard_path
+
+class UploadLimitError(ValueError):
+    """
+    Raised when a CSV file is larger than the configured byte or row budget
+    """
+    pass
+
+class _DigestSink:
+    """
+    Binary file wrapper that computes the SHA-256 hash of everything written to it
+    """
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.file.write(data)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+class _BudgetedReader(io.RawIOBase):
+    """
+    Binary stream wrapper that counts the bytes read, stops once the byte budget is exceeded
+    and optionally copies everything it reads to a sink file
+    """
+    def __init__(self, stream, max_bytes=None, sink=None):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.sink = sink
+        self.bytes_read = 0
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def _read_stream(self, size):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        if self.max_bytes and self.bytes_read > self.max_bytes:
+            raise UploadLimitError(f"The CSV file is larger than the limit of {self.max_bytes:,} bytes")
+        if self.sink is not None:
+            self.sink.write(data)
+        return data
+
+    def peek_line(self):
+        """
+        Return the first line of the stream without consuming it
+        """
+        while b'\n' not in self._pending:
+            data = self._read_stream(64 * 1024)
+            if not data:
+                break
+            self._pending += data
+        return self._pending.split(b'\n', 1)[0]
+
+    def readinto(self, buffer):
+        if self._pending:
+            data = self._pending[:len(buffer)]
+            self._pending = self._pending[len(data):]
+        else:
+            data = self._read_stream(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
 
 class FileHandler:
-    def __init__(self, upload_folder='uploads', descriptions_path='src/static/field_descriptions.csv'):
+    # Bytes read from the upload at a time
+    BUFFER_SIZE = 1024 * 1024
+    # Uploads are stored as <first two characters of the hash>/<sha256 of the content>.csv
+    CONTENT_NAME_PATTERN = re.compile(r'^[0-9a-f]{64}\.csv$')
+    # Paths in the upload folder written by the handler: stored uploads in their shard, and the
+    # temporary files of uploads being received. Retention sweeps leave everything else alone.
+    STORED_PATH_PATTERN = re.compile(r'^(([0-9a-f]{2})/\2[0-9a-f]{62}\.csv|tmp[0-9a-z_]+\.part)$')
+
+    def __init__(self, upload_folder='uploads', descriptions_path='src/static/field_descriptions.csv',
+                 max_bytes=None, max_rows=None, chunk_rows=10000, max_descriptions=None,
+                 dataframe_cache=None):
         """
         Initialize the FileHandler with the upload folder path and descriptions file path
         
         Args:
             upload_folder (str): Path to the folder where uploaded files will be stored
             descriptions_path (str): Path to the CSV file containing field descriptions
+            max_bytes (int, optional): Largest CSV file accepted, in bytes
+            max_rows (int, optional): Largest number of data rows accepted
+            chunk_rows (int): Number of rows parsed at a time
+            max_descriptions (int, optional): Largest number of field descriptions put in a prompt
+            dataframe_cache (DataFrameCache, optional): Cache of parsed files; defaults to a small
+                in-memory cache
         """
         self.upload_folder = upload_folder
         self.descriptions_path = descriptions_path
-        self.field_descriptions = self._load_field_descriptions()
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.chunk_rows = chunk_rows
+        self.max_descriptions = max_descriptions
+        self.dataframe_cache = dataframe_cache if dataframe_cache is not None else DataFrameCache()
+        # Parsed files are cached per version of the parser settings
+        parser_settings = repr((sorted(WEBLAB_COLUMNS.items()), chunk_rows))
+        self._parser_key = hashlib.sha1(parser_settings.encode('utf-8')).hexdigest()[:12]
+        self.description_index = DescriptionIndex(self._load_field_descriptions())
         self._ensure_upload_folder_exists()
         
     def _ensure_upload_folder_exists(self):
@@ -31,36 +131,170 @@ class FileHandler:
             dict: A dictionary mapping field names to their descriptions
         """
         try:
-            if os.path.exists(self.descriptions_path):
-                df = pd.read_csv(self.descriptions_path)
+            return self._read_field_descriptions()
+        except Exception as e:
+            print(f"Error loading field descriptions: {str(e)}")
+            return {}
+
+    @property
+    def field_descriptions(self):
+        """
+        The field descriptions as loaded from the CSV file, including prefix and pattern keys
+        """
+        return self.description_index.descriptions
+
+    def _read_field_descriptions(self):
+        """
+        Read the field descriptions CSV file, raising an exception if it cannot be parsed
+        """
+        if os.path.exists(self.descriptions_path):
+            df = pd.read_csv(self.descriptions_path)
+            
+            # Check if the dataframe has at least two columns
+            if len(df.columns) >= 2:
+                # Use the first column for field names and the second column for descriptions
+                field_name_col = df.columns[0]
+                description_col = df.columns[1]
                 
-                # Check if the dataframe has at least two columns
-                if len(df.columns) >= 2:
-                    # Use the first column for field names and the second column for descriptions
-                    field_name_col = df.columns[0]
-                    description_col = df.columns[1]
-                    
-                    return dict(zip(df[field_name_col], df[description_col]))
-                else:
-                    print(f"Warning: Field descriptions file must have at least two columns")
-                    return {}
+                return dict(zip(df[field_name_col], df[description_col]))
             else:
-                print(f"Warning: Field descriptions file not found at {self.descriptions_path}")
+                print(f"Warning: Field descriptions file must have at least two columns")
                 return {}
-        except Exception as e:
-            print(f"Error loading field descriptions: {str(e)}")
+        else:
+            print(f"Warning: Field descriptions file not found at {self.descriptions_path}")
             return {}
+
+    def reload_field_descriptions(self):
+        """
+        Load and index the field descriptions again and replace the current index in a single assignment
+
+        Returns:
+            dict: Number of 'descriptions' loaded
+
+        Raises:
+            Exception: If the file cannot be parsed; the current descriptions are kept
+        """
+        index = DescriptionIndex(self._read_field_descriptions())
+        self.description_index = index
+        return {'descriptions': len(index)}
             
-    def save_file(self, file):
+    def save_file(self, file, new_files=None):
         """
-        Save an uploaded file to the upload folder
-        
+        Save an uploaded file to the upload folder under the hash of its content
+
         Args:
             file: The file object from the request
-            
+            new_files (list, optional): Receives the path of the file if it was not stored
+                before, so a caller can remove what it added when a later step fails
+
         Returns:
             str: The path to the saved file
         """
+        file_path, _, created, _ = self._store_upload(file)
+        if created and new_files is not None:
+            new_files.append(file_path)
+        return file_path
+
+    def save_archive(self, file, max_files=None, new_files=None):
+        """
+        Save every CSV file of an uploaded zip archive to the upload folder
+
+        Members are decompressed as a stream within the byte budget of a single upload, so an
+        archive cannot expand beyond max_bytes per file. Directories, files other than CSV
+        and the metadata folders added by macOS are skipped.
+
+        Args:
+            file: The zip file object from the request
+            max_files (int, optional): Largest number of CSV files accepted
+            new_files (list, optional): Receives the paths of the files that were not stored before
+
+        Returns:
+            list: (name, path) of each saved CSV file, in archive order
+        """
+        if not file or not secure_filename(file.filename or '').lower().endswith('.zip'):
+            raise ValueError("Only zip archives are allowed")
+        try:
+            archive = zipfile.ZipFile(file.stream)
+        except zipfile.BadZipFile:
+            raise ValueError("The archive is not a valid zip file")
+        with archive:
+            members = [info for info in archive.infolist()
+                       if not info.is_dir()
+                       and not info.filename.startswith('__MACOSX/')
+                       and not os.path.basename(info.filename).startswith('.')
+                       and self._is_csv_file(info.filename)]
+            if not members:
+                raise ValueError("The archive does not contain any CSV file")
+            if max_files and len(members) > max_files:
+                raise ValueError(f"The archive has more than the limit of {max_files} CSV files")
+            saved = []
+            for info in members:
+                name = os.path.basename(info.filename)
+                with archive.open(info) as stream:
+                    saved.append((name, self.save_file(FileStorage(stream=stream, filename=name), new_files)))
+            return saved
+
+    def ingest_upload(self, file):
+        """
+        Save an uploaded CSV file and parse it in the same pass
+
+        The upload is parsed as it is received, while a copy is written to a private temporary
+        file and its SHA-256 hash is computed, so a file that exceeds the byte or row budget or
+        fails validation is rejected as soon as the problem is found. A valid file is then moved
+        to <shard>/<hash>.csv, so concurrent uploads of files with the same name never overwrite
+        each other and a file uploaded again is stored once, and its DataFrame is cached for the
+        later reads of the file. Files that are rejected are not kept.
+
+        Args:
+            file: The file object from the request
+
+        Returns:
+            tuple: The path to the saved file and the DataFrame with its data
+        """
+        file_path, digest, _, data_df = self._store_upload(file, parse=True)
+        self._cache_parsed(f"{digest}-{self._parser_key}", data_df)
+        return file_path, data_df
+
+    def _store_upload(self, file, parse=False):
+        """
+        Copy an upload to the upload folder under the hash of its content
+
+        Args:
+            file: The file object from the request
+            parse (bool): Parse and validate the upload while it is copied
+
+        Returns:
+            tuple: The path of the file, its SHA-256 hex digest, whether the file is new and
+            the parsed DataFrame (None unless parse is set)
+        """
+        self._check_upload(file)
+        fd, temp_path = tempfile.mkstemp(dir=self.upload_folder, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                sink = _DigestSink(f)
+                if parse:
+                    data_df = self._read_csv_chunks(file.stream, sink=sink, validate=True)
+                else:
+                    data_df = None
+                    reader = _BudgetedReader(file.stream, self.max_bytes, sink)
+                    while reader.read(self.BUFFER_SIZE):
+                        pass
+            digest = sink.hexdigest()
+            file_path = shard_path(self.upload_folder, f"{digest}.csv")
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            created = not os.path.exists(file_path)
+            # Same name means same content, so a concurrent upload of the file is replaced by an equal copy
+            os.replace(temp_path, file_path)
+            return file_path, digest, created, data_df
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _check_upload(self, file):
+        """
+        Check that an upload is present and has a CSV file name
+        """
         if not file:
             raise ValueError("No file provided")
             
@@ -70,10 +304,6 @@ class FileHandler:
             
         if not self._is_csv_file(filename):
             raise ValueError("Only CSV files are allowed")
-            
-        file_path = os.path.join(self.upload_folder, filename)
-        file.save(file_path)
-        return file_path
         
     def _is_csv_file(self, filename):
         """
@@ -91,39 +321,141 @@ class FileHandler:
         """
         Read a CSV file and return a pandas DataFrame
         
+        The DataFrame is taken from the cache when a file with the same content was parsed before.
+        
         Args:
             file_path (str): Path to the CSV file
             
         Returns:
             pandas.DataFrame: The data from the CSV file
         """
+        return self._read_cached(file_path, self._content_digest(file_path))
+
+    def _content_digest(self, file_path):
+        """
+        Get the SHA-256 hex digest of a file, taken from the name of stored uploads
+        """
+        name = os.path.basename(file_path)
+        if self.CONTENT_NAME_PATTERN.match(name):
+            return name[:-len('.csv')]
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(self.BUFFER_SIZE), b''):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def _read_cached(self, file_path, digest, validate=False):
+        """
+        Get the parsed content of a file from the cache, parsing and caching it on a miss
+        """
+        key = f"{digest}-{self._parser_key}"
         try:
-            return pd.read_csv(file_path)
+            # Mark the upload as used for the retention sweep
+            os.utime(file_path)
+        except OSError:
+            pass
+        data_df = self.dataframe_cache.get(key)
+        if data_df is not None:
+            # The file was validated when it was cached, but the row budget may have been lowered since
+            if self.max_rows and len(data_df) > self.max_rows:
+                raise UploadLimitError(f"The CSV file has more than the limit of {self.max_rows:,} rows")
+            return data_df
+
+        with open(file_path, 'rb') as f:
+            data_df = self._read_csv_chunks(f, validate=validate)
+        self._cache_parsed(key, data_df)
+        return data_df
+
+    def _cache_parsed(self, key, data_df):
+        """
+        Cache a parsed DataFrame if it passes validation
+        """
+        # read_csv also returns files that fail validation, but only valid ones are cached
+        try:
+            self.validate_csv_content(data_df)
+        except ValueError:
+            return
+        self.dataframe_cache.set(key, data_df)
+            
+    def _read_csv_chunks(self, stream, sink=None, validate=False):
+        """
+        Parse a binary CSV stream in chunks of chunk_rows rows within the byte and row budgets
+        
+        Args:
+            stream: Binary file object to read from
+            sink: Binary file object receiving a copy of the bytes read
+            validate (bool): Validate the first chunk before reading the rest
+            
+        Returns:
+            pandas.DataFrame: The data from the CSV file
+        """
+        reader = _BudgetedReader(stream, self.max_bytes, sink)
+        header = []
+        chunks = []
+        rows = 0
+        for chunk in self._parse_chunks(reader, header):
+            if validate and not chunks:
+                self.validate_csv_content(chunk)
+            rows += len(chunk)
+            if self.max_rows and rows > self.max_rows:
+                raise UploadLimitError(f"The CSV file has more than the limit of {self.max_rows:,} rows")
+            chunks.append(chunk)
+        if sink is not None:
+            # Copy whatever the parser left unread
+            while reader.read(self.BUFFER_SIZE):
+                pass
+
+        if not chunks:
+            if validate:
+                raise ValueError("The CSV file is empty")
+            return pd.DataFrame(columns=header)
+        if len(chunks) == 1:
+            return chunks[0]
+        return pd.concat(chunks, ignore_index=True)
+            
+    def _parse_chunks(self, reader, header):
+        """
+        Yield the DataFrame chunks of a CSV stream, filling in the header list as it is read
+        """
+        try:
+            # Weblab exports are read with only the columns the analysis uses
+            header.extend(next(csv.reader([reader.peek_line().decode('utf-8-sig')]), []))
+            options = {}
+            if is_weblab_format(header):
+                options['usecols'] = [col for col in header if col in WEBLAB_COLUMNS]
+                options['dtype'] = {col: dtype for col, dtype in WEBLAB_COLUMNS.items() if col in header}
+
+            with pd.read_csv(io.BufferedReader(reader, self.BUFFER_SIZE), chunksize=self.chunk_rows, **options) as parser:
+                for chunk in parser:
+                    yield chunk
+        except UploadLimitError:
+            raise
         except Exception as e:
             raise ValueError(f"Error reading CSV file: {str(e)}")
             
-    def get_field_descriptions(self, df):
+    def get_field_descriptions(self, df, max_descriptions=None):
         """
         Get descriptions for the fields in the DataFrame
-        
+
+        Columns and the values of the 'metric' and 'metric_name' columns are matched exactly,
+        ignoring case and separators, or by a prefix or pattern key of the descriptions file.
+        Names sharing a description are listed under one key, and only the max_descriptions
+        most specific descriptions are kept.
+
         Args:
             df (pandas.DataFrame): The DataFrame containing experiment data
-            
+            max_descriptions (int, optional): Overrides the limit set on the FileHandler
+
         Returns:
             dict: A dictionary mapping field names to their descriptions
         """
-        descriptions = {}
-        for column in df.columns:
-            if column in self.field_descriptions:
-                descriptions[column] = self.field_descriptions[column]
-            
-        # Also include descriptions for any values in the 'metric' column if it exists
-        if 'metric' in df.columns:
-            for metric in df['metric'].unique():
-                if metric in self.field_descriptions:
-                    descriptions[metric] = self.field_descriptions[metric]
-                    
-        return descriptions
+        # Use one version of the descriptions even if they are reloaded meanwhile
+        index = self.description_index
+        names = list(df.columns)
+        for column in ('metric', 'metric_name'):
+            if column in df.columns:
+                names.extend(df[column].dropna().unique())
+        return index.lookup(names, max_descriptions or self.max_descriptions)
         
     def validate_csv_content(self, df):
         """
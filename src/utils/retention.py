@@ -0,0 +1,218 @@
+import os
+import re
+import time
+import shutil
+import threading
+from typing import Dict, Any, List, Optional, Pattern
+
+# Content-addressed files are spread over subdirectories named by the first two characters of
+# their hash, so no directory holds more than a few hundred entries
+SHARD_PATTERN = re.compile(r'^[0-9a-f]{2}$')
+
+
+def shard_path(directory: str, name: str) -> str:
+    """
+    Get the path of a content-addressed file or directory in its shard of directory
+
+    Args:
+        directory (str): The sharded directory
+        name (str): File or directory name starting with a hex hash
+    """
+    return os.path.join(directory, name[:2], name)
+
+
+class RetentionManager:
+    """
+    Keeps directories of uploads and cached files within an age and a size limit
+
+    Every entry of a managed directory (a file or a directory, directly in it or in one of its
+    shards) is evicted once it has not been used for max_age_seconds, and the least recently
+    used entries are evicted while the directory holds more than max_bytes. The last use of an
+    entry is its modification time, which readers refresh with os.utime; access times are not
+    used because most file systems are mounted with noatime or relatime. Entries used within
+    grace_seconds are never evicted, so files of requests and queued jobs still in progress are
+    kept even when the directory is over its size limit.
+
+    Only the entries matching the pattern a directory is managed with are swept, so files put
+    there by anyone but the component writing the directory are never counted or deleted.
+    """
+    def __init__(self, interval_seconds: float = 300, grace_seconds: float = 3600):
+        """
+        Initialize the RetentionManager
+
+        Args:
+            interval_seconds (float): Time between two sweeps of the background thread
+            grace_seconds (float): Entries used more recently than this are never evicted
+        """
+        self.interval_seconds = interval_seconds
+        self.grace_seconds = grace_seconds
+        self._directories = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def manage(self, name: str, directory: str, pattern: Pattern, max_bytes: Optional[int] = None,
+               max_age_seconds: Optional[float] = None):
+        """
+        Add a directory to the sweeps
+
+        Args:
+            name (str): Name of the directory in the statistics
+            directory (str): The directory
+            pattern (re.Pattern): Matches the path, relative to directory and with '/' separators,
+                of the entries owned by the component writing the directory; others are left alone
+            max_bytes (int, optional): Largest total size of the entries kept
+            max_age_seconds (float, optional): Time after its last use an entry is evicted
+        """
+        with self._lock:
+            self._directories[name] = {
+                'directory': directory,
+                'pattern': pattern,
+                'max_bytes': max_bytes,
+                'max_age_seconds': max_age_seconds,
+                'files': 0,
+                'bytes': 0,
+                'evicted_files': 0,
+                'evicted_bytes': 0,
+                'sweeps': 0,
+                'last_sweep_at': None,
+                'last_sweep_seconds': None
+            }
+
+    @staticmethod
+    def _entries(directory: str, pattern: Pattern, prefix: str = '') -> List[Dict[str, Any]]:
+        """
+        List the entries of a directory and of its shards that match pattern, with their size,
+        file count and last use
+        """
+        entries = []
+        try:
+            items = list(os.scandir(directory))
+        except FileNotFoundError:
+            return entries
+        for item in items:
+            try:
+                if item.is_dir(follow_symlinks=False) and SHARD_PATTERN.match(item.name):
+                    entries.extend(RetentionManager._entries(item.path, pattern, f"{prefix}{item.name}/"))
+                    continue
+                if not pattern.match(f"{prefix}{item.name}"):
+                    continue
+                used_at = item.stat(follow_symlinks=False).st_mtime
+                if item.is_dir(follow_symlinks=False):
+                    files = [os.path.join(root, f) for root, _, names in os.walk(item.path) for f in names]
+                    size = sum(os.path.getsize(f) for f in files)
+                    count = len(files)
+                else:
+                    size = item.stat(follow_symlinks=False).st_size
+                    count = 1
+            except FileNotFoundError:
+                # Removed by another worker's sweep or replaced meanwhile
+                continue
+            entries.append({'path': item.path, 'is_dir': item.is_dir(follow_symlinks=False),
+                            'bytes': size, 'files': count, 'used_at': used_at})
+        return entries
+
+    @staticmethod
+    def _evict(entry: Dict[str, Any]) -> bool:
+        try:
+            if entry['is_dir']:
+                shutil.rmtree(entry['path'])
+            else:
+                os.remove(entry['path'])
+            return True
+        except FileNotFoundError:
+            return False
+
+    def sweep(self) -> Dict[str, Dict[str, int]]:
+        """
+        Evict the expired and least recently used entries of every managed directory
+
+        Returns:
+            Dict[str, Dict[str, int]]: For each directory, the number of files and bytes
+            'evicted_files', 'evicted_bytes' and still held ('files', 'bytes')
+        """
+        results = {}
+        for name, managed in list(self._directories.items()):
+            start = time.perf_counter()
+            now = time.time()
+            entries = sorted(self._entries(managed['directory'], managed['pattern']), key=lambda entry: entry['used_at'])
+            total = sum(entry['bytes'] for entry in entries)
+            kept_files = sum(entry['files'] for entry in entries)
+            evicted_files = evicted_bytes = 0
+            for entry in entries:
+                age = now - entry['used_at']
+                if age < self.grace_seconds:
+                    # Sorted by last use, so every remaining entry is in use as well
+                    break
+                expired = managed['max_age_seconds'] is not None and age > managed['max_age_seconds']
+                oversized = managed['max_bytes'] is not None and total > managed['max_bytes']
+                if not expired and not oversized:
+                    break
+                if self._evict(entry):
+                    evicted_files += entry['files']
+                    evicted_bytes += entry['bytes']
+                total -= entry['bytes']
+                kept_files -= entry['files']
+
+            with self._lock:
+                managed['files'] = kept_files
+                managed['bytes'] = total
+                managed['evicted_files'] += evicted_files
+                managed['evicted_bytes'] += evicted_bytes
+                managed['sweeps'] += 1
+                managed['last_sweep_at'] = time.time()
+                managed['last_sweep_seconds'] = time.perf_counter() - start
+            if evicted_files:
+                print(f"Evicted {evicted_files} files ({evicted_bytes:,} bytes) from {name}, "
+                      f"{kept_files} files ({total:,} bytes) kept")
+            results[name] = {'files': kept_files, 'bytes': total,
+                             'evicted_files': evicted_files, 'evicted_bytes': evicted_bytes}
+        return results
+
+    def start(self):
+        """
+        Start the sweeper thread of this process, if it is not running yet
+
+        Safe to call on every request: after a fork (e.g. gunicorn --preload) the child
+        process starts its own thread.
+        """
+        if self.interval_seconds <= 0:
+            return
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='retention-sweeper', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the sweeper thread
+        """
+        self._stop.set()
+
+    def _run(self):
+        # Sweep once right away, so a restart after a long downtime cleans up immediately
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error sweeping managed directories: {str(e)}")
+            if self._stop.wait(self.interval_seconds):
+                break
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the files and bytes held and evicted in each managed directory, as of the last sweep
+        """
+        with self._lock:
+            return {
+                'interval_seconds': self.interval_seconds,
+                'grace_seconds': self.grace_seconds,
+                'directories': {name: {key: value for key, value in managed.items() if key != 'pattern'}
+                                for name, managed in self._directories.items()}
+            }
@@ -0,0 +1,57 @@
+"""
+Schema of the weblab-style wide experiment export
+
+The export has ~209 columns, but an analysis only needs the per metric x segment impact,
+interval, probability and sample sizes listed here. Reading just these columns with explicit
+dtypes avoids parsing and type-inferring the other ~190 columns.
+"""
+
+# Columns that identify a weblab export
+WEBLAB_REQUIRED_COLUMNS = [
+    'metric_name',
+    'dimensions_string',
+    'treatment_name_a',
+    'treatment_name_b',
+    'overall_percent_impact',
+]
+
+# Columns read from a weblab export and their dtypes
+WEBLAB_COLUMNS = {
+    'weblab_id': str,
+    'analysis_start_date': str,
+    'analysis_end_date': str,
+    'metric_name': str,
+    'dimensions_string': str,
+    'segmentation_name': str,
+    'segment_value': str,
+    'treatment_name_a': str,
+    'treatment_name_b': str,
+    'metric_count_a': 'float64',
+    'metric_count_b': 'float64',
+    'customer_count_a': 'float64',
+    'customer_count_b': 'float64',
+    'metric_sample_mean_a': 'float64',
+    'metric_sample_mean_b': 'float64',
+    'metric_p_value': 'float64',
+    'overall_percent_impact': 'float64',
+    'overall_percent_ci_lower': 'float64',
+    'overall_percent_ci_upper': 'float64',
+    'overall_annualized_impact': 'float64',
+    'overall_annualized_ci_lower': 'float64',
+    'overall_annualized_ci_upper': 'float64',
+    'overall_posterior_probability_positive': 'float64',
+}
+
+
+def is_weblab_format(columns) -> bool:
+    """
+    Check whether a set of column names is a weblab export
+
+    Args:
+        columns: Column names of the file or DataFrame
+
+    Returns:
+        bool: True if all the identifying weblab columns are present
+    """
+    columns = set(columns)
+    return all(col in columns for col in WEBLAB_REQUIRED_COLUMNS)